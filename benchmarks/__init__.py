@@ -0,0 +1 @@
+# benchmarks - 整机打印流程的性能基准 (模拟 ESP32 + 离屏投影 + 模拟光机)
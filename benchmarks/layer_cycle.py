@@ -0,0 +1,230 @@
+# benchmarks/layer_cycle.py
+# 功能：整机层循环基准。用真实的 PrintWorker 打印合成切片，外设全部替换为替身：
+# 模拟 ESP32 (esp32_sim，经 localhost TCP)、离屏投影进程、模拟光机。
+#
+#   python -m benchmarks.layer_cycle                              # 全部用例 (100/1k/10k 层 × 1080p/4K，耗时较长)
+#   python -m benchmarks.layer_cycle --layers 100 --out r.json    # 只跑部分用例
+#   python -m benchmarks.layer_cycle --layers 100 --baseline benchmarks/baseline.json
+#
+# 每个用例在独立子进程中运行，峰值内存互不影响。
+# 曝光与运动在虚拟时钟下按 --speed 倍速压缩；layers_per_hour 按实机时间折算
+# (显示/LED/空闲等 PC 端耗时不缩放，曝光与运动乘回倍速)，wall_layers_per_hour 为本次实际运行速度。
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path: sys.path.insert(0, ROOT_DIR)
+
+RESOLUTIONS = {'1080p': (1920, 1080), '4k': (3840, 2160)}
+LAYER_COUNTS = (100, 1000, 10000)
+UNIQUE_SLICES = 16  # 合成切片的不同图案数，按层循环使用 (控制生成时间与磁盘占用)
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'kkdlp_bench')
+
+# 比较基线时各指标的方向：1 = 越大越好，-1 = 越小越好
+METRICS = {
+    'layers_per_hour': 1,
+    'startup_to_first_exposure_s': -1,
+    'per_layer_ms.display': -1,
+    'per_layer_ms.led': -1,
+    'per_layer_ms.idle': -1,
+    'per_layer_ms.motion': -1,
+    'peak_rss_mb': -1,
+}
+
+
+# --- 1. 合成切片 ---
+def make_slices_zip(layers, resolution):
+    """生成 (或复用缓存的) layers 层切片压缩包：圆柱 + 逐层收缩的圆锥截面"""
+    from PIL import Image, ImageDraw
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"slices_{resolution}_{layers}.zip")
+    if os.path.exists(path): return path
+    width, height = RESOLUTIONS[resolution]
+    frames = []
+    for k in range(UNIQUE_SLICES):
+        img = Image.new('L', (width, height), 0); draw = ImageDraw.Draw(img)
+        r = height // 6; cone = int(height * 0.3 * (1 - k / UNIQUE_SLICES)) + 1
+        draw.ellipse((width // 4 - r, height // 2 - r, width // 4 + r, height // 2 + r), fill=255)
+        draw.ellipse((3 * width // 4 - cone, height // 2 - cone, 3 * width // 4 + cone, height // 2 + cone), fill=255)
+        tmp = os.path.join(CACHE_DIR, f"_frame_{k}.png"); img.save(tmp)
+        with open(tmp, 'rb') as f: frames.append(f.read())
+        os.remove(tmp)
+    partial = path + ".part"
+    with zipfile.ZipFile(partial, 'w', zipfile.ZIP_STORED) as zf:  # PNG 已压缩
+        for i in range(layers): zf.writestr(f"{i + 1}.png", frames[i * UNIQUE_SLICES // layers])
+    os.replace(partial, path)
+    return path
+
+
+def benchmark_params(zip_path, temp_dir, host, port, speed):
+    """与 MainWindow.get_params 相同的键，取 PrintConfig / 界面默认值；曝光时间按倍速压缩"""
+    from guitest import PrintConfig as C, default_print_params
+    return default_print_params(esp32_ip=host, esp32_port=port, zip_path=zip_path, temp_dir=temp_dir, monitor_index=0,
+                                first_layer_expo=C.FIRST_LAYER_EXPOSURE_TIME_S / speed,
+                                normal_expo=C.NORMAL_EXPOSURE_TIME_S / speed,
+                                trace_dir=None, telemetry=False, telemetry_level_ms=0, metrics_port=None,
+                                journal_dir=os.path.join(temp_dir, "journals"))
+
+
+def peak_rss_mb(children=False):
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+# --- 2. 单个用例 (在子进程中运行) ---
+def run_case(layers, resolution, speed, uia_latency_s, verbose=False):
+    import shutil
+    import guitest
+    from esp32_sim import SimConfig, SimulatedESP32
+    from benchmarks.standins import PhaseRecorder, make_standins
+
+    zip_path = make_slices_zip(layers, resolution)
+    recorder = PhaseRecorder()
+    for name, cls in make_standins(recorder, uia_latency_s).items(): setattr(guitest, name, cls)
+    temp_dir = tempfile.mkdtemp(prefix='kkdlp_bench_')
+    errors = []; log_lines = [0]
+
+    def on_log(msg):
+        log_lines[0] += 1
+        if verbose: print(msg)
+
+    sim = SimulatedESP32(SimConfig(speed=speed, port=0))
+    host, port = sim.start()
+    try:
+        worker = guitest.PrintWorker(benchmark_params(zip_path, temp_dir, host, port, speed))
+        worker.log_message.connect(on_log); worker.error_occurred.connect(errors.append)
+        recorder.run_started = time.perf_counter()
+        worker.run()  # 直接在本线程运行 (信号为直接连接，无需 Qt 事件循环)
+        finished = time.perf_counter()
+    finally:
+        sim.stop(); shutil.rmtree(temp_dir, ignore_errors=True)
+    recorder.collect_scheduler()
+    if errors: raise RuntimeError(errors[0])
+
+    loop_s = finished - recorder.loop_started
+    scaled_s = recorder.totals['exposure'] + recorder.totals['motion']
+    projected_s = loop_s + scaled_s * (speed - 1)  # 曝光与运动还原为实机时间
+    per_layer_ms = {phase: recorder.totals[phase] / layers * 1000 for phase in PhaseRecorder.PHASES}
+    for phase in ('exposure', 'motion'): per_layer_ms[phase] *= speed
+    return {
+        'layers': layers, 'resolution': resolution, 'speed': speed,
+        'layers_per_hour': layers / projected_s * 3600,
+        'wall_layers_per_hour': layers / loop_s * 3600,
+        'wall_s': finished - recorder.run_started,
+        'startup_to_first_exposure_s': recorder.first_exposure_at - recorder.run_started,
+        'per_layer_ms': per_layer_ms,
+        'peak_rss_mb': peak_rss_mb(),
+        'projector_peak_rss_mb': peak_rss_mb(children=True),
+        'log_lines': log_lines[0],
+    }
+
+
+def run_case_subprocess(layers, resolution, args):
+    fd, out = tempfile.mkstemp(suffix='.json'); os.close(fd)
+    cmd = [sys.executable, '-m', 'benchmarks.layer_cycle', '--case', f"{layers}:{resolution}", '--out', out,
+           '--speed', str(args.speed), '--uia-latency-ms', str(args.uia_latency_ms)]
+    if args.verbose: cmd.append('--verbose')
+    try:
+        proc = subprocess.run(cmd, cwd=ROOT_DIR, stdout=None if args.verbose else subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0: return {'layers': layers, 'resolution': resolution, 'error': proc.stderr.strip()[-2000:]}
+        with open(out, encoding='utf-8') as f: return json.load(f)
+    finally:
+        os.remove(out)
+
+
+# --- 3. 基线比较 ---
+def _metric(result, key):
+    value = result
+    for part in key.split('.'):
+        if not isinstance(value, dict) or part not in value: return None
+        value = value[part]
+    return value
+
+
+def compare(results, baseline, threshold):
+    """打印与基线的差异，返回退化的 (用例, 指标, 变化比例) 列表"""
+    base = {(r['layers'], r['resolution']): r for r in baseline.get('results', []) if 'error' not in r}
+    regressions = []
+    for result in results:
+        key = (result['layers'], result['resolution']); old = base.get(key)
+        if old is None or 'error' in result: continue
+        print(f"\n{result['layers']} 层 @ {result['resolution']}:")
+        for metric, direction in METRICS.items():
+            new_v, old_v = _metric(result, metric), _metric(old, metric)
+            if new_v is None or not old_v: continue
+            change = (new_v - old_v) / old_v
+            worse = -change * direction > threshold
+            print(f"  {metric:32s} {old_v:12.2f} -> {new_v:12.2f}  {change:+7.1%}{'  <-- 退化' if worse else ''}")
+            if worse: regressions.append((key, metric, change))
+    return regressions
+
+
+def print_summary(results):
+    print(f"\n{'用例':>16s} {'层/小时':>10s} {'首次曝光':>8s} {'显示':>7s} {'LED':>7s} {'空闲':>7s} {'运动':>8s} {'RSS':>7s}")
+    for r in results:
+        name = f"{r['layers']}@{r['resolution']}"
+        if 'error' in r: print(f"{name:>16s}  失败: {r['error'].splitlines()[-1] if r['error'] else '?'}"); continue
+        ms = r['per_layer_ms']; rss = r['peak_rss_mb']
+        print(f"{name:>16s} {r['layers_per_hour']:10.0f} {r['startup_to_first_exposure_s']:7.2f}s "
+              f"{ms['display']:5.1f}ms {ms['led']:5.0f}ms {ms['idle']:5.1f}ms {ms['motion'] / 1000:6.2f}s "
+              f"{'-' if rss is None else f'{rss:.0f}M':>7s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="整机层循环基准 (模拟 ESP32 + 离屏投影 + 模拟光机)")
+    parser.add_argument('--layers', default=",".join(map(str, LAYER_COUNTS)), help="逗号分隔的层数")
+    parser.add_argument('--resolutions', default=",".join(RESOLUTIONS), help="逗号分隔: 1080p,4k")
+    parser.add_argument('--speed', type=float, default=20.0, help="虚拟时钟倍速 (曝光与运动按此压缩)")
+    parser.add_argument('--uia-latency-ms', type=float, default=20.0, help="模拟光机每次 UIA 操作的延迟")
+    parser.add_argument('--out', help="结果 JSON 输出路径")
+    parser.add_argument('--baseline', help="与已保存的结果 JSON 比较，出现退化时返回码为 1")
+    parser.add_argument('--threshold', type=float, default=0.05, help="判定退化的相对变化 (默认 5%%)")
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--case', help=argparse.SUPPRESS)  # 内部：在本进程中运行单个用例 "层数:分辨率"
+    args = parser.parse_args()
+
+    if args.case:
+        layers, resolution = args.case.split(':')
+        result = run_case(int(layers), resolution, args.speed, args.uia_latency_ms / 1000, args.verbose)
+        with open(args.out, 'w', encoding='utf-8') as f: json.dump(result, f)
+        return 0
+
+    resolutions = [r.strip().lower() for r in args.resolutions.split(',')]
+    unknown = [r for r in resolutions if r not in RESOLUTIONS]
+    if unknown: parser.error(f"未知分辨率: {unknown}")
+    results = []
+    for layers in (int(n) for n in args.layers.split(',')):
+        for resolution in resolutions:
+            print(f"运行 {layers} 层 @ {resolution} ...", flush=True)
+            results.append(run_case_subprocess(layers, resolution, args))
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'platform': platform.platform(), 'speed': args.speed, 'uia_latency_ms': args.uia_latency_ms,
+              'results': results}
+    print_summary(results)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f: json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已写入 {args.out}")
+    status = 1 if any('error' in r for r in results) else 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f: baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\n{len(regressions)} 项指标退化超过 {args.threshold:.0%}。" if regressions else "\n未发现超过阈值的退化。")
+        if regressions: status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
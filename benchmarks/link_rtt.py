@@ -0,0 +1,107 @@
+# benchmarks/link_rtt.py
+# 功能：比较 ESP32 各链路 (Wi-Fi TCP / 串口) 的指令往返时间。
+# 每条链路依次发送 PING (固件高优先级通道)，分别在空闲时与层间运动进行中测量，统计分位数与最大值。
+#
+#   python -m benchmarks.link_rtt                                        # 模拟 ESP32：localhost TCP + 伪终端串口 (仅 Linux / macOS)
+#   python -m benchmarks.link_rtt --host 10.10.17.102 --serial COM5     # 实机
+#   python -m benchmarks.link_rtt --probes 2000 --out rtt.json
+#
+# 模拟器的两条链路都在本机，结果只反映 PC 端协议栈与线程开销；Wi-Fi 的延迟尖峰需在实机上测量。
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path: sys.path.insert(0, ROOT_DIR)
+
+from motion_client import AsyncMotionClient
+from motion_transport import SERIAL_BAUD, TcpTransport, SerialTransport, measure_rtt
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    result = {f"p{p:g}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in PERCENTILES}
+    result.update(mean=statistics.fmean(ordered), max=ordered[-1], stdev=statistics.pstdev(ordered), samples=len(ordered))
+    return result
+
+
+async def bench_transport(transport, probes, motion_layers):
+    """空闲时测 probes 次；再在 motion_layers 次 NEXT_LAYER 进行中持续测量"""
+    client = AsyncMotionClient(None, None, connect_timeout=5.0, transports=[transport])
+    try:
+        await client.connect()
+        await measure_rtt(client, 20)  # 预热
+        result = {'link': transport.name, 'binary': client.binary, 'idle': summarize(await measure_rtt(client, probes))}
+        if motion_layers:
+            busy = []
+            for _ in range(motion_layers):
+                motion = asyncio.ensure_future(client.request("NEXT_LAYER", 120.0))
+                while not motion.done(): busy += await measure_rtt(client, 10)
+                success, response = motion.result()
+                if not success: raise RuntimeError(f"NEXT_LAYER 失败: {response}")
+            result['moving'] = summarize(busy)
+        return result
+    except Exception as e:
+        return {'link': transport.name, 'error': str(e) or type(e).__name__}
+    finally:
+        await client.close()
+
+
+def print_summary(results):
+    print(f"\n{'链路':>28s} {'阶段':>6s} " + " ".join(f"{f'p{p:g}':>8s}" for p in PERCENTILES) + f" {'最大':>8s} {'样本':>6s}")
+    for r in results:
+        if 'error' in r: print(f"{r['link']:>28s}  失败: {r['error']}"); continue
+        for phase in ('idle', 'moving'):
+            if phase not in r: continue
+            s = r[phase]
+            print(f"{r['link']:>28s} {phase:>6s} " + " ".join(f"{s[f'p{p:g}']:6.2f}ms" for p in PERCENTILES)
+                  + f" {s['max']:6.2f}ms {s['samples']:6d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESP32 链路往返时间基准 (TCP / 串口)")
+    parser.add_argument('--host', help="ESP32 IP；不指定时启动模拟 ESP32")
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--serial', help="串口 (如 COM5、/dev/ttyUSB0)；模拟时自动使用伪终端")
+    parser.add_argument('--baud', type=int, default=SERIAL_BAUD)
+    parser.add_argument('--probes', type=int, default=1000, help="空闲时每条链路的 PING 次数")
+    parser.add_argument('--motion-layers', type=int, default=3, help="运动中测量时执行的 NEXT_LAYER 次数 (0 = 不测)")
+    parser.add_argument('--speed', type=float, default=5.0, help="模拟器虚拟时钟倍速")
+    parser.add_argument('--out', help="结果 JSON 输出路径")
+    args = parser.parse_args()
+
+    sim = None
+    if args.host is None:
+        from esp32_sim import SimConfig, SimulatedESP32
+        sim = SimulatedESP32(SimConfig(speed=args.speed, port=0, serial=hasattr(os, 'openpty')))
+        args.host, args.port = sim.start()
+        args.serial = args.serial or sim.serial_port
+        print(f"模拟 ESP32: {args.host}:{args.port}" + (f"，串口 {sim.serial_port}" if sim.serial_port else ""))
+    transports = [TcpTransport(args.host, args.port)]
+    if args.serial: transports.append(SerialTransport(args.serial, args.baud))
+    try:
+        results = []
+        for transport in transports:  # 逐条测量，互不干扰
+            print(f"测量 {transport.name} ...", flush=True)
+            results.append(asyncio.run(bench_transport(transport, args.probes, args.motion_layers)))
+    finally:
+        if sim: sim.stop()
+    print_summary(results)
+    if args.out:
+        report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                  'platform': platform.platform(), 'simulated': sim is not None, 'results': results}
+        with open(args.out, 'w', encoding='utf-8') as f: json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已写入 {args.out}")
+    return 1 if any('error' in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# benchmarks/standins.py
+# 功能：PrintWorker 使用的外设替身与分阶段计时。
+# - OffscreenProjector: 真实的 projector_view.py 子进程，以 Qt offscreen 平台运行 (不需要第二块屏幕)
+# - SimulatedLightEngine: 真实的 LightEngineControl 逻辑，UIA 控件换成带固定延迟的替身
+# - PhaseRecorder: 累计各阶段耗时 (显示、LED、曝光、运动、空闲)
+# 替身只替换最底层的 I/O，PrintWorker 与各控制类的代码路径保持不变。
+
+import os
+import socket
+import time
+
+import guitest
+from layer_pipeline import LayerScheduler
+
+
+class PhaseRecorder:
+    PHASES = ('display', 'preload', 'led', 'led_arm', 'exposure', 'motion', 'prepare', 'idle')
+
+    def __init__(self):
+        self.totals = dict.fromkeys(self.PHASES, 0.0)
+        self.counts = dict.fromkeys(self.PHASES, 0)
+        self.run_started = None
+        self.first_exposure_at = None
+        self.loop_started = None
+        self.exposure_started = None
+        self.scheduler = None
+
+    def add(self, phase, seconds):
+        self.totals[phase] += seconds; self.counts[phase] += 1
+
+    def timed(self, phase, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def led_on_done(self):
+        now = time.perf_counter()
+        self.exposure_started = now
+        if self.first_exposure_at is None: self.first_exposure_at = now
+
+    def exposure_ended(self):
+        if self.exposure_started is None: return
+        self.add('exposure', time.perf_counter() - self.exposure_started); self.exposure_started = None
+
+    def collect_scheduler(self):
+        """层间运动 / 重叠准备 / 关键路径空闲取自 LayerScheduler 的逐层统计"""
+        if self.scheduler is None: return
+        for timing in self.scheduler.timings:
+            self.add('motion', timing.motion_s); self.add('prepare', timing.prepare_s); self.add('idle', timing.idle_s)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0)); return s.getsockname()[1]
+
+
+def make_standins(recorder, uia_latency_s=0.02):
+    """返回 {名称: 替身类}，用于替换 guitest 模块中的同名类"""
+
+    class OffscreenProjector(guitest.ProjectorProcessManager):
+        def __init__(self):
+            super().__init__(monitor_index=0, port=free_port())
+
+        def start(self):
+            os.environ['QT_QPA_PLATFORM'] = 'offscreen'  # 子进程继承环境变量
+            return super().start()
+
+        def present(self):
+            return recorder.timed('display', super().present)
+
+        def show_black(self):
+            recorder.exposure_ended()
+            return recorder.timed('display', super().show_black)
+
+        def preload_image(self, image_path):
+            return recorder.timed('preload', super().preload_image, image_path)
+
+    class _Control:
+        """UIA 控件替身：每次操作固定延迟，模拟跨进程 UIA 调用"""
+
+        def __init__(self): self.clicks = 0; self.selected = None
+        def is_enabled(self): return True
+        def set_focus(self): time.sleep(uia_latency_s)
+        def select(self, state): time.sleep(uia_latency_s); self.selected = state
+        def click(self): time.sleep(uia_latency_s); self.clicks += 1
+
+    class SimulatedLightEngine(guitest.LightEngineControl):
+        def connect(self, exe_path, title="Full-HD UV LE Controller v2.1", timeout=10):
+            self.main_win = _Control(); self.led_combo = _Control(); self.set_button = _Control()
+            self._is_connected = True
+            return True, "光引擎连接成功 (模拟)"
+
+        def arm_led_on(self):
+            return recorder.timed('led_arm', super().arm_led_on)
+
+        def led_on(self):
+            result = recorder.timed('led', super().led_on)
+            recorder.led_on_done()
+            return result
+
+        def led_off(self):
+            return recorder.timed('led', super().led_off)
+
+    class RecordingScheduler(LayerScheduler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs); recorder.scheduler = self
+            recorder.loop_started = time.perf_counter()
+
+    return {'ProjectorProcessManager': OffscreenProjector, 'LightEngineControl': SimulatedLightEngine,
+            'LayerScheduler': RecordingScheduler}
@@ -1,20 +1,44 @@
-# main.py - v2.5.2 (DIR 建立时间增加到 50ms)
+# main.py - v3.9.0 (串口链路：USB-UART 转接板接 UART1，与 TCP 共用指令处理，固定二进制帧)
 
 import machine
 import time
 import uasyncio
 import sh1106
 import sys
+import struct
+import math
+try:
+    import esp32; PCNT = esp32.PCNT  # 硬件脉冲计数器 (MicroPython 1.24+)
+except (ImportError, AttributeError): PCNT = None
 
-# --- 1. 自定义异步队列类 ---
+# --- 1. 自定义异步队列类 (固定容量环形缓冲) ---
+# 出入队 O(1)；队列满时 try_put 立即失败 (回复 Busy)，读取协程不暂停，高优先级指令随时可达
 class AsyncQueue:
-    def __init__(self): self.items = []; self.event = uasyncio.Event()
-    async def put(self, item): self.items.append(item); self.event.set()
+    def __init__(self, capacity=16):
+        self.buf = [None] * capacity; self.capacity = capacity; self.head = 0; self.count = 0
+        self.not_empty = uasyncio.Event()
+    def __len__(self): return self.count
+    def try_put(self, item):
+        if self.count == self.capacity: return False
+        self.buf[(self.head + self.count) % self.capacity] = item; self.count += 1
+        self.not_empty.set()
+        return True
     async def get(self):
-        while not self.items: await self.event.wait()
-        item = self.items.pop(0)
-        if not self.items: self.event.clear()
+        while self.count == 0: await self.not_empty.wait()
+        item = self.buf[self.head]; self.buf[self.head] = None
+        self.head = (self.head + 1) % self.capacity; self.count -= 1
+        if self.count == 0: self.not_empty.clear()
         return item
+    def remove_if(self, pred):
+        # 取消/停止时使用，非热路径：按顺序重排保留的条目
+        kept = []; removed = []
+        for i in range(self.count):
+            j = (self.head + i) % self.capacity; item = self.buf[j]; self.buf[j] = None
+            (removed if pred(item) else kept).append(item)
+        self.head = 0; self.count = len(kept)
+        for i, item in enumerate(kept): self.buf[i] = item
+        if self.count == 0: self.not_empty.clear()
+        return removed
 
 # --- 2. 硬件设定区 (已移除 ENA 引脚) ---
 Z_STEP_PIN, Z_DIR_PIN = 26, 25
@@ -23,6 +47,14 @@ B_STEP_PIN, B_DIR_PIN = 19, 18
 C_STEP_PIN, C_DIR_PIN = 17, 16
 A_LIMIT_HOME_PIN = 32
 A_LIMIT_END_PIN = 33
+LEVEL_SENSOR_PIN = 34
+# 串口链路 (USB-UART 转接板，如 CP2102)：SERIAL_UART_ID = None 表示不启用
+SERIAL_UART_ID = 1; SERIAL_TX_PIN = 4; SERIAL_RX_PIN = 13; SERIAL_BAUD = 921600
+# STEP 引脚同时由 PWM (LEDC) 输出并接入 PCNT 计数。ESP-IDF 配置 PCNT 时把引脚设为仅输入 (断开 LEDC 输出)，
+# 配置 LEDC 时又设为仅输出 (关闭输入缓冲，PCNT 读不到脉冲)；因此先建 PCNT、再接 PWM，最后在 IO_MUX 中重新打开输入使能
+IO_MUX_BASE = 0x3FF49000; IO_MUX_FUN_IE = 1 << 9
+IO_MUX_OFFSET = {2: 0x40, 4: 0x48, 5: 0x6C, 12: 0x34, 13: 0x38, 14: 0x30, 15: 0x3C, 16: 0x4C, 17: 0x50, 18: 0x70,
+                 19: 0x74, 21: 0x7C, 22: 0x80, 23: 0x8C, 25: 0x24, 26: 0x28, 27: 0x2C, 32: 0x1C, 33: 0x20}
 
 # --- 3. OLED 显示设定 ---
 I2C_SCL_PIN = 22; I2C_SDA_PIN = 21; OLED_WIDTH = 128; OLED_HEIGHT = 64
@@ -34,17 +66,158 @@ try:
     OLED_AVAILABLE = True
 except Exception as e: print(f"OLED Init Failed: {e}")
 
+# 显示模型：update_display 只改模型并置脏标志，由 display_task 限速合并后只重绘变化的行，
+# 调用方 (运动序列、指令处理) 从不等待 I2C 总线
+DISPLAY_LINE_Y = (0, 10, 20, 30)
+DISPLAY_LINE_CHARS = OLED_WIDTH // 8
+DISPLAY_MIN_INTERVAL_MS = 200
+display_lines = ["", "", "", ""]; display_shown = [None, None, None, None]
+display_dirty = uasyncio.Event()
+
 def update_display(line1="", line2="", line3="", line4=""):
-    if OLED_AVAILABLE:
-        try:
-            display.fill(0); display.text(line1, 0, 0); display.text(line2, 0, 10); display.text(line3, 0, 20); display.text(line4, 0, 30); display.show()
-        except OSError as e: print(f"OLED Update Failed: {e}. Operation will continue.")
+    if not OLED_AVAILABLE: return
+    changed = False
+    for i, text in enumerate((line1, line2, line3, line4)):
+        text = text[:DISPLAY_LINE_CHARS]
+        if display_lines[i] != text: display_lines[i] = text; changed = True
+    if changed: display_dirty.set()
+
+def flush_display():
+    # 只清除并重绘内容有变化的行；驱动支持按页局部刷新时只发送脏页
+    try:
+        for i, y in enumerate(DISPLAY_LINE_Y):
+            if display_lines[i] == display_shown[i]: continue
+            display.fill_rect(0, y, OLED_WIDTH, 8, 0); display.text(display_lines[i], 0, y); display_shown[i] = display_lines[i]
+        try: display.show(False)
+        except TypeError: display.show()
+    except OSError as e: print(f"OLED Update Failed: {e}. Operation will continue.")
+
+async def display_task():
+    last = time.ticks_ms()
+    while True:
+        await display_dirty.wait()
+        # 限速：距上次刷新不足间隔时先等待，期间的多次更新合并为一次
+        wait = DISPLAY_MIN_INTERVAL_MS - time.ticks_diff(time.ticks_ms(), last)
+        if wait > 0: await uasyncio.sleep_ms(wait)
+        display_dirty.clear()
+        flush_display(); last = time.ticks_ms()
+
+# --- 4a. 加减速斜坡表 ---
+# 运动被切成 RAMP_SLICE_MS 的时间片，每片输出整数个脉冲，PWM 频率 = 脉冲数 * (1000 / RAMP_SLICE_MS)，
+# 因此各片脉冲数之和严格等于目标步数 (位置按理想曲线取整后逐片做差，误差不累积)。
+# 加速段只保存一份表 (减速段逆序复用)，巡航段逐片即时计算。
+RAMP_SLICE_MS = 10
+RAMP_HZ_PER_PULSE = 1000 // RAMP_SLICE_MS
+RAMP_MAX_SLICES = 200      # 单段加速最多 2s，超出则降低巡航速度
+MAX_STEP_FREQ = 40000
+COUNT_POLL_MS = 200       # PCNT 为 16 位：最高频率下 200ms 输出 8000 脉冲，远小于回绕的 32767
+PROFILE_TRAPEZOID, PROFILE_SCURVE = 0, 1
+
+def build_ramp(total_steps, v_max, accel, profile):
+    """v_max: 步/秒, accel: 步/秒² (S 曲线为平均加速度)。返回 (加速段每片脉冲数列表, 巡航频率)，减速段为加速段的逆序。"""
+    v_peak = min(v_max, math.sqrt(accel * total_steps), accel * RAMP_MAX_SLICES * RAMP_SLICE_MS / 1000)
+    cruise_hz = int(v_peak)
+    if cruise_hz < RAMP_HZ_PER_PULSE: return [], max(1, cruise_hz)  # 低于一片一个脉冲，无需斜坡
+    t_acc = cruise_hz / accel; n = math.ceil(t_acc * 1000 / RAMP_SLICE_MS)
+    ramp = []; prev = 0
+    for k in range(1, n + 1):
+        t = k * RAMP_SLICE_MS / 1000
+        if t > t_acc: t = t_acc
+        if profile == PROFILE_SCURVE:  # v = V(1-cos(pi t/T))/2
+            s = cruise_hz / 2 * (t - t_acc / math.pi * math.sin(math.pi * t / t_acc))
+        else:
+            s = accel * t * t / 2
+        pos = int(s + 0.5); ramp.append(pos - prev); prev = pos
+    excess = 2 * prev - total_steps   # 取整可能使加减速段超出总步数
+    while excess > 0 and ramp:
+        cut = min(ramp[-1], (excess + 1) // 2); ramp[-1] -= cut; excess -= 2 * cut
+        if ramp[-1] == 0: ramp.pop()
+    return ramp, cruise_hz
+
+def ramp_segments(total_steps, ramp, cruise_hz):
+    """按时间顺序生成 (每片脉冲数, 片数)；巡航段把剩余脉冲按 Bresenham 均匀分到各片，相同脉冲数的连续片合并为一段"""
+    for pulses in ramp: yield pulses, 1
+    cruise = total_steps - 2 * sum(ramp)
+    if cruise > 0:
+        m = (cruise * RAMP_HZ_PER_PULSE + cruise_hz - 1) // cruise_hz
+        run_pulses = None; run = 0
+        for i in range(m):
+            pulses = (i + 1) * cruise // m - i * cruise // m
+            if pulses == run_pulses: run += 1; continue
+            if run: yield run_pulses, run
+            run_pulses = pulses; run = 1
+        yield run_pulses, run
+    for i in range(len(ramp) - 1, -1, -1): yield ramp[i], 1
 
 # --- 4. 步进马达驱动类 (已移除 ENA 逻辑) ---
 class Stepper:
-    def __init__(self, step_pin_num, dir_pin_num, is_dm_driver=False):
+    def __init__(self, step_pin_num, dir_pin_num, is_dm_driver=False, pcnt_id=None):
         self.step_pin_num = step_pin_num; self.step = machine.Pin(self.step_pin_num, machine.Pin.OUT); self.dir = machine.Pin(dir_pin_num, machine.Pin.OUT); self.use_ena = not is_dm_driver
-        self.steps_per_mm = 200.0; self.pwm = machine.PWM(self.step, freq=1, duty=0); self.dir.value(0); self.disable()
+        self.steps_per_mm = 200.0; self.dir.value(0); self.dir_state = 0; self.disable()
+        # 绝对位置寄存器 (步)，由实际输出的脉冲累计；STEP 引脚同时接入 PCNT 计数，无 PCNT 时按 ticks_us 估算
+        self.position_steps = 0; self.counter = None; self.seg_start_us = 0; self.count_rest = 0
+        # 限位中断状态 (move_until_trigger)
+        self.limit_hit = False; self.limit_ticks_us = 0; self.limit_count = 0; self.limit_overshoot_steps = 0
+        self.limit_flag = uasyncio.ThreadSafeFlag(); self._on_limit_cb = self._on_limit  # 预先绑定，ISR 中不分配内存
+        if PCNT is not None and pcnt_id is not None:
+            if step_pin_num not in IO_MUX_OFFSET: print(f"PCNT {pcnt_id}: no IO_MUX entry for pin {step_pin_num}. Using ticks_us estimate.")
+            else:
+                try:
+                    self.counter = PCNT(pcnt_id, pin=self.step, rising=PCNT.INCREMENT); self.counter.start()
+                except Exception as e: print(f"PCNT {pcnt_id} Init Failed: {e}. Using ticks_us estimate."); self.counter = None
+        # PWM 在 PCNT 之后接入 (重新把引脚设为输出并连到 LEDC)，再打开输入使能供 PCNT 读取 (见 IO_MUX_OFFSET)
+        self.pwm = machine.PWM(self.step, freq=1, duty=0)
+        if self.counter is not None:
+            reg = IO_MUX_BASE + IO_MUX_OFFSET[step_pin_num]; machine.mem32[reg] = machine.mem32[reg] | IO_MUX_FUN_IE
+        # 默认加速度 (mm/s²，0 表示不做斜坡) 与曲线类型，由 CONFIG_RAMP 设置
+        self.accel_mm_s2 = 0.0; self.profile = PROFILE_TRAPEZOID
+        # 当前/上一次相对运动的进度 (供多轴联锁判断)
+        self.move_total_steps = 0; self.move_steps_done = 0; self.move_sign = 1; self.seg_hz = 0; self.seg_start_ms = None; self.move_done = True
+    
+    def live_position_mm(self):
+        # 含进行中运动的实时位置 (已完成的时间片 + 当前片按频率估算)，供多轴联锁判断
+        steps = 0
+        if not self.move_done and self.seg_start_ms is not None:
+            steps = self.move_steps_done + time.ticks_diff(time.ticks_ms(), self.seg_start_ms) * self.seg_hz // 1000
+            if steps > self.move_total_steps: steps = self.move_total_steps
+        return (self.position_steps + self.move_sign * steps) / self.steps_per_mm
+    
+    def position_mm(self):
+        return self.position_steps / self.steps_per_mm
+    
+    def set_steps_per_mm(self, steps_per_mm):
+        # 保持以 mm 计的位置不变
+        self.position_steps = int(self.position_steps / self.steps_per_mm * steps_per_mm + 0.5) if self.steps_per_mm > 0 else 0
+        self.steps_per_mm = steps_per_mm
+    
+    def _take_count(self):
+        # 读取并清零上次读取以来输出的脉冲数；PCNT 为 16 位，长时间运动需周期性读取
+        if self.counter is not None: return self.counter.value(0)
+        now = time.ticks_us()
+        num = self.seg_hz * time.ticks_diff(now, self.seg_start_us) + self.count_rest
+        self.seg_start_us = now; self.count_rest = num % 1_000_000
+        return num // 1_000_000
+    
+    def _switch_segment(self, hz):
+        # 结算上一段的脉冲后切换到新频率 (0 = 停止输出)
+        if self.seg_start_ms is not None: self.move_steps_done += self._take_count()
+        self.seg_hz = hz
+        if hz: self.pwm.freq(hz); self.pwm.duty(512)
+        else: self.pwm.duty(0)
+        self.seg_start_ms = time.ticks_ms(); self.seg_start_us = time.ticks_us()
+    
+    async def _sleep_counting(self, ms):
+        while ms > 0:
+            chunk = ms if ms < COUNT_POLL_MS else COUNT_POLL_MS
+            await uasyncio.sleep_ms(chunk); ms -= chunk
+            self.move_steps_done += self._take_count()
+    
+    async def _set_dir(self, value):
+        if self.dir_state == value: return  # 方向未变 (如分段运动的后续段)，无需再等建立时间
+        self.dir.value(value); self.dir_state = value
+        # --- (已修改) DIR 建立时间 ---
+        # 再次增加延时以确保驱动器有足够的时间在 STEP 脉冲前识别 DIR 信号
+        await uasyncio.sleep_ms(50) # t2 delay (原为 20ms)
     
     def enable(self):
         if self.use_ena: pass
@@ -56,184 +229,758 @@ class Stepper:
         if self.steps_per_mm <= 0 or speed_mm_s <= 0: return
         total_steps = int(abs(distance_mm) * self.steps_per_mm)
         if total_steps == 0: return
-        self.enable()
-        if self.use_ena: await uasyncio.sleep_ms(5)
-        self.dir.value(1 if distance_mm < 0 else 0)
-        
-        # --- (已修改) DIR 建立时间 ---
-        # 再次增加延时以确保驱动器有足够的时间在 STEP 脉冲前识别 DIR 信号
-        await uasyncio.sleep_ms(50) # t2 delay (原为 20ms)
-        
-        frequency = speed_mm_s * self.steps_per_mm
-        if frequency > 40000: frequency = 40000
-        if frequency <= 0: return
-        duration_s = total_steps / frequency
+        if accel_mm_s2 <= 0: accel_mm_s2 = self.accel_mm_s2
+        self.move_total_steps = total_steps; self.move_steps_done = 0; self.seg_start_ms = None; self.move_done = False
+        self.count_rest = 0; sign = self.move_sign = -1 if distance_mm < 0 else 1
+        if self.counter is not None: self.counter.value(0)
         try:
-            self.pwm.freq(int(frequency)); self.pwm.duty(512); await uasyncio.sleep_ms(int(duration_s * 1000))
+            self.enable()
+            if self.use_ena: await uasyncio.sleep_ms(5)
+            await self._set_dir(1 if distance_mm < 0 else 0)
+            
+            v_max = speed_mm_s * self.steps_per_mm
+            if v_max > MAX_STEP_FREQ: v_max = MAX_STEP_FREQ
+            if accel_mm_s2 > 0: ramp, cruise_hz = build_ramp(total_steps, v_max, accel_mm_s2 * self.steps_per_mm, self.profile)
+            else: ramp, cruise_hz = [], max(1, int(v_max))
+            # 以起始时刻为基准计算每段截止时间，避免 sleep 误差累积
+            start = time.ticks_ms(); elapsed_ms = 0
+            for pulses, slices in ramp_segments(total_steps, ramp, cruise_hz):
+                self._switch_segment(pulses * RAMP_HZ_PER_PULSE)  # S 曲线起步的首片可能取整为 0 个脉冲
+                elapsed_ms += slices * RAMP_SLICE_MS
+                await self._sleep_counting(time.ticks_diff(time.ticks_add(start, elapsed_ms), time.ticks_ms()))
+            self._switch_segment(0)
+            if self.counter is not None and self.move_steps_done == 0:
+                # 输出了整段运动却一个脉冲也没计到：PCNT 读不到 STEP 引脚 (接线或引脚配置问题)，改用估算，不做补步
+                print(f"WARN: PCNT counted no pulses on pin {self.step_pin_num}. Using ticks_us estimate.")
+                self.counter = None; self.move_steps_done = total_steps
+            # 按实际计数补齐调度延迟造成的缺步 (多出的步数记入位置寄存器，不反向修正)
+            per_slice = max(1, cruise_hz // RAMP_HZ_PER_PULSE)
+            for _ in range(8):
+                deficit = total_steps - self.move_steps_done
+                if deficit <= 0: break
+                self._switch_segment(min(deficit, per_slice) * RAMP_HZ_PER_PULSE)
+                await uasyncio.sleep_ms(RAMP_SLICE_MS)
+                self._switch_segment(0)
+            if self.move_steps_done != total_steps: print(f"WARN: {self.move_steps_done}/{total_steps} steps output.")
         finally:
             self.pwm.duty(0); self.step.value(0)
+            if self.seg_start_ms is not None: self.move_steps_done += self._take_count(); self.seg_hz = 0
+            self.position_steps += sign * self.move_steps_done; self.move_total_steps = self.move_steps_done; self.move_done = True
+    
+    def _on_limit(self, pin):
+        # 硬中断：立即停止 PWM 并记录触发时刻与脉冲数 (自上次读取以来，不分配内存)
+        if self.limit_hit: return  # 开关抖动的重复中断
+        self.pwm.duty(0)
+        self.limit_hit = True; self.limit_ticks_us = time.ticks_us()
+        self.limit_count = self.counter.value() if self.counter is not None else 0
+        self.limit_flag.set()
+    
+    def overshoot_mm(self):
+        # 上一次限位触发后到电机停止之间多走的距离
+        return self.limit_overshoot_steps / self.steps_per_mm
     
     async def move_until_trigger(self, is_forward, speed_mm_s, trigger_pin, timeout_ms=30000):
         if self.steps_per_mm <= 0 or speed_mm_s <= 0: return False
+        self.limit_overshoot_steps = 0
+        if trigger_pin.value() == 0: return True  # 已在限位上
         self.enable()
         if self.use_ena: await uasyncio.sleep_ms(5)
-        self.dir.value(0 if is_forward else 1)
-
-        # --- (已修改) DIR 建立时间 ---
-        # 再次增加延时以确保驱动器有足够的时间在 STEP 脉冲前识别 DIR 信号
-        await uasyncio.sleep_ms(50) # t2 delay (原为 20ms)
+        await self._set_dir(0 if is_forward else 1)
         
         frequency = speed_mm_s * self.steps_per_mm
         if frequency > 40000: frequency = 40000
-        if frequency <= 0: return False
-        self.pwm.freq(int(frequency))
-        self.pwm.duty(512)
-        start_time = time.ticks_ms()
-        triggered = False
+        if frequency < 1: return False
+        sign = self.move_sign = 1 if is_forward else -1
+        self.move_total_steps = int(frequency) * timeout_ms // 1000; self.move_steps_done = 0; self.seg_start_ms = None; self.move_done = False
+        self.count_rest = 0; self.limit_hit = False; self.limit_flag.clear()
+        if self.counter is not None: self.counter.value(0)
+        trigger_pin.irq(trigger=machine.Pin.IRQ_FALLING, handler=self._on_limit_cb, hard=True)
+        self._switch_segment(int(frequency))
         try:
-            while time.ticks_diff(time.ticks_ms(), start_time) < timeout_ms:
-                if trigger_pin.value() == 0:
-                    triggered = True
-                    print(f"Triggered on pin {trigger_pin}, stopping motor.")
-                    break
-                await uasyncio.sleep_ms(1)
-            if not triggered:
-                print(f"ERROR: Timeout waiting for trigger on pin {trigger_pin} after {timeout_ms}ms!")
-                update_display("Status: ERROR", "Limit Timeout", f"Pin: {trigger_pin}")
-                return False
+            if trigger_pin.value() == 0: self._on_limit(trigger_pin)  # 启动前已触发，不会产生下降沿
+            # 分片等待并周期性累计脉冲数 (PCNT 为 16 位，慢速归零约 10 s 即回绕)；
+            # 读取时关中断，保证 ISR 记录的 limit_count 与最后一次读取之后的计数同一基准
+            deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+            while not self.limit_hit:
+                left = time.ticks_diff(deadline, time.ticks_ms())
+                if left <= 0:
+                    print(f"ERROR: Timeout waiting for trigger on pin {trigger_pin} after {timeout_ms}ms!")
+                    update_display("Status: ERROR", "Limit Timeout", f"Pin: {trigger_pin}")
+                    return False
+                try:
+                    await uasyncio.wait_for_ms(self.limit_flag.wait(), left if left < COUNT_POLL_MS else COUNT_POLL_MS)
+                except uasyncio.TimeoutError:
+                    state = machine.disable_irq()
+                    if not self.limit_hit: self.move_steps_done += self._take_count()
+                    machine.enable_irq(state)
+            print(f"Triggered on pin {trigger_pin}, stopped in ISR.")
             return True
         finally:
+            trigger_pin.irq(handler=None)
             self.pwm.duty(0)
             self.step.value(0)
+            if self.counter is not None:
+                rest = self.counter.value(0)
+                if self.limit_hit: self.limit_overshoot_steps = rest - self.limit_count
+            else:
+                # 无 PCNT：按触发时刻估算，ISR 已停止输出，之后无脉冲
+                end_us = self.limit_ticks_us if self.limit_hit else time.ticks_us()
+                rest = (self.seg_hz * time.ticks_diff(end_us, self.seg_start_us) + self.count_rest) // 1_000_000
+            self.move_steps_done += rest; self.seg_hz = 0
+            self.position_steps += sign * self.move_steps_done; self.move_total_steps = self.move_steps_done; self.move_done = True
 
 
 # --- 5. 全域變數 (已移除 ENA 引脚) ---
-command_queue = AsyncQueue()
+COMMAND_QUEUE_CAPACITY = 272  # 可容纳流水线上传的整个运动计划 (PLAN_MAX_ENTRIES + 2 条) 及少量其他指令；只存引用，每槽 4 字节
+command_queue = AsyncQueue(COMMAND_QUEUE_CAPACITY)
 steppers = {
-    'z': Stepper(Z_STEP_PIN, Z_DIR_PIN, is_dm_driver=True),
-    'a': Stepper(A_STEP_PIN, A_DIR_PIN, is_dm_driver=True),
-    'b': Stepper(B_STEP_PIN, B_DIR_PIN, is_dm_driver=True), 
-    'c': Stepper(C_STEP_PIN, C_DIR_PIN, is_dm_driver=True)
+    'z': Stepper(Z_STEP_PIN, Z_DIR_PIN, is_dm_driver=True, pcnt_id=0),
+    'a': Stepper(A_STEP_PIN, A_DIR_PIN, is_dm_driver=True, pcnt_id=1),
+    'b': Stepper(B_STEP_PIN, B_DIR_PIN, is_dm_driver=True, pcnt_id=2), 
+    'c': Stepper(C_STEP_PIN, C_DIR_PIN, is_dm_driver=True, pcnt_id=3)
 }
 a_limit_home = machine.Pin(A_LIMIT_HOME_PIN, machine.Pin.IN, machine.Pin.PULL_UP)
 a_limit_end = machine.Pin(A_LIMIT_END_PIN, machine.Pin.IN, machine.Pin.PULL_UP)
 
-# --- 6. 异步任务 ---
+# --- 6. 通讯协议 (文本行 / 二进制帧) ---
+# 二进制帧: SYNC(0xA5) VER CMD SEQ(u16) LEN(u16) PAYLOAD CRC16(u16)，小端；CRC 覆盖 VER..PAYLOAD
+# 连接后 PC 发送文本 "HELLO,BIN,1"，回复 OK 后该连接切换为二进制帧；否则继续使用文本协议
+PROTO_VERSION = 1
+FRAME_SYNC = 0xA5
+REPLY_ID = 0x80; EVENT_ID = 0xFF; TEXT_ID = 0x7F
+ST_OK, ST_DONE, ST_ERROR = 0, 1, 2
+# 指令表: 名称 -> (指令 id, 参数格式)；a=轴名 (u8 字符), f=float32, H=uint16, B=uint8
+COMMAND_SPECS = {
+    'CONFIG_AXIS': (0x01, 'aff'),
+    'CONFIG_Z_PEEL': (0x02, 'ffff'),
+    'CONFIG_A_WIPE': (0x03, 'ff'),
+    'NEXT_LAYER': (0x04, ''),
+    'MOVE_REL': (0x05, 'afff'),
+    'CANCEL': (0x06, 'H'),
+    'PING': (0x07, ''),
+    'PLAN_BEGIN': (0x08, 'HH'),
+    'PLAN_ENTRY': (0x09, 'HHHHHHHHBH'),
+    'PLAN_END': (0x0A, ''),
+    'GO': (0x0B, ''),
+    'CONFIG_INTERLOCK': (0x0C, 'f'),
+    'CONFIG_RAMP': (0x0D, 'afB'),
+    'MOVE_ABS': (0x0E, 'afff'),
+    'POS': (0x0F, ''),
+    'CONFIG_A_LIMIT': (0x10, 'ff'),
+    'CONFIG_Z_PEEL_PROFILE': (0x11, 'ffff'),
+    'STOP': (0x12, ''),
+    'STATUS': (0x13, ''),
+    'CONFIG_LEVEL': (0x14, 'Bfff'),
+    'LEVEL_FF': (0x15, 'f'),
+    'TELEMETRY': (0x16, 'BH'),
+    'TIME': (0x17, ''),
+}
+COMMAND_NAMES = {spec[0]: name for name, spec in COMMAND_SPECS.items()}
+STRUCT_FORMATS = {name: '<' + spec[1].replace('a', 'B') for name, spec in COMMAND_SPECS.items()}
+STRUCT_SIZES = {name: struct.calcsize(fmt) for name, fmt in STRUCT_FORMATS.items()}
+
+def _crc16_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8): crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+CRC_TABLE = _crc16_table()
+
+def crc16(data, crc=0xFFFF):
+    for b in data: crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[((crc >> 8) ^ b) & 0xFF]
+    return crc
+
+def encode_frame(cmd_id, seq, payload=b''):
+    header = struct.pack('<BBHH', PROTO_VERSION, cmd_id, seq & 0xFFFF, len(payload))
+    crc = crc16(payload, crc16(header))
+    return bytes([FRAME_SYNC]) + header + payload + struct.pack('<H', crc)
+
+async def read_frame(reader):
+    # 返回 (cmd_id, seq, payload, crc_ok)；连接关闭时抛出 EOFError
+    while (await reader.readexactly(1))[0] != FRAME_SYNC: pass
+    header = await reader.readexactly(6)
+    _, cmd_id, seq, length = struct.unpack('<BBHH', header)
+    body = await reader.readexactly(length + 2)
+    payload = body[:length]
+    return cmd_id, seq, payload, crc16(payload, crc16(header)) == struct.unpack('<H', body[length:])[0]
+
+def parse_text(cmd):
+    # "MOVE_REL,z,1,10,20" -> ('MOVE_REL', ['z', 1.0, 10.0, 20.0])；不在指令表中的参数保持字符串
+    parts = cmd.split(','); name = parts[0].strip().upper(); spec = COMMAND_SPECS.get(name)
+    if spec is None: return name, parts[1:]
+    fmt = spec[1]
+    if len(parts) - 1 != len(fmt): raise ValueError(f"{name} expects {len(fmt)} args")
+    return name, [p.strip().lower() if f == 'a' else (int(p) if f in 'HB' else float(p)) for f, p in zip(fmt, parts[1:])]
+
+def parse_binary(cmd_id, payload):
+    if cmd_id == TEXT_ID: return parse_text(payload.decode())
+    name = COMMAND_NAMES.get(cmd_id)
+    if name is None: raise ValueError(f"Unknown command id {cmd_id}")
+    # 先检查长度：struct.unpack 的异常类型因运行时而异 (CPython 为 struct.error)，统一为 ValueError 以回复 Bad command 并保持连接
+    if len(payload) != STRUCT_SIZES[name]: raise ValueError(f"{name} expects {STRUCT_SIZES[name]} payload bytes, got {len(payload)}")
+    args = list(struct.unpack(STRUCT_FORMATS[name], payload))
+    for i, f in enumerate(COMMAND_SPECS[name][1]):
+        if f == 'a': args[i] = chr(args[i])
+    return name, args
+
+def split_tag(line):
+    # "@12 NEXT_LAYER" -> (12, "NEXT_LAYER")；无标签返回 (None, line)
+    if line.startswith('@'):
+        head, _, rest = line.partition(' ')
+        try: return int(head[1:]), rest
+        except ValueError: pass
+    return None, line
+
+async def send_response(writer, tag, response, binary=False, data=False):
+    if binary:
+        # 二进制模式：OK/DONE 只回状态字节；ERROR 与带数据的回复 (data=True，见 DATA_HANDLERS) 附带原文
+        status = ST_DONE if response.startswith("DONE") else (ST_OK if response.startswith("OK") else ST_ERROR)
+        writer.write(encode_frame(REPLY_ID, tag or 0, bytes([status]) + (response.strip().encode() if status == ST_ERROR or data else b'')))
+    else:
+        if tag is not None: response = f"@{tag} {response}"
+        print(f"Sending response: {response.strip()}") # 打印發送的回應
+        writer.write(response.encode())
+    await writer.drain()
+
+async def send_event(writer, event, binary=False):
+    if binary: writer.write(encode_frame(EVENT_ID, 0, event.encode()))
+    else: writer.write(f"!{event}\n".encode())
+    await writer.drain()
+
+# --- 7. 异步任务 ---
+# 正在执行的指令 (供 CANCEL / STOP 中止)
+current = {'task': None, 'name': None, 'writer': None, 'tag': None, 'stops': 0}
+# 液位补偿移动也占用 current (名称 LEVEL)，STOP 可将其中止；结束时置位，等待中的 command_processor 随之继续
+motion_idle = uasyncio.Event()
+
+async def handle_cancel(args, writer, tag, binary):
+    # CANCEL 在读取协程中直接处理，不进入指令队列；可取消排队中或正在执行的指令
+    target = args[0]
+    removed = command_queue.remove_if(lambda it: it[3] == target and it[2] is writer)
+    for _, _, w, t, b in removed: await send_response(w, t, "ERROR: Cancelled.\n", b)
+    running = current['task'] is not None and current['tag'] == target and current['writer'] is writer
+    if running: current['task'].cancel()  # 运动在 finally 中停止 PWM 并结算位置
+    await send_response(writer, tag, f"OK: Cancelled {len(removed) + running}.\n", binary)
+
+async def cmd_stop(args):
+    # 急停：清空队列、中止当前指令、立即停止所有 PWM，作废已上传的运动计划
+    for s in steppers.values(): s.pwm.duty(0)
+    removed = command_queue.remove_if(lambda it: True)
+    for _, _, w, t, b in removed:
+        try: await send_response(w, t, "ERROR: Stopped.\n", b)
+        except OSError: pass
+    if current['task'] is not None: current['task'].cancel()
+    current['stops'] += 1  # 已出队、正在等待液位移动结束的指令也随之作废
+    plan['ready'] = False; level['enabled'] = False; level['pending_mm'] = 0.0  # 液位闭环需重新 CONFIG_LEVEL
+    update_display("Status: STOPPED", f"Dropped: {len(removed)}")
+    return f"OK: Stopped ({current['name'] or 'idle'}, {len(removed)} queued dropped).\n"
+
+async def cmd_status(args):
+    return (f"OK: STATUS,state={'busy' if current['task'] is not None else 'idle'},cmd={current['name'] or '-'},"
+            f"queue={len(command_queue)},layer={plan['layer']}/{plan['layers'] if plan['ready'] else 0}," +
+            ",".join(f"{axis}={steppers[axis].live_position_mm():.3f}" for axis in ('z', 'a')) +
+            f",level={level['measured']},level_pending={level['pending_mm']:.4f},tm_dropped={telemetry['dropped']}\n")
+
+async def handle_hello(args, writer, tag):
+    # 协议协商: HELLO,BIN,<版本>
+    if len(args) == 2 and args[0].strip().upper() == "BIN" and args[1].strip() == str(PROTO_VERSION):
+        await send_response(writer, tag, f"OK: BIN,{PROTO_VERSION}\n"); return True
+    await send_response(writer, tag, "ERROR: Unsupported protocol.\n"); return False
+
+# 客户端发过 PING (启用了心跳) 后，超过此时间收不到任何数据即视为半开连接并关闭 (已排队 / 执行中的运动照常完成)
+CLIENT_IDLE_TIMEOUT_MS = 10000
+
+async def serve_link(reader, writer, label, binary=False):
+    # 一条链路 (TCP 连接或串口) 的指令读取循环；链路断开、心跳超时或读取出错时返回
+    heartbeat = False
+    while True:
+        tag = None
+        try:
+            if binary:
+                frame = read_frame(reader)
+                cmd_id, tag, payload, crc_ok = await (uasyncio.wait_for_ms(frame, CLIENT_IDLE_TIMEOUT_MS) if heartbeat else frame)
+                if not crc_ok: await send_response(writer, tag, "ERROR: CRC mismatch.\n", True); continue
+                name, args = parse_binary(cmd_id, payload)
+            else:
+                data = await reader.readline()
+                if not data: print("客戶端斷開連接"); update_display("Status: Online", label, "Client Disconn."); break
+                tag, cmd = split_tag(data.decode().strip())
+                name, args = parse_text(cmd)
+                if name == "HELLO": binary = await handle_hello(args, writer, tag); continue
+            if name == "CANCEL": await handle_cancel(args, writer, tag, binary)
+            elif name == "TELEMETRY": await send_response(writer, tag, handle_telemetry(args, writer, binary), binary)
+            elif name in PRIORITY_HANDLERS:
+                # 高优先级通道：不排队，运动进行中也立即处理
+                if name == "PING": heartbeat = True
+                await send_response(writer, tag, await PRIORITY_HANDLERS[name](args), binary, name in DATA_HANDLERS)
+            # 读取循环从不等待队列空位，否则排在已满队列之后的 STOP / STATUS / CANCEL / PING 要等运动完成才被读到
+            elif not command_queue.try_put((name, args, writer, tag, binary)): await send_response(writer, tag, "ERROR: Busy.\n", binary)
+        except EOFError:
+            print("客戶端斷開連接"); update_display("Status: Online", label, "Client Disconn."); break
+        except uasyncio.TimeoutError:
+            print("客戶端心跳超時，關閉連接"); update_display("Status: Online", label, "Client Timeout"); break
+        except ValueError as e:
+            await send_response(writer, tag, f"ERROR: Bad command: {e}\n", binary)
+        except Exception as e:
+            print(f"讀取錯誤: {e}")
+            sys.print_exception(e) # 打印詳細錯誤
+            update_display("Status: ERROR", "Client Read Err")
+            break
+    if telemetry['writer'] is writer: telemetry['writer'] = None; telemetry['mask'] = 0
+
 async def tcp_server(host, port):
     print(f"TCP 伺服器啟動於 {host}:{port}")
     async def handle_client(reader, writer):
         print("客戶端已連接"); update_display("Status: Online", f"IP: {host}", "Client Connected")
-        while True:
-            try:
-                data = await reader.readline()
-                if data: await command_queue.put((data.decode().strip(), writer))
-                else: print("客戶端斷開連接"); update_display("Status: Online", f"IP: {host}", "Client Disconn."); break
-            except Exception as e:
-                print(f"讀取錯誤: {e}")
-                sys.print_exception(e) # 打印詳細錯誤
-                update_display("Status: ERROR", "Client Read Err")
-                break
+        await serve_link(reader, writer, f"IP: {host}")
         writer.close(); await writer.wait_closed()
     await uasyncio.start_server(handle_client, host, port)
 
+async def serial_server():
+    # 串口没有连接 / 断开过程，无法靠新连接重置协议协商，因此固定使用二进制帧 (帧同步 + CRC 可从噪声中恢复)；
+    # 心跳超时或读取出错后重新进入读取循环，PC 重新打开串口即可继续
+    try:
+        uart = machine.UART(SERIAL_UART_ID, baudrate=SERIAL_BAUD, tx=SERIAL_TX_PIN, rx=SERIAL_RX_PIN, rxbuf=1024)
+    except Exception as e: print(f"串口鏈路不可用: {e}"); return
+    reader = uasyncio.StreamReader(uart); writer = uasyncio.StreamWriter(uart, {})
+    print(f"串口鏈路啟動於 UART{SERIAL_UART_ID} ({SERIAL_BAUD} baud)")
+    while True:
+        await serve_link(reader, writer, f"UART{SERIAL_UART_ID}", binary=True)
+        await uasyncio.sleep_ms(100)
+
+# --- 8. 指令处理 (分派表) ---
+params = {
+    'peel_lift_z1': 5.05, 'peel_return_z2': 5.0,
+    'z_speed_down': 20.0, 'z_speed_up': 20.0,
+    'wipe_speed_fast': 80.0, 'wipe_speed_slow': 10.0,
+    'wipe': True, 'dwell_ms': 1000,
+    'a_home_clearance': 0.0,  # A 归位前 Z 需抬升的距离 (mm)，<=0 表示等 Z 抬升完成
+    'limit_release_mm': 0.5,  # 限位回退：越过触发点的距离之外再退开的余量 (开关释放行程)
+    'a_prehome_mm': 3.0,      # 两段式归位：快速段停在距原点开关此距离处，其后慢速接近
+    # Z 分段剥离：离层时先以 z_break_speed 走 z_break_mm，回层时最后 z_approach_mm 以 z_approach_speed 接近 (距离 0 = 不分段)
+    'z_break_mm': 0.0, 'z_break_speed': 1.0, 'z_approach_mm': 0.0, 'z_approach_speed': 2.0,
+}
+
+# --- 运动计划：整个任务的逐层参数在开始打印前一次性上传，之后每层只需一条 GO ---
+# 条目按游程压缩 (连续相同的层只存一条 + 重复次数)，存放于开机时预分配的缓冲区
+# 条目格式: 重复次数, 抬升/回落距离 (um), Z 下/上速度, A 快/慢速度 (0.1 mm/s), 标志位, 停顿 (ms)
+PLAN_ENTRY_FMT = '<HHHHHHHBH'
+PLAN_ENTRY_SIZE = struct.calcsize(PLAN_ENTRY_FMT)
+PLAN_MAX_ENTRIES = 256
+PLAN_FLAG_WIPE = 0x01
+plan_buf = bytearray(PLAN_MAX_ENTRIES * PLAN_ENTRY_SIZE)
+plan = {'entries': 0, 'layers': 0, 'ready': False, 'entry': 0, 'left': 0, 'layer': 0}
+layer_params = dict(params)  # GO 时复用的参数字典，避免每层分配
+
+async def cmd_config_axis(args):
+    axis, pulse_per_rev, lead = args
+    if axis not in steppers: return "ERROR: Invalid axis.\n"
+    steppers[axis].set_steps_per_mm(pulse_per_rev / lead); return f"OK: Axis {axis} configured.\n"
+
+async def cmd_config_z_peel(args):
+    params['peel_lift_z1'], params['peel_return_z2'], params['z_speed_down'], params['z_speed_up'] = args; return "OK: Z peel params configured.\n"
+
+async def cmd_config_a_wipe(args):
+    params['wipe_speed_fast'], params['wipe_speed_slow'] = args; return "OK: A wipe params configured.\n"
+
+async def cmd_config_interlock(args):
+    params['a_home_clearance'] = layer_params['a_home_clearance'] = args[0]; return "OK: Interlock configured.\n"
+
+async def cmd_config_a_limit(args):
+    params['limit_release_mm'] = layer_params['limit_release_mm'] = args[0]
+    params['a_prehome_mm'] = layer_params['a_prehome_mm'] = args[1]; return "OK: A limit back-off configured.\n"
+
+async def cmd_config_z_peel_profile(args):
+    for key, value in zip(('z_break_mm', 'z_break_speed', 'z_approach_mm', 'z_approach_speed'), args):
+        params[key] = layer_params[key] = value
+    return "OK: Z peel profile configured.\n"
+
+async def cmd_config_ramp(args):
+    axis, accel, profile = args
+    if axis not in steppers: return "ERROR: Invalid axis.\n"
+    if profile not in (PROFILE_TRAPEZOID, PROFILE_SCURVE): return "ERROR: Invalid ramp profile.\n"
+    steppers[axis].accel_mm_s2 = accel if accel > 0 else 0.0; steppers[axis].profile = profile
+    return f"OK: Axis {axis} ramp configured.\n"
+
+async def cmd_move_rel(args):
+    axis, distance, speed, accel = args
+    if axis not in steppers: return "ERROR: Invalid axis.\n"
+    await steppers[axis].move_rel(distance, speed, accel); return "DONE\n"
+
+async def cmd_move_abs(args):
+    axis, position, speed, accel = args
+    if axis not in steppers: return "ERROR: Invalid axis.\n"
+    stepper = steppers[axis]
+    await stepper.move_rel(position - stepper.position_mm(), speed, accel); return f"DONE: {axis}={stepper.position_mm():.4f}\n"
+
+async def cmd_pos(args):
+    return "OK: POS," + ",".join(f"{axis}={steppers[axis].position_mm():.4f}" for axis in ('z', 'a', 'b', 'c')) + "\n"
+
+async def cmd_ping(args):
+    return "OK: PONG\n"
+
+async def cmd_time(args):
+    # 对时：PC 以往返时间的中点对应此 ticks_us (高优先级通道，排队不影响精度)
+    return f"OK: TIME,{time.ticks_us()}\n"
+
+async def cmd_plan_begin(args):
+    total_layers, entries = args
+    if entries > PLAN_MAX_ENTRIES: return f"ERROR: Plan too large (max {PLAN_MAX_ENTRIES} entries).\n"
+    plan['entries'], plan['layers'], plan['ready'] = entries, total_layers, False
+    plan['entry'], plan['left'], plan['layer'] = 0, 0, 0
+    return "OK: Plan begin.\n"
+
+async def cmd_plan_entry(args):
+    index = args[0]
+    if index >= plan['entries']: return "ERROR: Plan entry out of range.\n"
+    if args[1] == 0: return "ERROR: Plan entry repeat must be > 0.\n"  # 否则 plan['left'] 会减成负数
+    struct.pack_into(PLAN_ENTRY_FMT, plan_buf, index * PLAN_ENTRY_SIZE, *args[1:])
+    return "OK\n"
+
+async def cmd_plan_end(args):
+    covered = sum(struct.unpack_from('<H', plan_buf, i * PLAN_ENTRY_SIZE)[0] for i in range(plan['entries']))
+    if covered != plan['layers']: return f"ERROR: Plan covers {covered} of {plan['layers']} layers.\n"
+    plan['ready'] = True
+    return f"OK: Plan ready, {plan['layers']} layers.\n"
+
+def _load_plan_layer():
+    # 游标前进到下一层，把条目解码到 layer_params
+    if plan['left'] == 0:
+        offset = plan['entry'] * PLAN_ENTRY_SIZE; plan['entry'] += 1
+        repeat, lift, ret, z_down, z_up, fast, slow, flags, dwell = struct.unpack_from(PLAN_ENTRY_FMT, plan_buf, offset)
+        plan['left'] = repeat
+        layer_params['peel_lift_z1'] = lift / 1000; layer_params['peel_return_z2'] = ret / 1000
+        layer_params['z_speed_down'] = z_down / 10; layer_params['z_speed_up'] = z_up / 10
+        layer_params['wipe_speed_fast'] = fast / 10; layer_params['wipe_speed_slow'] = slow / 10
+        layer_params['wipe'] = bool(flags & PLAN_FLAG_WIPE); layer_params['dwell_ms'] = dwell
+    plan['left'] -= 1; plan['layer'] += 1
+    return layer_params
+
+async def cmd_go(args, writer=None, binary=False):
+    if not plan['ready']: return "ERROR: No plan loaded.\n"
+    if plan['layer'] >= plan['layers']: return "ERROR: Plan finished.\n"
+    p = _load_plan_layer()
+    start = time.ticks_ms()
+    await run_layer_sequence(p, writer, binary)
+    if writer: await send_event(writer, f"LAYER,{plan['layer']},{plan['layers']},{time.ticks_diff(time.ticks_ms(), start)}", binary)
+    return "DONE\n"
+
+async def progress(writer, binary, step):
+    # 向 PC 推送层间子步骤进度事件
+    if writer:
+        try: await send_event(writer, f"STEP,{plan['layer']},{step}", binary)
+        except OSError: pass
+
+async def cmd_next_layer(args, writer=None, binary=False):
+    await run_layer_sequence(params, writer, binary)
+    return "DONE\n"
+
+# --- 层间运动序列 (NEXT_LAYER / GO 共用)：声明式步骤 + 并发执行器 ---
+# 每一步: (名称, 轴, 依赖步骤, 联锁, 启用参数键, 动作)
+# - 依赖中的步骤全部完成后才开始；无依赖关系的步骤并发执行
+# - 联锁 (步骤名, 参数键): 等待该步骤的轴自步骤开始已走过 params[参数键] mm (<=0 表示需等该步骤完成)
+# - 启用参数键为 None 表示总是执行，否则 params[键] 为假时跳过
+# 同一轴上的步骤必须由依赖关系确定先后 (开机时 validate_sequence 检查)
+async def z_profile_move(distance, travel_speed, head_mm, head_speed, tail_mm, tail_speed):
+    # 分段剥离：起始慢速段 -> 快速段 -> 末尾慢速段；慢速段距离为 0 或速度 <=0 时省略
+    sign = -1 if distance < 0 else 1; total = abs(distance)
+    head = min(head_mm, total) if head_speed > 0 else 0
+    tail = min(tail_mm, total - head) if tail_speed > 0 else 0
+    for d, v in ((head, head_speed), (total - head - tail, travel_speed), (tail, tail_speed)):
+        if d > 0: await steppers['z'].move_rel(sign * d, v, 0)
+
+async def step_z_return(p):
+    update_display("Status: Printing", "Action: Return", "Z-Down...")
+    # (Z 轴方向修正) 离开当前层：先慢速脱离，再快速移动
+    await z_profile_move(-p['peel_return_z2'], p['z_speed_up'], p['z_break_mm'], p['z_break_speed'], 0, 0)
+    await uasyncio.sleep_ms(100)
+
+# A 轴行程记录：归位后位置寄存器以原点开关触发点为零，擦拭到末端时记下末端开关的位置
+a_travel = {'homed': False, 'end_mm': None}
+
+async def step_a_wipe(p):
+    update_display("Status: Printing", "Action: Wiping", "A-to-End")
+    t0 = time.ticks_us()
+    if not await steppers['a'].move_until_trigger(is_forward=True, speed_mm_s=p['wipe_speed_fast'], trigger_pin=a_limit_end):
+        a_travel['homed'] = False
+        raise RuntimeError("A to End failed (Limit Timeout?)")
+    tm_span('A_WIPE.search', t0)
+    if a_travel['homed']: a_travel['end_mm'] = steppers['a'].position_mm() - steppers['a'].overshoot_mm()
+    # --- (重要) 增加 "A to End" 后的回退：中断停机后越程确定，只需退回越程 + 释放余量 ---
+    t0 = time.ticks_us()
+    await steppers['a'].move_rel(-(steppers['a'].overshoot_mm() + p['limit_release_mm']), p['wipe_speed_slow'], 0)
+    tm_span('A_WIPE.backoff', t0)
+    await uasyncio.sleep_ms(100)
+
+async def step_z_lift(p):
+    update_display("Status: Printing", "Action: Peeling", "Z-Up...")
+    # (Z 轴方向修正) 回到新层高：快速移动后慢速接近
+    await z_profile_move(p['peel_lift_z1'], p['z_speed_down'], 0, 0, p['z_approach_mm'], p['z_approach_speed'])
+
+async def step_z_settle(p):
+    await uasyncio.sleep_ms(p['dwell_ms'])
+
+async def step_a_home(p):
+    a = steppers['a']
+    update_display("Status: Printing", "Action: Wiping", "A-to-Home...")
+    homed = False; t0 = time.ticks_us()
+    # 两段式归位：位置已知时快速移动到预归位点，只有最后几毫米慢速接近开关
+    if a_travel['homed'] and a_travel['end_mm'] is not None and -1.0 < a.position_mm() <= a_travel['end_mm'] + 1.0:
+        prehome = p['a_prehome_mm']
+        if a.position_mm() > prehome: await a.move_rel(prehome - a.position_mm(), p['wipe_speed_fast'], 0); tm_span('A_HOME.fast', t0); t0 = time.ticks_us()
+        # 慢速段只允许走完预归位距离再加少量余量，超出说明位置已失准
+        slow_timeout_ms = int((a.position_mm() + 2.0) / p['wipe_speed_slow'] * 1000) + 200
+        homed = await a.move_until_trigger(is_forward=False, speed_mm_s=p['wipe_speed_slow'], trigger_pin=a_limit_home, timeout_ms=slow_timeout_ms)
+        if not homed: print("[NL] Fast home missed the switch. Falling back to full slow approach.")
+    if not homed:
+        a_travel['homed'] = False
+        if not await a.move_until_trigger(is_forward=False, speed_mm_s=p['wipe_speed_slow'], trigger_pin=a_limit_home):
+            # (重试逻辑)
+            print("[NL] A to Home failed on first attempt. Retrying...")
+            update_display("Status: Printing", "Action: Wiping", "Retry A Home")
+            if not await a.move_until_trigger(is_forward=False, speed_mm_s=p['wipe_speed_slow'], trigger_pin=a_limit_home):
+                raise RuntimeError("A to Home failed after retry (Limit Timeout?)")
+    tm_span('A_HOME.search', t0)
+    a.position_steps = -a.limit_overshoot_steps  # 原点开关触发点即 A 轴零点
+    a_travel['homed'] = True
+    # --- (重要) 增加 "A to Home" 后的回退 ---
+    t0 = time.ticks_us()
+    await steppers['a'].move_rel(steppers['a'].overshoot_mm() + p['limit_release_mm'], p['wipe_speed_slow'], 0)
+    tm_span('A_HOME.backoff', t0)
+    await uasyncio.sleep_ms(100)
+
+LAYER_SEQUENCE = (
+    ('Z_RETURN', 'z', (),            None,                             None,   step_z_return),
+    ('A_WIPE',   'a', ('Z_RETURN',), None,                             'wipe', step_a_wipe),
+    ('Z_LIFT',   'z', ('A_WIPE',),   None,                             None,   step_z_lift),
+    ('Z_SETTLE', 'z', ('Z_LIFT',),   None,                             None,   step_z_settle),
+    # A 归位与 Z 停顿重叠；Z 抬升越过安全高度后即可开始
+    ('A_HOME',   'a', ('A_WIPE',),   ('Z_LIFT', 'a_home_clearance'),   'wipe', step_a_home),
+)
+
+def validate_sequence(sequence):
+    names = [step[0] for step in sequence]
+    ancestors = {}
+    for name, axis, deps, interlock, _, _ in sequence:
+        for d in deps + ((interlock[0],) if interlock else ()):
+            if d not in ancestors: raise ValueError(f"Step {name} depends on unknown/later step {d}")
+        ancestors[name] = set(deps).union(*[ancestors[d] for d in deps]) if deps else set()
+    for i, a in enumerate(sequence):
+        for b in sequence[i + 1:]:
+            if a[1] == b[1] and a[0] not in ancestors[b[0]]:
+                raise ValueError(f"Steps {a[0]} and {b[0]} share axis {a[1]} without ordering")
+    return names
+
+async def wait_interlock(interlock, p, finished, started, sequence):
+    step_name, key = interlock
+    axis = next(step[1] for step in sequence if step[0] == step_name)
+    clearance = p.get(key, 0)
+    while not finished[step_name].is_set():
+        # 以步骤开始时的位置为基准 (步骤可能包含多段运动)；步骤未开始时不能作为联锁依据
+        if clearance > 0 and step_name in started and abs(steppers[axis].live_position_mm() - started[step_name]) >= clearance: return
+        await uasyncio.sleep_ms(2)
+
+async def run_layer_sequence(p, writer=None, binary=False, sequence=LAYER_SEQUENCE):
+    print("[NL] Sequence Started.")
+    finished = {step[0]: uasyncio.Event() for step in sequence}
+    started = {}; failure = []
+    async def run_step(name, axis, deps, interlock, enable_key, action):
+        try:
+            for d in deps: await finished[d].wait()
+            if failure: return
+            if enable_key is None or p[enable_key]:
+                if interlock: await wait_interlock(interlock, p, finished, started, sequence)
+                print(f"[NL] {name} start.")
+                started[name] = steppers[axis].live_position_mm() if axis in steppers else 0.0
+                t0 = time.ticks_us()
+                await action(p)
+                tm_span(name, t0)
+                await progress(writer, binary, name)
+        except Exception as e:
+            if not failure: failure.append(e)
+        finally:
+            finished[name].set()  # 失败时也释放后续步骤，由 failure 标志终止它们
+    tasks = [uasyncio.create_task(run_step(*step)) for step in sequence]
+    try:
+        await uasyncio.gather(*tasks)
+    except uasyncio.CancelledError:
+        for t in tasks: t.cancel()  # CANCEL / STOP：中止所有并发步骤 (各自在 finally 中停机)
+        raise
+    if failure: raise failure[0]
+    print("[NL] Sequence complete.")
+
+# --- 液位闭环 (B 轴)：过采样中值滤波 + 增量式 PI + PC 前馈，只在空闲窗口 (如曝光期间) 动作 ---
+LEVEL_SAMPLES = 15          # 每次测量的 ADC 采样数，取中值
+LEVEL_PERIOD_MS = 500
+LEVEL_MAX_STEP_MM = 0.2     # 单次补偿的最大移动量
+LEVEL_MAX_PENDING_MM = 1.0  # 待执行补偿量上限 (抗积分饱和)
+LEVEL_DEADBAND_MM = 0.005
+LEVEL_B_DIR = -1            # B 轴负方向使液位上升 (与旧固件一致)
+try:
+    level_adc = machine.ADC(machine.Pin(LEVEL_SENSOR_PIN)); level_adc.atten(machine.ADC.ATTN_11DB)
+except Exception as e: print(f"Level ADC Init Failed: {e}"); level_adc = None
+level_samples = [0] * LEVEL_SAMPLES
+# setpoint / 测量值为 ADC 读数；kp: mm/读数，ki: mm/(读数·s)；pending_mm 为尚未执行的补偿 (液位上升方向为正)
+level = {'enabled': False, 'setpoint': 2000.0, 'kp': 0.00005, 'ki': 0.00001, 'speed': 2.0,
+         'measured': None, 'last_error': None, 'pending_mm': 0.0}
+
+def read_level():
+    for i in range(LEVEL_SAMPLES): level_samples[i] = level_adc.read()
+    level_samples.sort(); return level_samples[LEVEL_SAMPLES // 2]
+
+def add_level_pending(mm):
+    pending = level['pending_mm'] + mm
+    if pending > LEVEL_MAX_PENDING_MM: pending = LEVEL_MAX_PENDING_MM
+    elif pending < -LEVEL_MAX_PENDING_MM: pending = -LEVEL_MAX_PENDING_MM
+    level['pending_mm'] = pending
+
+async def level_task():
+    print("液位閉環任務已啟動。")
+    last = time.ticks_ms()
+    while True:
+        await uasyncio.sleep_ms(LEVEL_PERIOD_MS)
+        now = time.ticks_ms(); dt = time.ticks_diff(now, last) / 1000; last = now
+        level['measured'] = read_level()
+        if not level['enabled']: level['last_error'] = None; continue
+        error = level['setpoint'] - level['measured']  # 正 = 液位偏低
+        # 增量式 PI：du = kp * de + ki * e * dt，累加到待执行量，执行时机与控制周期解耦
+        de = 0 if level['last_error'] is None else error - level['last_error']
+        level['last_error'] = error
+        add_level_pending(level['kp'] * de + level['ki'] * error * dt)
+        # 只在空闲窗口动作：无正在执行的指令且队列为空 (PC 曝光期间即属此类)
+        if current['task'] is not None or len(command_queue): continue
+        step = level['pending_mm']
+        if -LEVEL_DEADBAND_MM < step < LEVEL_DEADBAND_MM: continue
+        if step > LEVEL_MAX_STEP_MM: step = LEVEL_MAX_STEP_MM
+        elif step < -LEVEL_MAX_STEP_MM: step = -LEVEL_MAX_STEP_MM
+        # 检查与占用之间没有 await：移动期间 current 为忙，新指令在 command_processor 中等待，STOP 可中止
+        b = steppers['b']; start_steps = b.position_steps
+        current['task'] = uasyncio.create_task(b.move_rel(LEVEL_B_DIR * step, level['speed'], 0)); current['name'] = 'LEVEL'
+        try: await current['task']
+        except uasyncio.CancelledError: pass
+        finally: current['task'] = None; current['name'] = None; motion_idle.set()
+        # 按实际移动的步数扣减 (STOP 中止时待补偿量已被清零)
+        if level['enabled']: add_level_pending(-LEVEL_B_DIR * (b.position_steps - start_steps) / b.steps_per_mm)
+
+async def cmd_config_level(args):
+    if level_adc is None: return "ERROR: Level sensor unavailable.\n"
+    enabled, setpoint, kp, ki = args
+    level['enabled'] = bool(enabled); level['setpoint'], level['kp'], level['ki'] = setpoint, kp, ki
+    level['last_error'] = None; level['pending_mm'] = 0.0
+    return f"OK: Level control {'enabled' if level['enabled'] else 'disabled'}.\n"
+
+async def cmd_level_ff(args):
+    # PC 前馈：本层预计消耗的树脂折算为 B 轴补偿量 (mm)，在下一个空闲窗口与 PI 输出一起执行
+    if level['enabled']: add_level_pending(args[0])
+    return f"OK: Level pending {level['pending_mm']:.4f}.\n"
+
+# --- 遥测：层间子步骤以 ticks_us 计时、液位定期采样，批量推送给订阅的连接 ---
+# TELEMETRY,<掩码>,<液位采样周期 ms> 把当前连接设为遥测接收端 (掩码 0 = 关闭)；PC 用 TIME 对时后换算为主机时间
+# 事件: "T,<起始 ticks_us>,<时长 us>,<名称>,<层>"  "L,<ticks_us>,<ADC 中值>,<待补偿 mm>"
+# 记录只追加到定长缓冲，不等待网络；telemetry_task 每 TM_FLUSH_MS 合并发送一次，缓冲满时丢弃并计数
+TM_STEPS, TM_LEVEL = 0x01, 0x02
+TM_MAX_PENDING = 64
+TM_FLUSH_MS = 50
+telemetry = {'writer': None, 'binary': False, 'mask': 0, 'level_ms': 0, 'pending': [], 'dropped': 0}
+
+def tm_push(line):
+    if len(telemetry['pending']) >= TM_MAX_PENDING: telemetry['dropped'] += 1; return
+    telemetry['pending'].append(line)
+
+def tm_span(name, t0):
+    # t0 为起始 ticks_us，结束时刻取当前；未订阅时不格式化字符串
+    if telemetry['mask'] & TM_STEPS: tm_push(f"T,{t0},{time.ticks_diff(time.ticks_us(), t0)},{name},{plan['layer']}")
+
+def handle_telemetry(args, writer, binary):
+    mask, level_ms = args
+    if mask & TM_LEVEL and level_adc is None: return "ERROR: Level sensor unavailable.\n"
+    telemetry['writer'] = writer if mask else None; telemetry['binary'] = binary
+    telemetry['mask'] = mask; telemetry['level_ms'] = level_ms; telemetry['pending'] = []; telemetry['dropped'] = 0
+    return f"OK: Telemetry mask {mask}.\n"
+
+async def telemetry_task():
+    last_level = time.ticks_ms()
+    while True:
+        await uasyncio.sleep_ms(TM_FLUSH_MS)
+        if telemetry['mask'] & TM_LEVEL and telemetry['level_ms'] and time.ticks_diff(time.ticks_ms(), last_level) >= telemetry['level_ms']:
+            last_level = time.ticks_ms(); tm_push(f"L,{time.ticks_us()},{read_level()},{level['pending_mm']:.4f}")
+        writer = telemetry['writer']
+        if writer is None or not telemetry['pending']: continue
+        batch = telemetry['pending']; telemetry['pending'] = []
+        try:
+            for line in batch:
+                if telemetry['binary']: writer.write(encode_frame(EVENT_ID, 0, line.encode()))
+                else: writer.write(f"!{line}\n".encode())
+            await writer.drain()
+        except OSError as e:
+            print(f"遙測發送失敗，停止推送: {e}"); telemetry['writer'] = None; telemetry['mask'] = 0
+
+HANDLERS = {
+    'CONFIG_AXIS': cmd_config_axis,
+    'CONFIG_Z_PEEL': cmd_config_z_peel,
+    'CONFIG_A_WIPE': cmd_config_a_wipe,
+    'NEXT_LAYER': cmd_next_layer,
+    'MOVE_REL': cmd_move_rel,
+    'PLAN_BEGIN': cmd_plan_begin,
+    'PLAN_ENTRY': cmd_plan_entry,
+    'PLAN_END': cmd_plan_end,
+    'GO': cmd_go,
+    'CONFIG_INTERLOCK': cmd_config_interlock,
+    'CONFIG_RAMP': cmd_config_ramp,
+    'MOVE_ABS': cmd_move_abs,
+    'CONFIG_A_LIMIT': cmd_config_a_limit,
+    'CONFIG_Z_PEEL_PROFILE': cmd_config_z_peel_profile,
+    'CONFIG_LEVEL': cmd_config_level,
+}
+# 需要向客户端推送进度事件的指令
+STREAMING_HANDLERS = ('NEXT_LAYER', 'GO')
+# 高优先级指令：由读取协程直接处理，不进入队列
+PRIORITY_HANDLERS = {
+    'STOP': cmd_stop,
+    'STATUS': cmd_status,
+    'POS': cmd_pos,
+    'PING': cmd_ping,
+    'LEVEL_FF': cmd_level_ff,
+    'TIME': cmd_time,
+}
+# 回复带数据的指令：二进制模式下 OK 回复也附带原文 (其余 OK 回复只有状态字节)
+DATA_HANDLERS = ('POS', 'STATUS', 'TIME')
+
+async def run_handler(handler, name, args, writer, binary):
+    if name in STREAMING_HANDLERS: return await handler(args, writer, binary)
+    return await handler(args)
+
 async def command_processor():
     print("指令處理器已啟動。")
-    params = {
-        'peel_lift_z1': 5.05, 'peel_return_z2': 5.0,
-        'z_speed_down': 20.0, 'z_speed_up': 20.0,
-        'wipe_speed_fast': 80.0, 'wipe_speed_slow': 10.0,
-    }
+    validate_sequence(LAYER_SEQUENCE)
     while True:
-        cmd, writer = await command_queue.get()
-        cmd_short = (cmd[:14] + '..') if len(cmd) > 16 else cmd; update_display("Status: Running", f"CMD: {cmd_short}"); response = ""; parts = cmd.split(','); command = parts[0].upper()
-        move_success = True 
+        name, args, writer, tag, binary = await command_queue.get()
+        update_display("Status: Running", f"CMD: {name[:14]}"); response = ""
+        handler = HANDLERS.get(name)
+        stops = current['stops']
+        while current['task'] is not None: motion_idle.clear(); await motion_idle.wait()  # 等液位补偿移动结束
         try:
-            if command == "CONFIG_AXIS":
-                axis, pulse_per_rev, lead = parts[1].lower(), float(parts[2]), float(parts[3])
-                if axis in steppers: steppers[axis].steps_per_mm = pulse_per_rev / lead; response = f"OK: Axis {axis} configured.\n"
-                else: response = "ERROR: Invalid axis.\n"
-            elif command == "CONFIG_Z_PEEL":
-                params['peel_lift_z1'], params['peel_return_z2'], params['z_speed_down'], params['z_speed_up'] = map(float, parts[1:]); response = "OK: Z peel params configured.\n"
-            elif command == "CONFIG_A_WIPE":
-                params['wipe_speed_fast'], params['wipe_speed_slow'] = map(float, parts[1:]); response = "OK: A wipe params configured.\n"
-
-            # --- 核心修改：NEXT_LAYER 移除并发，改为顺序执行 ---
-            elif command == "NEXT_LAYER":
-                print("[NL] NEW Sequence Started.")
-                
-                # --- 1. Z轴向下 (Return) [顺序执行] ---
-                print("[NL] Step 1: Z-Down (Return)...")
-                update_display("Status: Printing", "Action: Return", "Z-Down...")
-                
-                # (Z 轴方向修正)
-                await steppers['z'].move_rel(-params['peel_return_z2'], params['z_speed_up'], 0)
-                print("[NL] Step 1 Complete.")
-                await uasyncio.sleep_ms(100) 
-
-
-                # --- 2. A轴移动到远端 (Wipe) [顺序执行] ---
-                print("[NL] Step 2: A-to-End (Wipe)...")
-                update_display("Status: Printing", "Action: Wiping", "A-to-End")
-
-                move_success_a_end = await steppers['a'].move_until_trigger(is_forward=True, speed_mm_s=params['wipe_speed_fast'], trigger_pin=a_limit_end)
-                
-                if not move_success_a_end:
-                    raise RuntimeError("A to End failed (Limit Timeout?)")
-
-                # --- (重要) 增加 "A to End" 后的回退 ---
-                print("[NL] Backing off END switch...")
-                await steppers['a'].move_rel(-2.0, params['wipe_speed_slow'], 0) # 向后移动 2mm
-                await uasyncio.sleep_ms(100)
-                print("[NL] Step 2 Complete.")
-
-
-                # --- 3. Z轴上升 (Lift/Peel) [顺序执行] ---
-                print("[NL] Step 3: Z-Up (Peel)...")
-                update_display("Status: Printing", "Action: Peeling", "Z-Up...")
-                # (Z 轴方向修正)
-                await steppers['z'].move_rel(params['peel_lift_z1'], params['z_speed_down'], 0)
-                print("[NL] Step 3 Complete.")
-                await uasyncio.sleep_ms(1000) 
-
-
-                # --- 4. A轴回到 Home 端 [顺序执行] ---
-                print("[NL] Step 4: A-to-Home...")
-                update_display("Status: Printing", "Action: Wiping", "A-to-Home...")
-                move_success_a_home = await steppers['a'].move_until_trigger(is_forward=False, speed_mm_s=params['wipe_speed_slow'], trigger_pin=a_limit_home)
-
-                # (重试逻辑)
-                if not move_success_a_home:
-                    print("[NL] A to Home failed on first attempt. Retrying...")
-                    update_display("Status: Printing", "Action: Wiping", "Retry A Home")
-                    move_success_a_home = await steppers['a'].move_until_trigger(is_forward=False, speed_mm_s=params['wipe_speed_slow'], trigger_pin=a_limit_home)
-                    if not move_success_a_home: # 如果再次失败
-                        raise RuntimeError("A to Home failed after retry (Limit Timeout?)")
-
-                # --- (重要) 增加 "A to Home" 后的回退 ---
-                print("[NL] Backing off HOME switch...")
-                await steppers['a'].move_rel(2.0, params['wipe_speed_slow'], 0) # 向前移动 2mm
-                await uasyncio.sleep_ms(100)
-                
-                print("[NL] Step 4 Complete.")
-                print("[NL] NEW NEXT_LAYER sequence complete.")
-                response = "DONE\n"
-            # --- 修改结束 ---
-
-            elif command == "MOVE_REL":
-                axis, distance, speed, accel = parts[1].lower(), float(parts[2]), float(parts[3]), float(parts[4])
-                if axis in steppers: await steppers[axis].move_rel(distance, speed, accel); response = "DONE\n"
-                else: response = "ERROR: Invalid axis.\n"
-            else: response = "ERROR: Unknown command.\n"
+            if current['stops'] != stops: response = "ERROR: Stopped.\n"
+            elif handler is None: response = "ERROR: Unknown command.\n"
+            else:
+                # 作为独立任务运行，以便 CANCEL / STOP 在运动中途中止
+                current['task'] = uasyncio.create_task(run_handler(handler, name, args, writer, binary))
+                current['name'], current['writer'], current['tag'] = name, writer, tag
+                try: response = await current['task']
+                finally: current['task'] = None; current['name'] = None; current['writer'] = None; current['tag'] = None
+        except uasyncio.CancelledError:
+            print(f"指令 '{name}' 已中止。"); response = "ERROR: Cancelled.\n"
         except Exception as e:
-            print(f"處理指令 '{cmd}' 時發生錯誤:")
+            print(f"處理指令 '{name}' 時發生錯誤:")
             sys.print_exception(e) # 打印詳細錯誤
             update_display("Status: ERROR", "Processing err", str(e)); response = f"ERROR: Processing command failed: {e}\n"
 
-        if response and ("DONE" in response or "OK" in response): update_display("Status: Online", "Last OK", f"CMD: {cmd_short}")
+        if response and ("DONE" in response or "OK" in response): update_display("Status: Online", "Last OK", f"CMD: {name[:14]}")
         if response and writer:
             try:
-                print(f"Sending response: {response.strip()}") # 打印發送的回應
-                writer.write(response.encode()); await writer.drain()
+                await send_response(writer, tag, response, binary, name in DATA_HANDLERS)
             except OSError as e: print(f"發送回應失败，客戶端可能已斷開: {e}")
 
 async def main():
@@ -242,11 +989,18 @@ async def main():
         wlan = network.WLAN(network.STA_IF);
         if wlan.isconnected(): host_ip = wlan.ifconfig()[0]
     except Exception as e: print(f"無法獲取 IP: {e}")
+    try:
+        wlan.config(pm=wlan.PM_NONE)  # 关闭 Wi-Fi 省电：省电模式下回复延迟可达数百 ms，心跳会误判断线
+    except Exception as e: print(f"無法關閉 Wi-Fi 省電: {e}")
     update_display("Status: Ready", f"IP: {host_ip}", "Waiting Client..")
+    if OLED_AVAILABLE: uasyncio.create_task(display_task())
+    if level_adc is not None: uasyncio.create_task(level_task())
+    uasyncio.create_task(telemetry_task())
+    if SERIAL_UART_ID is not None: uasyncio.create_task(serial_server())
     server_task = uasyncio.create_task(tcp_server(host_ip, 8899)); processor_task = uasyncio.create_task(command_processor())
     print("ESP32 4-Axis Controller Ready."); await uasyncio.gather(server_task, processor_task)
 
-# --- 7. 主程式入口 ---
+# --- 9. 主程式入口 ---
 if __name__ == "__main__":
     try:
         uasyncio.run(main())
@@ -254,4 +1008,5 @@ if __name__ == "__main__":
         print("主循環發生致命錯誤:")
         sys.print_exception(e)
         update_display("FATAL ERROR", str(e))
+        if OLED_AVAILABLE: flush_display()  # 事件循环已退出，同步刷新
         time.sleep(10) # GND?
\ No newline at end of file
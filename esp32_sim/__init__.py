@@ -0,0 +1,11 @@
+# esp32_sim - ESP32 固件的主机端模拟器 (虚拟时钟、PWM 步进、限位开关、液位 ADC)
+# 用法:
+#     with SimulatedESP32(SimConfig(speed=10, port=0)) as sim:
+#         host, port = sim.address   # 交给 MotionController / AsyncMotionClient 连接
+
+from esp32_sim.clock import VirtualClock
+from esp32_sim.board import Board, AxisModel, LimitSwitch, LevelSensor
+from esp32_sim.simulator import SimConfig, SimulatedESP32, DEFAULT_FIRMWARE
+
+__all__ = ['VirtualClock', 'Board', 'AxisModel', 'LimitSwitch', 'LevelSensor',
+           'SimConfig', 'SimulatedESP32', 'DEFAULT_FIRMWARE']
@@ -0,0 +1,36 @@
+# python -m esp32_sim [--port 8899] [--speed 10] [--serial]
+# 在本机启动模拟的 ESP32，供 guitest.py / main_controller.py 连接 (IP 填 127.0.0.1)
+
+import argparse
+import time
+
+from esp32_sim import SimConfig, SimulatedESP32, DEFAULT_FIRMWARE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESP32 固件主机端模拟器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8899, help="0 = 随机端口")
+    parser.add_argument('--speed', type=float, default=1.0, help="虚拟时钟倍速")
+    parser.add_argument('--firmware', default=DEFAULT_FIRMWARE)
+    parser.add_argument('--no-pcnt', action='store_true', help="模拟无 PCNT 的 MicroPython 版本")
+    parser.add_argument('--serial', action='store_true', help="为 UART 串口链路创建伪终端 (仅 Linux / macOS)")
+    parser.add_argument('--verbose', action='store_true', help="打印固件输出")
+    args = parser.parse_args()
+
+    config = SimConfig(speed=args.speed, host=args.host, port=args.port, pcnt=not args.no_pcnt, quiet=not args.verbose,
+                       serial=args.serial)
+    sim = SimulatedESP32(config, args.firmware)
+    host, port = sim.start()
+    print(f"模拟 ESP32 已启动: {host}:{port} (倍速 {args.speed}x)，Ctrl+C 退出")
+    if sim.serial_port: print(f"串口链路: {sim.serial_port}")
+    try:
+        while sim.running: time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# esp32_sim/board.py
+# 功能：虚拟硬件。按 PWM 频率/占空比与 DIR 电平解析计算各轴的脉冲数与位置 (不逐个脉冲模拟)，
+# 限位开关按轴位置判定 (低电平有效)，并在预计越过触发点的时刻产生下降沿中断；
+# 液位传感器 ADC 读数由 B 轴位置、树脂消耗漂移与噪声合成。
+# 所有方法都只在模拟器的事件循环线程中调用。
+
+import random
+
+PWM_DUTY_MAX = 1023
+IRQ_RISING, IRQ_FALLING = 1, 2
+EDGE_EPSILON_STEPS = 1e-6
+
+
+class AxisModel:
+    """一个步进轴：STEP 引脚上的 PWM 每个周期输出一个脉冲，DIR 低电平为正方向 (与固件一致)"""
+
+    def __init__(self, board, name, step_pin, dir_pin, steps_per_mm, start_mm=0.0):
+        self.board = board; self.name = name
+        self.step_pin = step_pin; self.dir_pin = dir_pin
+        self.steps_per_mm = float(steps_per_mm)
+        self.position_steps = start_mm * self.steps_per_mm  # 连续量，整数部分即已输出的脉冲
+        self.pulses = 0.0        # 上电以来输出的脉冲总数 (不分方向)
+        self.freq = 0; self.duty = 0; self.dir_level = 0
+        self._since = board.clock.now()
+
+    @property
+    def running(self):
+        return self.freq > 0 and self.duty > 0
+
+    @property
+    def rate(self):
+        """带符号的步进速率 (步/s)"""
+        if not self.running: return 0.0
+        return -float(self.freq) if self.dir_level else float(self.freq)
+
+    def position_mm(self):
+        self.settle()
+        return self.position_steps / self.steps_per_mm
+
+    def pulse_count(self):
+        self.settle()
+        return int(self.pulses)
+
+    def settle(self):
+        """把上次状态变化以来的输出结算到位置与脉冲总数"""
+        now = self.board.clock.now()
+        dt = now - self._since; self._since = now
+        if dt > 0 and self.running:
+            self.pulses += self.freq * dt
+            self.position_steps += self.rate * dt
+
+    def set_pwm(self, freq=None, duty=None):
+        self.settle()
+        if freq is not None: self.freq = freq
+        if duty is not None: self.duty = duty
+        self.board.reschedule_limits(self)
+
+    def set_dir(self, level):
+        self.settle()
+        self.dir_level = 1 if level else 0
+        self.board.reschedule_limits(self)
+
+
+class LimitSwitch:
+    """kind='min'：位置 <= 触发点时触发；kind='max'：位置 >= 触发点时触发。输出低电平有效"""
+
+    def __init__(self, pin, axis, position_mm, kind):
+        if kind not in ('min', 'max'): raise ValueError(f"限位类型必须为 'min' 或 'max': {kind}")
+        self.pin = pin; self.axis = axis; self.position_mm = float(position_mm); self.kind = kind
+        self.irq_handler = None; self.irq_trigger = 0; self.irq_pin = None
+        self.timer = None        # 已预约的越过触发点回调
+        self.trigger_count = 0
+
+    def _distance_steps(self):
+        # 距触发点的步数，<= 0 表示已触发
+        target = self.position_mm * self.axis.steps_per_mm
+        return (self.axis.position_steps - target) if self.kind == 'min' else (target - self.axis.position_steps)
+
+    def triggered(self):
+        self.axis.settle()
+        return self._distance_steps() <= EDGE_EPSILON_STEPS
+
+    def value(self):
+        return 0 if self.triggered() else 1
+
+
+class LevelSensor:
+    """HGC-1030 模拟输出：B 轴负方向使液位上升 (读数增大)；消耗使读数随时间下降；含噪声与偶发尖峰"""
+
+    def __init__(self, board, axis='b', base=2000.0, gain_per_mm=400.0, drift_per_s=-0.5,
+                 noise=3.0, spike_rate=0.01, spike_size=300.0, seed=0):
+        self.board = board; self.axis = axis
+        self.base = base; self.gain_per_mm = gain_per_mm; self.drift_per_s = drift_per_s
+        self.noise = noise; self.spike_rate = spike_rate; self.spike_size = spike_size
+        self.rng = random.Random(seed)
+        self.consumed = 0.0      # 外部注入的消耗 (读数)，如模拟每层固化
+        self.reads = 0
+        self._b0 = None
+
+    def true_value(self):
+        b_mm = self.board.axes[self.axis].position_mm()
+        if self._b0 is None: self._b0 = b_mm
+        return self.base + self.gain_per_mm * (self._b0 - b_mm) + self.drift_per_s * self.board.clock.now() - self.consumed
+
+    def read(self):
+        self.reads += 1
+        value = self.true_value() + self.rng.gauss(0.0, self.noise)
+        if self.rng.random() < self.spike_rate: value += self.rng.choice((-1, 1)) * self.spike_size
+        return min(4095, max(0, int(value)))
+
+
+class Board:
+    def __init__(self, clock, loop):
+        self.clock = clock; self.loop = loop
+        self.axes = {}
+        self.step_axes = {}; self.dir_axes = {}   # 引脚号 -> AxisModel
+        self.limits = {}                          # 引脚号 -> LimitSwitch
+        self.adcs = {}                            # 引脚号 -> 带 read() 的模型
+        self.outputs = {}                         # 其余输出引脚的电平
+        self.display = None                       # sh1106 实例 (由固件创建)
+
+    def add_axis(self, name, step_pin, dir_pin, steps_per_mm, start_mm=0.0):
+        axis = AxisModel(self, name, step_pin, dir_pin, steps_per_mm, start_mm)
+        self.axes[name] = axis; self.step_axes[step_pin] = axis; self.dir_axes[dir_pin] = axis
+        return axis
+
+    def add_limit(self, pin, axis, position_mm, kind):
+        switch = LimitSwitch(pin, self.axes[axis], position_mm, kind)
+        self.limits[pin] = switch
+        return switch
+
+    def add_adc(self, pin, model):
+        self.adcs[pin] = model
+        return model
+
+    # --- 引脚 ---
+    def write_pin(self, pin, value):
+        axis = self.dir_axes.get(pin)
+        if axis is not None: axis.set_dir(value)
+        else: self.outputs[pin] = 1 if value else 0
+
+    def read_pin(self, pin):
+        switch = self.limits.get(pin)
+        if switch is not None: return switch.value()
+        axis = self.dir_axes.get(pin)
+        if axis is not None: return axis.dir_level
+        return self.outputs.get(pin, 1)  # 未接线的输入按上拉处理
+
+    def set_irq(self, pin_obj, handler, trigger):
+        switch = self.limits.get(pin_obj.id)
+        if switch is None: return
+        switch.irq_handler = handler; switch.irq_trigger = trigger; switch.irq_pin = pin_obj
+        self._schedule(switch)
+
+    # --- 限位边沿 ---
+    def reschedule_limits(self, axis):
+        for switch in self.limits.values():
+            if switch.axis is axis: self._schedule(switch)
+
+    def _schedule(self, switch):
+        if switch.timer is not None: switch.timer.cancel(); switch.timer = None
+        if switch.irq_handler is None or not switch.irq_trigger & IRQ_FALLING or switch.triggered(): return
+        rate = switch.axis.rate
+        approaching = rate < 0 if switch.kind == 'min' else rate > 0
+        if not approaching: return
+        dt = switch._distance_steps() / abs(rate)
+        switch.timer = self.loop.call_later(self.clock.real_delay(dt), self._fire, switch)
+
+    def _fire(self, switch):
+        switch.timer = None
+        if not switch.triggered():
+            # 回调提前于数值上的越过时刻 (浮点误差)，重新预约
+            self._schedule(switch); return
+        switch.trigger_count += 1
+        if switch.irq_handler is not None: switch.irq_handler(switch.irq_pin)
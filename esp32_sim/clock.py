@@ -0,0 +1,26 @@
+# esp32_sim/clock.py
+# 功能：虚拟时钟。虚拟时间 = 真实经过时间 × speed，固件看到的 ticks_ms/ticks_us 与 sleep_ms 都按此缩放，
+# speed > 1 时运动序列比真实时间更快完成，而相对时序保持不变。
+
+import time
+
+
+class VirtualClock:
+    def __init__(self, speed=1.0):
+        if speed <= 0: raise ValueError("speed 必须为正数")
+        self.speed = float(speed)
+        self._t0 = time.perf_counter()
+
+    def now(self):
+        """当前虚拟时间 (秒)"""
+        return (time.perf_counter() - self._t0) * self.speed
+
+    def real_delay(self, virtual_s):
+        """虚拟时长 -> 需要真实等待的秒数"""
+        return max(0.0, virtual_s) / self.speed
+
+    def ticks_ms(self):
+        return int(self.now() * 1000)
+
+    def ticks_us(self):
+        return int(self.now() * 1_000_000)
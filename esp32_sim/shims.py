@@ -0,0 +1,329 @@
+# esp32_sim/shims.py
+# 功能：MicroPython 模块替身 (machine / uasyncio / time / sys / sh1106 / network / esp32)。
+# 每个模拟器实例生成一组独立的模块对象，绑定到自己的 Board 与 VirtualClock；
+# 固件中所有时间相关调用都按虚拟时钟缩放。
+
+import asyncio
+import os
+import sys as _sys
+import time as _time
+import traceback
+import types
+
+from esp32_sim.board import IRQ_RISING, IRQ_FALLING, PWM_DUTY_MAX
+
+
+# --- 1. machine ---
+class UartStream:
+    """uasyncio.StreamReader / StreamWriter(uart) 的替身：经事件循环监听伪终端主端 (非阻塞)。
+    实际 UART 发送不受接收方影响，因此 PC 端长时间不读、缓冲区满时丢弃数据而不是阻塞固件"""
+
+    def __init__(self, fd, loop):
+        self.fd = fd; self._out = bytearray()
+        self._reader = asyncio.StreamReader()
+        loop.add_reader(fd, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            self._reader.feed_data(os.read(self.fd, 4096))
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    async def readexactly(self, n): return await self._reader.readexactly(n)
+    async def readline(self): return await self._reader.readline()
+    def write(self, data): self._out += data
+
+    async def drain(self):
+        for _ in range(200):
+            if not self._out: return
+            try:
+                del self._out[:os.write(self.fd, self._out)]
+            except BlockingIOError:
+                await asyncio.sleep(0.001)
+        self._out.clear()
+
+    def close(self): pass
+    async def wait_closed(self): pass
+
+
+def make_machine(board, uart_fd=None):
+    """uart_fd: 串口链路的伪终端主端 (None = 固件创建 UART 时失败)"""
+    mod = types.ModuleType('machine')
+
+    class Pin:
+        IN, OUT, OPEN_DRAIN = 1, 3, 7
+        PULL_UP, PULL_DOWN = 2, 1
+        IRQ_RISING, IRQ_FALLING = IRQ_RISING, IRQ_FALLING
+
+        def __init__(self, id, mode=None, pull=None, value=None):
+            self.id = id; self.mode = mode; self.pull = pull
+            if value is not None: self.value(value)
+
+        def value(self, v=None):
+            if v is None: return board.read_pin(self.id)
+            axis = board.step_axes.get(self.id)
+            if axis is None: board.write_pin(self.id, v)
+            # STEP 引脚由 PWM 驱动，直接写电平不产生脉冲
+
+        def on(self): self.value(1)
+        def off(self): self.value(0)
+
+        def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+            board.set_irq(self, handler, trigger)
+
+        def __repr__(self):
+            return f"Pin({self.id})"
+
+    class PWM:
+        def __init__(self, pin, freq=None, duty=None):
+            self.pin = pin; self._freq = 0; self._duty = 0
+            self.axis = board.step_axes.get(pin.id)
+            self.init(freq, duty)
+
+        def init(self, freq=None, duty=None):
+            if freq is not None: self._freq = int(freq)
+            if duty is not None: self._duty = max(0, min(PWM_DUTY_MAX, int(duty)))
+            if self.axis is not None: self.axis.set_pwm(self._freq, self._duty)
+
+        def freq(self, value=None):
+            if value is None: return self._freq
+            if value <= 0: raise ValueError("frequency must be from 1Hz to 40MHz")
+            self.init(freq=value)
+
+        def duty(self, value=None):
+            if value is None: return self._duty
+            self.init(duty=value)
+
+        def deinit(self):
+            self.init(duty=0)
+
+    class ADC:
+        ATTN_0DB, ATTN_2_5DB, ATTN_6DB, ATTN_11DB = 0, 1, 2, 3
+
+        def __init__(self, pin):
+            self.model = board.adcs.get(pin.id)
+            if self.model is None: raise ValueError(f"invalid Pin for ADC: {pin.id}")
+            self.attenuation = self.ATTN_0DB
+
+        def atten(self, value): self.attenuation = value
+        def read(self): return self.model.read()
+        def read_u16(self): return self.model.read() << 4
+
+    class I2C:
+        def __init__(self, id, scl=None, sda=None, freq=400000):
+            self.id = id; self.scl = scl; self.sda = sda; self.freq = freq
+
+        def scan(self): return [0x3c]
+        def writeto(self, addr, buf): return len(buf)
+
+    class Timer:
+        ONE_SHOT, PERIODIC = 0, 1
+
+        def __init__(self, id=-1):
+            self.id = id; self._handle = None
+
+        def init(self, mode=PERIODIC, period=-1, freq=None, callback=None):
+            self.deinit()
+            if freq is not None: period = 1000 / freq
+            self._mode = mode; self._period = period; self._callback = callback
+            self._arm()
+
+        def _arm(self):
+            self._handle = board.loop.call_later(board.clock.real_delay(self._period / 1000), self._fire)
+
+        def _fire(self):
+            self._handle = None
+            if self._mode == self.PERIODIC: self._arm()
+            if self._callback is not None: self._callback(self)
+
+        def deinit(self):
+            if self._handle is not None: self._handle.cancel(); self._handle = None
+
+    class UART:
+        def __init__(self, id, baudrate=115200, tx=None, rx=None, rxbuf=256, **kwargs):
+            if uart_fd is None: raise OSError(f"UART{id} 未连接 (模拟器需 SimConfig(serial=True))")
+            self.id = id; self.baudrate = baudrate; self._stream = None
+
+        def async_stream(self):
+            if self._stream is None: self._stream = UartStream(uart_fd, board.loop)
+            return self._stream
+
+    class Mem32(dict):
+        """machine.mem32 的替身：寄存器读写只做记录 (固件用于 IO_MUX 输入使能，模拟的 PCNT 不依赖引脚配置)"""
+
+        def __getitem__(self, addr): return self.get(addr, 0)
+        def __setitem__(self, addr, value): super().__setitem__(addr, value & 0xFFFFFFFF)
+
+    mod.Pin = Pin; mod.PWM = PWM; mod.ADC = ADC; mod.I2C = I2C; mod.Timer = Timer; mod.UART = UART
+    mod.mem32 = Mem32()
+    mod.freq = lambda *args: 240000000
+    # 中断处理函数由事件循环调用，不会打断固件代码，关中断无需实际动作
+    mod.disable_irq = lambda: 0
+    mod.enable_irq = lambda state=0: None
+    mod.reset = lambda: None
+    return mod
+
+
+# --- 2. time ---
+def make_time(clock):
+    mod = types.ModuleType('time')
+    mod.ticks_ms = clock.ticks_ms
+    mod.ticks_us = clock.ticks_us
+    mod.ticks_diff = lambda a, b: a - b
+    mod.ticks_add = lambda a, b: a + b
+    mod.time = lambda: clock.now()
+    # 同步睡眠会阻塞整个模拟器 (与真机阻塞事件循环的效果一致)
+    mod.sleep = lambda s: _time.sleep(clock.real_delay(s))
+    mod.sleep_ms = lambda ms: _time.sleep(clock.real_delay(ms / 1000))
+    mod.sleep_us = lambda us: _time.sleep(clock.real_delay(us / 1_000_000))
+    return mod
+
+
+# --- 3. uasyncio ---
+class ThreadSafeFlag:
+    """与 MicroPython 一致：wait() 返回时自动清除标志"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self): self._event.set()
+    def clear(self): self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+def make_uasyncio(clock, server_config):
+    """server_config: {'host', 'port'} 覆盖固件的监听地址 (port 0 = 临时端口)；
+    绑定完成后写入 'bound' (host, port) 与 'server'，并调用 'on_bound'；'clients' 为当前连接"""
+    mod = types.ModuleType('uasyncio')
+    for name in ('Event', 'Lock', 'create_task', 'gather', 'CancelledError', 'TimeoutError',
+                 'run', 'get_event_loop', 'current_task'):
+        setattr(mod, name, getattr(asyncio, name))
+    mod.ThreadSafeFlag = ThreadSafeFlag
+
+    async def sleep(s): await asyncio.sleep(clock.real_delay(s))
+    async def sleep_ms(ms): await asyncio.sleep(clock.real_delay(ms / 1000))
+    async def wait_for(aw, timeout): return await asyncio.wait_for(aw, None if timeout is None else clock.real_delay(timeout))
+    async def wait_for_ms(aw, timeout): return await asyncio.wait_for(aw, clock.real_delay(timeout / 1000))
+
+    async def start_server(callback, host, port, backlog=5):
+        clients = server_config.setdefault('clients', {})  # writer -> 连接处理任务，停止模拟器时先关闭连接
+
+        async def handle(reader, writer):
+            clients[writer] = asyncio.current_task()
+            try:
+                await callback(reader, writer)
+            finally:
+                clients.pop(writer, None)
+
+        server = await asyncio.start_server(handle, server_config['host'], server_config['port'], backlog=backlog)
+        server_config['server'] = server
+        server_config['bound'] = server.sockets[0].getsockname()[:2]
+        on_bound = server_config.get('on_bound')
+        if on_bound: on_bound(server_config['bound'])
+        return server
+
+    def stream(obj, extra=None): return obj.async_stream()  # 固件只对 machine.UART 构造流
+
+    mod.sleep = sleep; mod.sleep_ms = sleep_ms; mod.wait_for = wait_for; mod.wait_for_ms = wait_for_ms
+    mod.start_server = start_server
+    mod.StreamReader = mod.StreamWriter = mod.Stream = stream
+    return mod
+
+
+# --- 4. sys ---
+def make_sys(console):
+    mod = types.ModuleType('sys')
+
+    def print_exception(exc, file=None):
+        lines = traceback.format_exception(type(exc), exc, exc.__traceback__)
+        if file is None: console("".join(lines).rstrip())
+        else: file.write("".join(lines))
+
+    mod.print_exception = print_exception
+    mod.implementation = types.SimpleNamespace(name='micropython', version=(1, 24, 0))
+    mod.platform = 'esp32'
+    mod.__getattr__ = lambda name: getattr(_sys, name)  # 其余属性转发到宿主 sys
+    return mod
+
+
+# --- 5. sh1106 ---
+def make_sh1106(board):
+    mod = types.ModuleType('sh1106')
+
+    class SH1106_I2C:
+        """只记录文字内容 (按行 y 坐标)，不模拟像素"""
+
+        def __init__(self, width, height, i2c, res=None, addr=0x3c, rotate=0, external_vcc=False):
+            self.width = width; self.height = height; self.i2c = i2c; self.addr = addr
+            self.rows = {}; self.shown = {}; self.show_count = 0
+            board.display = self
+
+        def fill(self, color): self.rows.clear()
+
+        def fill_rect(self, x, y, w, h, color):
+            for row in [r for r in self.rows if y <= r < y + h]: del self.rows[row]
+
+        def text(self, string, x, y, color=1):
+            self.rows[y] = self.rows.get(y, "")[:x // 8].ljust(x // 8) + string
+
+        def show(self, full_update=True):
+            self.shown = dict(self.rows); self.show_count += 1
+
+        def lines(self):
+            return [self.shown[y] for y in sorted(self.shown)]
+
+        def poweron(self): pass
+        def poweroff(self): pass
+        def contrast(self, value): pass
+
+    mod.SH1106_I2C = SH1106_I2C
+    return mod
+
+
+# --- 6. network ---
+def make_network(host_ip):
+    mod = types.ModuleType('network')
+    mod.STA_IF, mod.AP_IF = 0, 1
+
+    class WLAN:
+        PM_NONE, PM_PERFORMANCE, PM_POWERSAVE = 0, 1, 2
+
+        def __init__(self, interface=0): self.interface = interface
+        def config(self, **kwargs): pass
+        def active(self, *args): return True
+        def isconnected(self): return True
+        def ifconfig(self): return (host_ip, '255.255.255.0', host_ip, host_ip)
+
+    mod.WLAN = WLAN
+    return mod
+
+
+# --- 7. esp32 ---
+def make_esp32(board):
+    mod = types.ModuleType('esp32')
+
+    class PCNT:
+        """计数对应 STEP 引脚所属轴输出的脉冲；value(0) 返回当前值并清零。
+        与硬件一致为 16 位有符号计数器，超出 -32768..32767 时回绕 (固件须周期性读取)"""
+        INCREMENT, DECREMENT, IGNORE = 1, -1, 0
+
+        def __init__(self, id, pin=None, rising=0, falling=0, **kwargs):
+            self.id = id
+            self.axis = board.step_axes.get(pin.id) if pin is not None else None
+            if self.axis is None: raise ValueError(f"PCNT {id}: pin not connected to an axis")
+            self.rising = rising; self._base = self.axis.pulse_count(); self._running = False
+
+        def start(self): self._running = True; self._base = self.axis.pulse_count()
+        def stop(self): self._running = False
+
+        def value(self, reset=None):
+            total = self.axis.pulse_count()
+            count = (total - self._base) * self.rising if self._running else 0
+            if reset is not None: self._base = total
+            return ((count + 0x8000) & 0xFFFF) - 0x8000
+
+    mod.PCNT = PCNT
+    return mod
@@ -0,0 +1,196 @@
+# esp32_sim/simulator.py
+# 功能：在 CPython 上原样运行 esp32/main.py。
+# 固件源码在模拟器自己的事件循环线程中执行，import 被重定向到本实例的模块替身；
+# 固件监听真实的 localhost TCP 端口，PC 端 MotionController / motion_client 无需修改即可连接。
+# serial=True 时另建伪终端对 (仅 POSIX)：固件的 UART 接主端，PC 端以 serial_port (从端路径) 作为串口打开。
+# 注意：只有固件中的 sleep / ticks 按虚拟时钟缩放，固件代码本身的 CPU 耗时不缩放，
+# speed 越大，调度延迟折算成的虚拟时间越长 (表现为补步/多步增多)，精确测时建议 speed <= 10。
+
+import asyncio
+import builtins
+import collections
+import os
+import threading
+
+from esp32_sim import shims
+from esp32_sim.board import Board, LevelSensor
+from esp32_sim.clock import VirtualClock
+
+DEFAULT_FIRMWARE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'esp32', 'main.py')
+
+
+class SimConfig:
+    """模拟器参数。axes: 名称 -> (STEP 引脚, DIR 引脚, 步/mm, 初始位置 mm)，按实机 PrintConfig 的脉冲数/导程；
+    limits: 引脚 -> (轴, 触发位置 mm, 'min' | 'max')；level: LevelSensor 参数；level_pin=None 表示不接液位传感器；
+    serial: 是否为固件的 UART 串口链路创建伪终端对"""
+
+    def __init__(self, speed=1.0, host='127.0.0.1', port=8899, pcnt=True, quiet=True,
+                 axes=None, limits=None, level_pin=34, level=None, console_lines=500, serial=False):
+        self.speed = speed
+        self.host = host; self.port = port
+        self.serial = serial
+        self.pcnt = pcnt
+        self.quiet = quiet
+        self.axes = axes if axes is not None else {
+            'z': (26, 25, 12800 / 5.0, 50.0),
+            'a': (14, 27, 12800 / 75.0, 1.0),
+            'b': (19, 18, 3200 / 1.0, 0.0),
+            'c': (17, 16, 12800 / 5.0, 0.0),
+        }
+        self.limits = limits if limits is not None else {32: ('a', 0.0, 'min'), 33: ('a', 120.0, 'max')}
+        self.level_pin = level_pin
+        self.level = level if level is not None else {}
+        self.console_lines = console_lines
+
+
+class SimulatedESP32:
+    def __init__(self, config=None, firmware_path=DEFAULT_FIRMWARE):
+        self.config = config or SimConfig()
+        self.firmware_path = firmware_path
+        self.clock = None; self.board = None; self.loop = None
+        self.firmware = None      # 固件模块的全局命名空间 (可检查 steppers / plan / level 等)
+        self.address = None
+        self.serial_port = None   # serial=True 时为伪终端从端路径 (如 /dev/pts/3)
+        self._pty = None
+        self.console = collections.deque(maxlen=self.config.console_lines)
+        self._server = {}
+        self._thread = None; self._main_task = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # --- 启动 / 停止 ---
+    def start(self, timeout=10.0):
+        """在后台线程启动固件，等待 TCP 监听就绪后返回 (host, port)"""
+        if self.running: return self.address
+        ready = threading.Event(); error = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.loop.run_until_complete(self._boot(ready))
+            except BaseException as e:
+                error.append(e); ready.set(); return
+            try:
+                self.loop.run_forever()
+            finally:
+                self._shutdown_loop()
+
+        self._thread = threading.Thread(target=run, name="esp32-sim", daemon=True)
+        self._thread.start()
+        if not ready.wait(timeout):
+            self.stop(); raise TimeoutError(f"模拟器在 {timeout}s 内未开始监听")
+        if error: self._thread.join(); raise RuntimeError(f"固件启动失败: {error[0]!r}") from error[0]
+        if self._main_task_failed(): raise RuntimeError(f"固件 main() 退出: {list(self.console)[-5:]}")
+        return self.address
+
+    def stop(self):
+        if not self.running: return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        self.start(); return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def _boot(self, ready):
+        self.clock = VirtualClock(self.config.speed)
+        self.board = board = Board(self.clock, asyncio.get_running_loop())
+        for name, (step_pin, dir_pin, steps_per_mm, start_mm) in self.config.axes.items():
+            board.add_axis(name, step_pin, dir_pin, steps_per_mm, start_mm)
+        for pin, (axis, position_mm, kind) in self.config.limits.items():
+            board.add_limit(pin, axis, position_mm, kind)
+        if self.config.level_pin is not None:
+            board.add_adc(self.config.level_pin, LevelSensor(board, **self.config.level))
+
+        def on_bound(address):
+            self.address = address; ready.set()
+
+        self._server = {'host': self.config.host, 'port': self.config.port, 'on_bound': on_bound}
+        if self.config.serial: self._open_pty()
+        modules = {
+            'machine': shims.make_machine(board, self._pty[0] if self._pty else None),
+            'time': shims.make_time(self.clock),
+            'uasyncio': shims.make_uasyncio(self.clock, self._server),
+            'sys': shims.make_sys(self._print),
+            'sh1106': shims.make_sh1106(board),
+            'network': shims.make_network(self.config.host),
+        }
+        if self.config.pcnt: modules['esp32'] = shims.make_esp32(board)
+        self.firmware = self._load_firmware(modules)
+        # 固件在入口 (__name__ == "__main__") 中调用 uasyncio.run(main())，这里改为在已有循环中创建任务
+        self._main_task = asyncio.ensure_future(self.firmware['main']())
+        self._main_task.add_done_callback(lambda t: ready.set())  # main 提前退出时不必等到超时
+
+    def _load_firmware(self, modules):
+        real_import = builtins.__import__
+
+        def sim_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level == 0 and name in modules: return modules[name]
+            if level == 0 and name == 'esp32': raise ImportError("no module named 'esp32'")  # 模拟无 PCNT 的固件版本
+            return real_import(name, globals, locals, fromlist, level)
+
+        sim_builtins = dict(vars(builtins)); sim_builtins['__import__'] = sim_import; sim_builtins['print'] = self._print
+        namespace = {'__name__': 'esp32_firmware', '__file__': self.firmware_path, '__builtins__': sim_builtins}
+        with open(self.firmware_path, encoding='utf-8') as f:
+            code = compile(f.read(), self.firmware_path, 'exec')
+        exec(code, namespace)
+        return namespace
+
+    def _open_pty(self):
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)  # 关闭回显与行编辑，否则固件会读到自己发出的数据
+        os.set_blocking(master, False)
+        self._pty = (master, slave); self.serial_port = os.ttyname(slave)  # 保持从端打开，PC 端关闭串口时主端不会出错
+
+    def _main_task_failed(self):
+        return self._main_task is not None and self._main_task.done()
+
+    def _shutdown_loop(self):
+        self.loop.run_until_complete(self._close_links())
+        # command_processor 把 CancelledError 当作 STOP 处理后继续循环，运动进行中停止时需再次取消
+        for _ in range(10):
+            tasks = asyncio.all_tasks(self.loop)
+            if not tasks: break
+            for task in tasks: task.cancel()
+            self.loop.run_until_complete(asyncio.wait(tasks, timeout=0.2))
+        if self._pty:
+            self.loop.remove_reader(self._pty[0])
+            for fd in self._pty: os.close(fd)
+            self._pty = None
+        self.loop.close()
+
+    async def _close_links(self):
+        """先关闭客户端连接，让固件的连接处理正常结束 (读到 EOF)，再关闭监听；直接取消处理任务会打印 CancelledError"""
+        server = self._server.get('server')
+        if server is not None: server.close()
+        clients = dict(self._server.get('clients', {}))
+        for writer in clients: writer.close()
+        if clients: await asyncio.wait(list(clients.values()), timeout=2.0)
+        if server is not None: await server.wait_closed()
+
+    def _print(self, *args, sep=' ', end='\n', **kwargs):
+        line = sep.join(str(a) for a in args)
+        self.console.append(line)
+        if not self.config.quiet: print(f"[esp32] {line}")
+
+    # --- 检查接口 (线程安全) ---
+    def call(self, func, *args, timeout=5.0):
+        """在模拟器线程中执行 func(*args) 并返回结果，用于读取固件/硬件状态"""
+        async def run(): return func(*args)
+        return asyncio.run_coroutine_threadsafe(run(), self.loop).result(timeout)
+
+    def axis_position(self, axis):
+        """硬件层面的实际位置 (mm)，与固件位置寄存器对比可发现丢步"""
+        return self.call(lambda: self.board.axes[axis].position_mm())
+
+    def display_lines(self):
+        return self.call(lambda: self.board.display.lines() if self.board.display else [])
+
+    def virtual_time(self):
+        return self.clock.now()
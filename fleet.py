@@ -0,0 +1,509 @@
+# fleet.py
+# 功能：无界面的多打印机控制器 (单进程、单个 asyncio 事件循环)。
+# - 每台打印机有独立的 ESP32 连接 (AsyncMotionClient 直接运行在本事件循环中，不另开通信线程)、投影进程与光机后端
+# - 投影与光机都是阻塞调用，分别在该打印机专属的单线程执行器中执行 (光机 UIA 对象始终在同一线程使用)，
+#   一台机器卡住 (UIA 超时、投影进程无响应) 只阻塞它自己的线程，不影响其他机器
+# - 相同切片包的解压与逐层像素统计由 SliceCache 在所有机器之间共享 (统计在解码进程池中完成)
+# - 每台机器有独立的时间线，指标以 printer 标签区分，由同一个 /metrics 端点提供
+# 用法: python fleet.py fleet.json   (格式见 README「多打印機控制」)
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import traceback
+
+from guitest import (PrintConfig, MotionController, LightEngineControl, ProjectorProcessManager,
+                     default_print_params, with_overrides, exposure_time)
+from motion_client import AsyncMotionClient
+from motion_plan import build_motion_plan, layer_motion_from_params, plan_commands, layer_motion_deadline
+from layer_trace import Tracer, NULL_TRACER, now_ns
+from print_metrics import REGISTRY, TraceMetrics, MetricsServer
+from slice_cache import SliceCache
+from job_queue import JobQueue, JOB_QUEUE_PATH
+
+
+# --- 1. 协程版运动控制 ---
+class AsyncMotionController(MotionController):
+    """MotionController 的协程版本：继承的 config_* / move_* 等方法返回协程 (需 await)，
+    submit_command 返回 asyncio.Task。不支持依赖阻塞等待的 query_time (固件遥测)"""
+
+    async def connect(self):
+        try:
+            self.link = AsyncMotionClient(self.host, self.port, connect_timeout=self.timeout, heartbeat=self.heartbeat,
+                                          heartbeat_timeout=self.heartbeat_timeout, transports=self.transports())
+            await self.link.connect()
+        except asyncio.TimeoutError:
+            await self.disconnect(); return False, f"连接超时 ({self.timeout}s)"
+        except Exception as e:
+            await self.disconnect(); return False, f"连接失败: {e}"
+        self.link.add_event_listener(self._on_event)
+        self._is_connected = True
+        return True, self._connected_message(self.link)
+
+    async def disconnect(self):
+        if self.link:
+            try:
+                await self.link.close()
+            except Exception:
+                pass
+        self.link = None; self._is_connected = False
+
+    def is_connected(self):
+        return self._is_connected and self.link is not None and self.link.connected
+
+    def submit_command(self, cmd, deadline=None):
+        if not self.is_connected(): raise RuntimeError("未连接")
+        return asyncio.ensure_future(self.link.request(cmd, self.timeout if deadline is None else deadline))
+
+    async def send_command(self, cmd, deadline=None):
+        if not self.is_connected(): return False, "未连接"
+        return await self.submit_command(cmd, deadline)
+
+    async def upload_plan(self, entries):
+        if not self.is_connected(): return False, "未连接"
+        commands = plan_commands(entries)
+        results = await asyncio.gather(*(self.submit_command(cmd) for cmd in commands))
+        for cmd, (success, response) in zip(commands, results):
+            if not success: return False, f"{cmd.split(',')[0]} 失败: {response}"
+        return True, f"运动计划已上传 ({len(entries)} 条, {sum(e.repeat for e in entries)} 层)"
+
+
+# --- 2. 单台打印机 ---
+# _configure 下发到固件的参数；任务覆盖了其中任一项时，打印前重新下发配置
+CONFIG_KEYS = ('z_pulse_rev', 'z_lead', 'a_pulse_rev', 'a_lead', 'b_pulse_rev', 'b_lead', 'c_pulse_rev', 'c_lead',
+               'peel_lift_z1', 'peel_return_z2', 'z_speed_down', 'z_speed_up', 'a_fast_speed', 'a_slow_speed',
+               'z_break_dist', 'z_break_speed', 'z_approach_dist', 'z_approach_speed', 'a_home_clearance',
+               'z_accel', 'a_accel', 'ramp_profile', 'a_limit_release', 'a_prehome',
+               'level_enabled', 'level_setpoint', 'level_kp', 'level_ki')
+# 已准备好的任务：切片 (缓存中，打印结束后需 release)、运动计划、合并后的打印参数
+PreparedJob = collections.namedtuple('PreparedJob', 'slices plan params')
+
+
+class PrinterConfig:
+    """fleet.json 中的一台打印机。params 覆盖 default_print_params 的同名键 (曝光时间、速度等)"""
+
+    def __init__(self, name, esp32_ip, esp32_port=PrintConfig.ESP32_PORT, monitor_index=PrintConfig.PROJECTOR_MONITOR_INDEX,
+                 projector_port=6000, light_engine_title="Full-HD UV LE Controller v2.1",
+                 controller_exe_path=PrintConfig.CONTROLLER_EXE_PATH, esp32_serial=None, params=None):
+        self.name = name
+        self.params = default_print_params(esp32_ip=esp32_ip, esp32_port=esp32_port, esp32_serial=esp32_serial,
+                                           monitor_index=monitor_index, controller_exe_path=controller_exe_path,
+                                           trace_dir=None, telemetry=False)
+        self.params = with_overrides(self.params, params or {})
+        self.projector_port = projector_port
+        self.light_engine_title = light_engine_title
+
+
+class FleetPrinter:
+    """一台打印机的设备会话与打印循环。所有协程在舰队事件循环中运行；
+    projector_factory / light_engine_factory 可替换为模拟后端 (参见 benchmarks/standins.py)"""
+
+    def __init__(self, config, slice_cache, log=print,
+                 projector_factory=ProjectorProcessManager, light_engine_factory=LightEngineControl):
+        self.config = config; self.name = config.name; self.params = config.params
+        self.slice_cache = slice_cache
+        self._log = log
+        self.projector_factory = projector_factory; self.light_engine_factory = light_engine_factory
+        traced = self.params['trace_dir'] or self.params['metrics_port']
+        self.tracer = Tracer(PrintConfig.TRACE_CAPACITY) if traced else NULL_TRACER
+        if self.params['metrics_port']: self.tracer.add_listener(TraceMetrics(REGISTRY, self.name).on_span)
+        # 投影与光机各一个专属线程：两者互不等待，且 UIA 对象不跨线程
+        self._projector_io = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f"{self.name}-projector")
+        self._light_io = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f"{self.name}-light")
+        self.motion = None; self.projector = None; self.light_engine = None
+        self.state = "idle"; self.layer = 0; self.total_layers = 0
+        self.level_ff = False
+        self._configured = None  # 最近一次下发到固件的参数
+        self._running = False; self._job_params = self.params
+
+    def log(self, msg):
+        self._log(f"[{self.name}] {msg}")
+
+    async def _projector(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._projector_io, func, *args)
+
+    async def _light(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._light_io, func, *args)
+
+    @staticmethod
+    def _check(result, what):
+        success, msg = result
+        if not success: raise RuntimeError(f"{what}失败: {msg}")
+        return msg
+
+    # --- 设备会话 ---
+    async def open(self):
+        """并行启动投影进程、连接光机与 ESP32，然后下发轴与运动配置"""
+        self.state = "connecting"
+        self.projector = self.projector_factory(monitor_index=self.params['monitor_index'], port=self.config.projector_port)
+        self.light_engine = self.light_engine_factory()
+        self.motion = AsyncMotionController(self.params['esp32_ip'], self.params['esp32_port'],
+                                            serial_port=self.params['esp32_serial'], link_mode=self.params['motion_link'])
+        self.motion.event_callback = lambda evt: self.log(f"[ESP32] {evt}")
+
+        async def connect_motion():
+            with self.tracer.span('motion_connect'): return await self.motion.connect()
+
+        results = await asyncio.gather(
+            self._projector(self.projector.start),
+            self._light(self.light_engine.connect, self.params['controller_exe_path'], self.config.light_engine_title),
+            connect_motion())
+        for what, result in zip(("启动投影进程", "连接光引擎", "连接 ESP32 "), results):
+            self.log(self._check(result, what))
+        await self._configure(self.params)
+        self.state = "ready"
+
+    async def _configure(self, p):
+        """配置指令全部流水线发出后统一等待；必需项失败则中止，可选项 (旧固件不支持) 只告警"""
+        m = self.motion; self._configured = None
+        required = [(f"配置 {a.upper()} 轴", m.config_axis(a, p[f'{a}_pulse_rev'], p[f'{a}_lead'])) for a in 'zabc']
+        required += [("配置 Z 轴剥离", m.config_z_peel(p)), ("配置 A 轴擦拭", m.config_a_wipe(p))]
+        optional = [("分段剥离", m.config_z_peel_profile(p)), ("联锁配置", m.config_interlock(p)),
+                    ("Z 加减速", m.config_ramp('z', p['z_accel'], p['ramp_profile'])),
+                    ("A 加减速", m.config_ramp('a', p['a_accel'], p['ramp_profile'])),
+                    ("限位回退", m.config_a_limit(p))]
+        if p['level_enabled'] or self.level_ff: optional.append(("液位闭环", m.config_level(p)))  # 之前启用过则需下发关闭
+        results = await asyncio.gather(*(coro for _, coro in required + optional))
+        for (what, _), result in zip(required, results): self._check(result, what)
+        for (what, _), (success, msg) in zip(optional, results[len(required):]):
+            if not success: self.log(f"警告：固件不支持{what}: {msg}")
+        self.level_ff = p['level_enabled'] and results[-1][0]
+        self._configured = p
+
+    async def close(self):
+        if self.motion: await self.motion.disconnect()
+        loop = asyncio.get_running_loop()
+        if self.projector: await loop.run_in_executor(self._projector_io, self.projector.stop)
+        if self.light_engine: await loop.run_in_executor(self._light_io, self.light_engine.disconnect)
+        self.motion = None; self.projector = None; self.light_engine = None
+        self.state = "idle"
+
+    def is_open(self):
+        return self.motion is not None and self.motion.is_connected()
+
+    def shutdown(self):
+        self._projector_io.shutdown(wait=False); self._light_io.shutdown(wait=False)
+
+    # --- 任务准备 (不占用设备，可与其他任务的打印并行) ---
+    async def prepare(self, zip_path, overrides=None):
+        """合并任务参数、解压并校验切片 (共享缓存)、生成运动计划，返回 PreparedJob"""
+        params = with_overrides(self.params, overrides or {})
+        slices = await self.slice_cache.acquire(zip_path)  # 液位前馈的亮像素数在打印时逐层统计 (_feed_level)
+        try:
+            motion = layer_motion_from_params(params, dwell_ms=params['peel_dwell_ms'])
+            plan = build_motion_plan([motion] * (slices.layers - 1))
+        except ValueError:
+            self.slice_cache.release(slices); raise
+        return PreparedJob(slices, plan, params)
+
+    # --- 打印循环 ---
+    async def print_job(self, job):
+        """在已打开的会话上打印一个已准备好的任务；被取消时先让固件急停"""
+        p = self._job_params = job.params; slices = job.slices; tracer = self.tracer
+        self.total_layers = total = slices.layers; self.layer = 0
+        self.state = "printing"; self._running = True
+        try:
+            changed = [k for k in CONFIG_KEYS if self._configured is None or p[k] != self._configured[k]]
+            if changed:
+                self.log(f"任务参数与设备配置不同 ({', '.join(changed[:4])}{' 等' if len(changed) > 4 else ''})，重新下发配置...")
+                await self._configure(p)
+            use_plan = False
+            if job.plan:
+                s, m = await self.motion.upload_plan(job.plan)
+                self.log(m if s else f"警告：{m}，改用逐层 NEXT_LAYER。")
+                use_plan = s
+            self._check(await self._projector(self.projector.show_black), "初始黑屏")
+            self._check(await self._prepare(slices, 0), "第 1 层准备")
+            for i in range(total):
+                if not self._running: self.log("打印任务被终止。"); return False, "已终止"
+                self.layer = layer_num = i + 1; layer_start = now_ns()
+                expo = exposure_time(p, layer_num)
+                with tracer.span('projector_present', layer=layer_num):
+                    self._check(await self._projector(self.projector.present), f"显示切片 {layer_num} ")
+                with tracer.span('led_on', layer=layer_num):
+                    self._check(await self._light(self.light_engine.led_on), "打开 LED ")
+                with tracer.span('exposure', layer=layer_num, target_s=expo):
+                    await asyncio.sleep(expo)
+                with tracer.span('projector_black', layer=layer_num):
+                    s, m = await self._projector(self.projector.show_black)
+                if not s: self.log(f"警告：设置黑屏失败: {m}")
+                with tracer.span('led_off', layer=layer_num):
+                    self._check(await self._light(self.light_engine.led_off), "关闭 LED ")
+                if layer_num < total:
+                    motion_start = now_ns()
+                    deadline = layer_motion_deadline(p, PrintConfig.A_TRAVEL_MM)
+                    motion_future = (self.motion.run_planned_layer(deadline) if use_plan
+                                     else self.motion.submit_command("NEXT_LAYER", deadline))
+                    motion_future.add_done_callback(lambda _f, start=motion_start, n=layer_num: tracer.complete(
+                        'layer_motion', start, now_ns(), 'motion', 'esp32', {'layer': n}))
+                    # 层间运动期间并行准备下一层
+                    motion_result, prepare_result = await asyncio.gather(motion_future, self._prepare(slices, i + 1))
+                    self._check(motion_result, "层间运动")
+                    self._check(prepare_result, f"第 {layer_num + 1} 层准备")
+                tracer.complete('layer', layer_start, now_ns(), 'layer', 'layers', {'layer': layer_num})
+            self.log(f"打印完成 ({total} 层)。")
+            return True, f"打印完成 ({total} 层)"
+        except asyncio.CancelledError:
+            await self.emergency_stop(); raise
+        finally:
+            self._running = False; self.state = "ready"
+            self._export_trace()
+
+    async def _prepare(self, slices, index):
+        """预载切片、预选 LED 与液位前馈三者互不依赖，并行执行"""
+        steps = [self._traced('frame_fetch', index, 'projector',
+                              self._projector(self.projector.preload_image, slices.image_paths[index])),
+                 self._traced('led_arm', index, 'light engine', self._light(self.light_engine.arm_led_on))]
+        if self.level_ff: steps.append(self._traced('level_ff', index, 'esp32', self._feed_level(slices, index)))
+        for success, msg in await asyncio.gather(*steps):
+            if not success: return False, msg
+        return True, "准备完成"
+
+    async def _feed_level(self, slices, index):
+        """统计本层亮像素 (进程池，与层间运动重叠) 并发送液位前馈 (不等待回复)"""
+        try:
+            lit_pixels = await self.slice_cache.lit_pixels(slices, index)
+        except OSError as e:
+            return False, f"读取切片失败: {e}"
+        self.motion.feed_level(self._level_mm(lit_pixels))
+        return True, "液位前馈"
+
+    async def _traced(self, name, index, track, awaitable):
+        with self.tracer.span(name, track=track, layer=index + 1): return await awaitable
+
+    def _level_mm(self, lit_pixels):
+        """亮像素数 -> 本层树脂消耗 -> B 轴补偿量 (与 PrintWorker._feed_level 相同的换算)"""
+        p = self._job_params
+        return lit_pixels * p['pixel_pitch'] ** 2 * p['layer_height'] / p['b_displacer_area']
+
+    async def emergency_stop(self):
+        self._running = False
+        if self.motion and self.motion.is_connected():
+            s, m = await self.motion.stop_motion()
+            if not s: self.log(f"警告：发送 STOP 失败: {m}")
+
+    def stop(self):
+        """在层边界停止 (当前曝光与层间运动照常完成)；需要立即停止时取消任务或调用 emergency_stop"""
+        self._running = False
+
+    def _export_trace(self):
+        if not self.tracer.enabled or not self.params['trace_dir']: return
+        path = os.path.join(self.params['trace_dir'], time.strftime(f"trace_{self.name}_%Y%m%d_%H%M%S.json"))
+        try:
+            self.log(f"时间线已导出: {path} ({self.tracer.export(path)} 条)")
+        except OSError as e:
+            self.log(f"警告：导出时间线失败: {e}")
+
+
+# --- 3. 舰队控制器 ---
+class FleetController:
+    """同时驱动多台打印机；每台机器的失败只结束它自己的任务"""
+
+    def __init__(self, printer_configs, slice_cache=None, log=print, **printer_kwargs):
+        self.slice_cache = slice_cache or SliceCache()
+        self.log = log
+        for key in ('name', 'projector_port'):
+            values = [getattr(cfg, key) for cfg in printer_configs]
+            if len(set(values)) != len(values): raise ValueError(f"打印机的 {key} 不能重复: {values}")
+        self.printers = {cfg.name: FleetPrinter(cfg, self.slice_cache, log, **printer_kwargs) for cfg in printer_configs}
+
+    async def run(self, jobs):
+        """jobs: {打印机名: 切片包路径}。返回 {打印机名: (success, msg)}"""
+        unknown = set(jobs) - set(self.printers)
+        if unknown: raise ValueError(f"未知的打印机: {', '.join(sorted(unknown))}")
+        names = list(jobs)
+        results = await asyncio.gather(*(self._run_printer(self.printers[n], jobs[n]) for n in names))
+        return dict(zip(names, results))
+
+    async def _run_printer(self, printer, zip_path):
+        # 任务准备 (切片缓存多台机器共享) 与设备连接并行进行
+        prepare = asyncio.ensure_future(printer.prepare(zip_path))
+        try:
+            await printer.open()
+            job = await prepare
+            printer.log(f"{os.path.basename(zip_path)}: {job.slices.layers} 层")
+            return await printer.print_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            printer.log(f"打印过程中发生错误: {e}\n{traceback.format_exc()}")
+            return False, str(e)
+        finally:
+            if not prepare.done(): prepare.cancel()
+            elif not prepare.cancelled() and prepare.exception() is None: self.slice_cache.release(prepare.result().slices)
+            await printer.close()
+
+    def stop_all(self):
+        for printer in self.printers.values(): printer.stop()
+
+    def status(self):
+        return {name: {'state': p.state, 'layer': p.layer, 'total_layers': p.total_layers}
+                for name, p in self.printers.items()}
+
+    def close(self):
+        for printer in self.printers.values(): printer.shutdown()
+        self.slice_cache.close()
+
+
+# --- 4. 持久化任务队列 ---
+class QueueRunner:
+    """按 job_queue.JobQueue 连续打印。对每台打印机：
+    - 设备会话在任务之间保持打开，只在首个任务或出错后重新连接与配置
+    - 当前任务打印时，在后台准备下一个排队的任务 (校验、切片缓存、运动计划)
+    - 开始打印即把平台标记为占用；换板确认 (python job_queue.py confirm) 后立即开始已准备好的任务"""
+
+    def __init__(self, fleet, queue, poll_s=0.2, reconnect_s=10.0):
+        self.fleet = fleet; self.queue = queue
+        self.poll_s = poll_s; self.reconnect_s = reconnect_s
+        self._changed = None
+
+    async def run(self):
+        """持续运行直到被取消"""
+        self._changed = asyncio.Event()  # 在运行的事件循环中创建 (兼容 Python 3.8)
+        for job in self.queue.recover():
+            self.fleet.log(f"任务 #{job['id']} ({job['printer']}) 上次未完成，已标记为失败，需确认换板后继续")
+        try:
+            await asyncio.gather(self._watch(), *(self._printer_loop(p) for p in self.fleet.printers.values()))
+        finally:
+            await asyncio.gather(*(p.close() for p in self.fleet.printers.values()), return_exceptions=True)
+
+    # --- 队列变化通知 ---
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_s)
+            if self.queue.refresh(): self._notify()
+
+    def _notify(self):
+        self._changed.set(); self._changed = asyncio.Event()
+
+    async def _wait_for(self, predicate):
+        """等待 predicate() 返回真值 (队列文件每次变化时重新求值)"""
+        while True:
+            changed = self._changed
+            result = predicate()
+            if result: return result
+            await changed.wait()
+
+    # --- 每台打印机的任务循环 ---
+    def _prepare(self, printer, job):
+        printer.log(f"后台准备任务 #{job['id']}: {os.path.basename(job['zip_path'])}")
+        return job, asyncio.ensure_future(printer.prepare(job['zip_path'], job['params']))
+
+    def _discard(self, prepare):
+        if prepare is None: return
+        if not prepare.done(): prepare.cancel()
+        elif not prepare.cancelled() and prepare.exception() is None: self.fleet.slice_cache.release(prepare.result().slices)
+
+    async def _printer_loop(self, printer):
+        name = printer.name; pending = None
+        while True:
+            if pending is None: pending = self._prepare(printer, await self._wait_for(lambda: self.queue.next_job(name)))
+            job, prepare = pending; pending = None
+            try:
+                if not printer.is_open():
+                    await printer.close()
+                    try:
+                        await printer.open()
+                    except Exception as e:
+                        printer.log(f"连接失败，{self.reconnect_s:.0f}s 后重试: {e}")
+                        await printer.close(); await asyncio.sleep(self.reconnect_s)
+                        pending = (job, prepare); continue
+                try:
+                    prepared = await prepare
+                except Exception as e:
+                    # 准备期间任务可能已被取消：只把仍在排队的任务标记为失败，不覆盖 cancelled
+                    if self.queue.finish(job['id'], False, f"准备失败: {e}", from_states=('queued',)) is None:
+                        printer.log(f"任务 #{job['id']} 已取消 (准备失败: {e})")
+                    else:
+                        printer.log(f"任务 #{job['id']} 准备失败: {e}")
+                    self._notify(); continue
+                if not self.queue.plate_ready(name): printer.log(f"任务 #{job['id']} 已就绪，等待换板确认...")
+                await self._wait_for(lambda: self.queue.plate_ready(name))
+                confirmed_at = time.perf_counter()
+                if not self.queue.start(job['id']):
+                    self.fleet.slice_cache.release(prepared.slices); continue  # 准备期间已被取消
+                self._notify()
+                printer.log(f"开始任务 #{job['id']} ({prepared.slices.layers} 层)，"
+                            f"距换板确认 {(time.perf_counter() - confirmed_at) * 1000:.0f}ms")
+                prepare = None  # 切片由 _print_with_lookahead 负责释放
+                pending = await self._print_with_lookahead(printer, job, prepared)
+            except asyncio.CancelledError:
+                self._discard(prepare)
+                if pending is not None: self._discard(pending[1])
+                raise
+
+    async def _print_with_lookahead(self, printer, job, prepared):
+        """打印当前任务，同时等待下一个排队任务出现并开始准备；返回 (下一个任务, 准备 Task) 或 None"""
+        name = printer.name; pending = None
+        printing = asyncio.ensure_future(printer.print_job(prepared))
+        lookahead = asyncio.ensure_future(self._wait_for(lambda: self.queue.next_job(name)))
+        try:
+            await asyncio.wait([printing, lookahead], return_when=asyncio.FIRST_COMPLETED)
+            if lookahead.done(): pending = self._prepare(printer, lookahead.result())
+            try:
+                success, msg = await printing
+            except Exception as e:
+                printer.log(f"打印过程中发生错误: {e}\n{traceback.format_exc()}")
+                success, msg = False, str(e)
+        except asyncio.CancelledError:
+            printing.cancel()
+            await asyncio.wait([printing])  # 等待急停完成
+            if pending is not None: self._discard(pending[1])
+            raise
+        finally:
+            lookahead.cancel()
+            self.fleet.slice_cache.release(prepared.slices)
+        self.queue.finish(job['id'], success, msg); self._notify()
+        printer.log(f"任务 #{job['id']} {'完成' if success else '失败'}: {msg}")
+        if not success: await printer.close()  # 出错后下一个任务重新连接与配置
+        return pending
+
+
+def load_fleet_config(path):
+    """fleet.json -> ([PrinterConfig], {打印机名: 切片包路径})；相对路径以配置文件所在目录为准"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    configs = [PrinterConfig(**entry) for entry in data['printers']]
+    jobs = {name: os.path.join(base, zip_path) for name, zip_path in data.get('jobs', {}).items()}
+    return configs, jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无界面多打印机控制器")
+    parser.add_argument('config', help="fleet.json")
+    parser.add_argument('--decode-workers', type=int, default=None, help="切片解码进程数 (默认 CPU 核数)")
+    parser.add_argument('--queue', nargs='?', const=JOB_QUEUE_PATH, default=None,
+                        help="持续执行任务队列 (默认 print_jobs.json)，忽略配置中的 jobs")
+    args = parser.parse_args(argv)
+    configs, jobs = load_fleet_config(args.config)
+    metrics = None
+    if PrintConfig.METRICS_PORT is not None:
+        metrics = MetricsServer(REGISTRY, PrintConfig.METRICS_HOST, PrintConfig.METRICS_PORT)
+        try:
+            host, port = metrics.start(); print(f"指标服务: http://{host}:{port}/metrics")
+        except OSError as e:
+            print(f"警告：指标服务启动失败: {e}"); metrics = None
+    fleet = FleetController(configs, SliceCache(decode_workers=args.decode_workers))
+    try:
+        if args.queue:
+            print(f"执行任务队列 {args.queue} (Ctrl+C 停止)")
+            asyncio.run(QueueRunner(fleet, JobQueue(args.queue)).run())
+        else:
+            results = asyncio.run(fleet.run(jobs))
+    except KeyboardInterrupt:
+        print("已中断，所有打印机已急停。"); return 1
+    finally:
+        fleet.close()
+        if metrics: metrics.stop()
+    for name, (success, msg) in results.items(): print(f"{name}: {'成功' if success else '失败'} - {msg}")
+    return 0 if all(success for success, _ in results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# fw_telemetry.py
+# 功能：接收固件遥测事件 (TELEMETRY 订阅)，按对时结果把固件 ticks_us 换算为主机 perf_counter_ns，
+# 写入 layer_trace.Tracer：层间子步骤为 span，液位采样为数值序列。
+# 事件格式见 esp32/main.py 遥测一节: "T,<起始 ticks_us>,<时长 us>,<名称>,<层>"  "L,<ticks_us>,<ADC>,<待补偿 mm>"
+
+import collections
+import threading
+
+TM_STEPS, TM_LEVEL = 0x01, 0x02   # 与固件一致
+TICKS_PERIOD_US = 1 << 30         # MicroPython ESP32 的 ticks_us 回绕周期
+
+
+def ticks_delta(a, b):
+    """a - b (us)，按 ticks 周期取模，与固件 time.ticks_diff 一致"""
+    half = TICKS_PERIOD_US // 2
+    return (a - b + half) % TICKS_PERIOD_US - half
+
+
+class ClockSync:
+    """最小往返滤波 (NTP 式)：在最近 window 次对时中取往返最短的一次，
+    认为固件在往返中点读取了 ticks_us。误差上限为该次往返时间的一半"""
+
+    def __init__(self, window=8):
+        self.samples = collections.deque(maxlen=window)
+        self.best = None  # (往返 ns, 中点主机时刻 ns, 固件 ticks_us)
+
+    @property
+    def synced(self):
+        return self.best is not None
+
+    def add_sample(self, send_ns, recv_ns, fw_ticks_us):
+        rtt = recv_ns - send_ns
+        self.samples.append((rtt, send_ns + rtt // 2, fw_ticks_us))
+        self.best = min(self.samples)
+
+    def to_host_ns(self, ticks_us):
+        _, mid_ns, ref_ticks = self.best
+        return mid_ns + ticks_delta(ticks_us, ref_ticks) * 1000
+
+    def uncertainty_us(self):
+        return self.best[0] / 2000 if self.best else None
+
+
+class FirmwareTelemetry:
+    def __init__(self, tracer, clock=None):
+        self.tracer = tracer
+        self.clock = clock or ClockSync()
+        self.last_level = None    # (主机时刻 ns, ADC, 待补偿 mm)
+        self.unsynced = 0         # 对时前收到而丢弃的事件数
+        self._lock = threading.Lock()  # 对时在打印线程，事件在通信线程
+
+    def sync(self, motion_ctrl, samples=1):
+        """向固件发送 samples 次 TIME 对时，返回 (success, msg)"""
+        for _ in range(samples):
+            success, ticks, send_ns, recv_ns = motion_ctrl.query_time()
+            if not success: return False, f"对时失败: {ticks}"
+            with self._lock: self.clock.add_sample(send_ns, recv_ns, ticks)
+        return True, f"对时完成 (误差 ±{self.clock.uncertainty_us():.0f}us)"
+
+    def handle_event(self, event):
+        """处理遥测事件，返回 True；非遥测事件返回 False 交由调用方处理"""
+        kind = event[:2]
+        if kind not in ('T,', 'L,'): return False
+        with self._lock:
+            if not self.clock.synced: self.unsynced += 1; return True
+            parts = event.split(',')
+            try:
+                if kind == 'T,':
+                    start = self.clock.to_host_ns(int(parts[1]))
+                    self.tracer.complete(parts[3], start, start + int(parts[2]) * 1000, 'firmware', 'esp32 firmware',
+                                         {'layer': int(parts[4])})
+                else:
+                    ts = self.clock.to_host_ns(int(parts[1]))
+                    self.last_level = (ts, int(parts[2]), float(parts[3]))
+                    self.tracer.counter('resin_level', ts, 'level', 'esp32 level', adc=self.last_level[1])
+            except (IndexError, ValueError):
+                print(f"警告：无法解析遥测事件: {event}")
+        return True
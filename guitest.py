@@ -7,6 +7,9 @@ import zipfile
 import socket
 import subprocess
 import traceback
+import asyncio
+import importlib.util
+import threading
 from multiprocessing.connection import Client
 from PIL import Image
 
@@ -15,14 +18,21 @@ from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QG
 from PyQt5.QtCore import QThread, QObject, pyqtSignal, pyqtSlot, Qt
 from PyQt5.QtGui import QPainter, QPixmap, QColor
 
-try:
-    from pywinauto.application import Application
-
-    PYWINAUTO_AVAILABLE = True
-except ImportError:
-    PYWINAUTO_AVAILABLE = False
+PYWINAUTO_AVAILABLE = importlib.util.find_spec("pywinauto") is not None  # 仅检查是否安装；uia_cache 在使用时才导入
+if not PYWINAUTO_AVAILABLE:
     print("警告：未找到 pywinauto 库，无法控制光引擎软件。请使用 'pip install pywinauto' 安装。")
 
+from uia_cache import UIAElementCache, LED_CONTROLS
+from motion_client import MotionClientThread
+from motion_transport import SERIAL_BAUD, make_transports, format_report
+from layer_pipeline import LayerScheduler
+from motion_plan import (build_motion_plan, layer_motion_from_params, plan_commands,
+                         move_seconds, layer_motion_seconds, layer_motion_deadline, motion_deadline)
+from layer_trace import Tracer, NULL_TRACER, now_ns
+from print_metrics import REGISTRY, TraceMetrics, MetricsServer
+from print_journal import PrintJournal, read_journal, latest_unfinished, resume_params
+from fw_telemetry import FirmwareTelemetry, TM_STEPS, TM_LEVEL
+
 
 # --- 1. 配置设定 ---
 class PrintConfig:
@@ -34,7 +44,15 @@ class PrintConfig:
     PROJECTOR_MONITOR_INDEX = 1
     ESP32_IP_ADDRESS = "10.10.17.102"  # 请替换为您的 ESP32 IP
     ESP32_PORT = 8899
-    SOCKET_TIMEOUT = 60.0
+    # 串口链路 (USB-UART 转接板，如 "COM5")：None 表示只用 Wi-Fi。MOTION_LINK: 'auto' = 连接时测量往返时间选用较快的链路，
+    # 'tcp' / 'serial' = 固定使用该链路
+    ESP32_SERIAL_PORT = None
+    ESP32_SERIAL_BAUD = SERIAL_BAUD
+    MOTION_LINK = 'auto'
+    SOCKET_TIMEOUT = 5.0  # 连接及即时指令的超时；运动指令的截止时间按参数估算 (motion_plan.motion_deadline)
+    # 心跳：每 HEARTBEAT_INTERVAL_S 发送 PING，超过 HEARTBEAT_TIMEOUT_S 收不到 ESP32 任何数据即判定断线，None 表示关闭
+    HEARTBEAT_INTERVAL_S = 0.2
+    HEARTBEAT_TIMEOUT_S = 1.0
 
     # 轴参数
     Z_PULSE_PER_REV = 12800.0;
@@ -58,64 +76,163 @@ class PrintConfig:
     NORMAL_EXPOSURE_TIME_S = 2.5
     FIRST_LAYER_EXPOSURE_TIME_S = 5.0
     TRANSITION_LAYERS = 5
+    PEEL_DWELL_MS = 1000  # Z 抬升后的停顿 (随运动计划上传)
+    A_HOME_CLEARANCE_MM = 0.0  # A 归位前 Z 需抬升的距离，0 表示等 Z 抬升完成 (仅与停顿重叠)
+    Z_ACCEL = 20.0   # 层间运动加速度 (mm/s²)，0 表示恒速
+    A_ACCEL = 400.0
+    RAMP_PROFILE = 1  # 0 = 梯形, 1 = S 曲线
+    A_LIMIT_RELEASE_MM = 0.5  # A 限位触发后，在越程之外额外回退的距离
+    A_PREHOME_MM = 3.0  # A 归位快速段停在距原点开关的距离，其后慢速接近
+    A_TRAVEL_MM = 100.0  # A 轴擦拭行程 (上限)，用于估算层间运动时长
+    # Z 分段剥离：离层先慢速脱离，回层最后一段慢速接近，中间按 Z 上/下移速度快速移动
+    Z_BREAK_DISTANCE = 0.3;
+    Z_BREAK_SPEED = 1.0;
+    Z_APPROACH_DISTANCE = 0.3;
+    Z_APPROACH_SPEED = 2.0
+    # 液位闭环 (B 轴)：固件做中值滤波 + PI，PC 按每层切片面积前馈树脂消耗
+    LEVEL_CONTROL_ENABLED = False
+    LEVEL_SETPOINT_ADC = 2000.0
+    LEVEL_KP = 0.00005  # mm / ADC 读数
+    LEVEL_KI = 0.00001  # mm / (ADC 读数 · s)
+    PIXEL_PITCH_MM = 0.05  # 投影像素边长，用于由亮像素数估算固化面积
+    B_DISPLACER_AREA_MM2 = 2000.0  # B 轴每移动 1 mm 排开的树脂体积 / mm
 
     # 获取当前脚本文件所在的绝对目录
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
     # 使用绝对路径拼接 (使用 .png)
     BACKGROUND_IMAGE_PATH = os.path.join(SCRIPT_DIR, "preview.png")
+    # 每次打印的时间线 (Chrome trace JSON) 导出目录，None 表示不记录
+    TRACE_DIR = os.path.join(SCRIPT_DIR, "traces")
+    TRACE_CAPACITY = 65536  # 环形缓冲容量 (span 数)，约每层 15 条
+    # 固件遥测 (需开启时间线)：子步骤 ticks_us 计时，液位采样周期 (ms，0 = 不采样)
+    TELEMETRY_ENABLED = True
+    TELEMETRY_LEVEL_PERIOD_MS = 1000
+    # Prometheus 指标端口 (http://<主机>:<端口>/metrics)，None 表示关闭；车间监控从其他机器抓取时改为 "0.0.0.0"
+    METRICS_HOST = "127.0.0.1"
+    METRICS_PORT = 9108
+    # 打印日志 (每层落盘，断线或崩溃后续打)，None 表示不记录
+    JOURNAL_DIR = os.path.join(SCRIPT_DIR, "journals")
+    # 打印中断线：指数退避重连 (首次间隔 -> 上限)，总时长超过 RECONNECT_TIMEOUT_S 放弃；单次连接超时
+    RECONNECT_INITIAL_S = 0.5
+    RECONNECT_MAX_S = 8.0
+    RECONNECT_TIMEOUT_S = 600.0
+    RECONNECT_CONNECT_TIMEOUT_S = 3.0
+
+
+def default_print_params(**overrides):
+    """与 MainWindow.get_params 相同的键，取 PrintConfig 与界面默认值 (无界面运行时使用)"""
+    C = PrintConfig; layer_height = 0.05; peel_base = 5.0
+    params = {'esp32_ip': C.ESP32_IP_ADDRESS, 'esp32_port': C.ESP32_PORT, 'esp32_serial': C.ESP32_SERIAL_PORT,
+              'motion_link': C.MOTION_LINK,
+              'zip_path': C.ZIP_FILE_PATH, 'temp_dir': C.TEMP_EXTRACT_DIR,
+              'black_image_path': C.BLACK_IMAGE_PATH, 'controller_exe_path': C.CONTROLLER_EXE_PATH,
+              'monitor_index': C.PROJECTOR_MONITOR_INDEX, 'first_layer_expo': C.FIRST_LAYER_EXPOSURE_TIME_S,
+              'normal_expo': C.NORMAL_EXPOSURE_TIME_S, 'transition_layers': C.TRANSITION_LAYERS,
+              'peel_dwell_ms': C.PEEL_DWELL_MS, 'a_home_clearance': C.A_HOME_CLEARANCE_MM,
+              'z_accel': C.Z_ACCEL, 'a_accel': C.A_ACCEL, 'ramp_profile': C.RAMP_PROFILE,
+              'layer_height': layer_height, 'level_enabled': C.LEVEL_CONTROL_ENABLED,
+              'level_setpoint': C.LEVEL_SETPOINT_ADC, 'level_kp': C.LEVEL_KP, 'level_ki': C.LEVEL_KI,
+              'pixel_pitch': C.PIXEL_PITCH_MM, 'b_displacer_area': C.B_DISPLACER_AREA_MM2,
+              'a_limit_release': C.A_LIMIT_RELEASE_MM, 'a_prehome': C.A_PREHOME_MM,
+              'z_pulse_rev': C.Z_PULSE_PER_REV, 'z_lead': C.Z_LEAD, 'a_pulse_rev': C.A_PULSE_PER_REV, 'a_lead': C.A_LEAD,
+              'b_pulse_rev': C.B_PULSE_PER_REV, 'b_lead': C.B_LEAD, 'c_pulse_rev': C.C_PULSE_PER_REV, 'c_lead': C.C_LEAD,
+              'peel_lift_z1': peel_base + layer_height, 'peel_return_z2': peel_base,
+              'z_speed_down': C.Z_PEEL_SPEED, 'z_speed_up': C.Z_PEEL_SPEED,
+              'z_break_dist': C.Z_BREAK_DISTANCE, 'z_break_speed': C.Z_BREAK_SPEED,
+              'z_approach_dist': C.Z_APPROACH_DISTANCE, 'z_approach_speed': C.Z_APPROACH_SPEED,
+              'a_fast_speed': C.A_WIPE_SPEED_FAST, 'a_slow_speed': C.A_WIPE_SPEED_SLOW,
+              'c_jog_speed': C.C_JOG_SPEED, 'z_jog_speed': C.Z_JOG_SPEED, 'a_jog_speed': C.A_JOG_SPEED,
+              'b_jog_speed': C.B_JOG_SPEED, 'trace_dir': C.TRACE_DIR, 'telemetry': C.TELEMETRY_ENABLED,
+              'telemetry_level_ms': C.TELEMETRY_LEVEL_PERIOD_MS, 'metrics_port': C.METRICS_PORT,
+              'journal_dir': C.JOURNAL_DIR}
+    return with_overrides(params, overrides)
+
+
+def with_overrides(params, overrides):
+    """覆盖打印参数。抬升距离 = 回落距离 + 层高 (与界面一致)：覆盖了层高或回落距离而未直接给出抬升距离时重新计算"""
+    params = dict(params, **overrides)
+    if 'peel_lift_z1' not in overrides and ('layer_height' in overrides or 'peel_return_z2' in overrides):
+        params['peel_lift_z1'] = params['peel_return_z2'] + params['layer_height']
+    return params
+
+
+def exposure_time(params, layer_num):
+    """首层曝光 -> 过渡层线性递减 -> 正常曝光"""
+    if layer_num == 1: return params['first_layer_expo']
+    if layer_num <= params['transition_layers']:
+        progress = (layer_num - 1) / (params['transition_layers'] - 1)
+        return params['first_layer_expo'] - (params['first_layer_expo'] - params['normal_expo']) * progress
+    return params['normal_expo']
 
 
 # --- 2. 后端通信与控制类 ---
 
 class MotionController:
-    """与 ESP32 进行 TCP 通信"""
+    """与 ESP32 通信 (基于 motion_client 的带标签流水线，可多条指令同时在途)；
+    链路为 Wi-Fi TCP 或串口，设置了 serial_port 且 link_mode 为 'auto' 时连接前测量两者的往返时间，选用较快的"""
 
-    def __init__(self, host, port, timeout=PrintConfig.SOCKET_TIMEOUT):
+    def __init__(self, host, port, timeout=PrintConfig.SOCKET_TIMEOUT, heartbeat=PrintConfig.HEARTBEAT_INTERVAL_S,
+                 heartbeat_timeout=PrintConfig.HEARTBEAT_TIMEOUT_S, serial_port=None, link_mode=PrintConfig.MOTION_LINK):
         self.host = host;
         self.port = port;
+        self.serial_port = serial_port;
+        self.link_mode = link_mode;
         self.timeout = timeout;
-        self.sock = None;
-        self.reader = None;
+        self.heartbeat = heartbeat;
+        self.heartbeat_timeout = heartbeat_timeout;
+        self.link = None;
+        self.event_callback = None;
         self._is_connected = False
 
-    def connect(self):
+    def connect(self, timeout=None):
+        timeout = timeout or self.timeout
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM);
-            self.sock.settimeout(self.timeout);
-            self.sock.connect((self.host, self.port));
-            self.reader = self.sock.makefile('r');
+            self.link = MotionClientThread(self.host, self.port, connect_timeout=timeout, heartbeat=self.heartbeat,
+                                           heartbeat_timeout=self.heartbeat_timeout, transports=self.transports());
+            self.link.start();
+            self.link.add_event_listener(self._on_event);
             self._is_connected = True;
-            return True, "连接成功"
-        except socket.timeout:
-            self._is_connected = False; return False, f"连接超时 ({self.timeout}s)"
+            return True, self._connected_message(self.link.client)
+        except (socket.timeout, asyncio.TimeoutError):
+            self.disconnect(); return False, f"连接超时 ({timeout}s)"
         except Exception as e:
-            self._is_connected = False; return False, f"连接失败: {e}"
+            self.disconnect(); return False, f"连接失败: {e}"
+
+    def transports(self):
+        return make_transports(self.host, self.port, self.serial_port, self.link_mode, PrintConfig.ESP32_SERIAL_BAUD)
+
+    @staticmethod
+    def _connected_message(client):
+        msg = f"连接成功 ({client.transport.name})"
+        return f"{msg}，往返时间: {format_report(client.link_report)}" if client.link_report else msg
 
     def disconnect(self):
-        if self.sock:
+        if self.link:
             try:
-                self.sock.close()
+                self.link.stop()
             except Exception:
                 pass
-        self.sock = None;
-        self.reader = None;
+        self.link = None;
         self._is_connected = False
 
     def is_connected(self):
-        return self._is_connected
+        return self._is_connected and self.link is not None and self.link.client.connected
+
+    def _on_event(self, event):
+        if self.event_callback: self.event_callback(event)
+        else: print(f"[ESP32 事件] {event}")
+
+    def submit_command(self, cmd, deadline=None):
+        """非阻塞发送，返回 Future，其结果为 (success, response)"""
+        if not self.is_connected(): raise RuntimeError("未连接")
+        return self.link.submit(cmd, self.timeout if deadline is None else deadline)
 
-    def send_command(self, cmd):
+    def send_command(self, cmd, deadline=None):
         if not self.is_connected(): return False, "未连接"
         try:
-            full_cmd = cmd + "\n";
-            self.sock.sendall(full_cmd.encode());
-            response = self.reader.readline().strip()
-            if "OK" in response or "DONE" in response:
-                return True, response
-            else:
-                return False, response
-        except socket.timeout:
-            self.disconnect(); return False, f"命令 '{cmd}' 超时 ({self.timeout}s)"
+            success, response = self.submit_command(cmd, deadline).result()
+            if not success and not self.link.client.connected: self.disconnect()
+            return success, response
         except Exception as e:
             self.disconnect(); return False, f"命令 '{cmd}' 失败: {e}\n{traceback.format_exc()}"
 
@@ -129,11 +246,87 @@ class MotionController:
     def config_a_wipe(self, params):
         return self.send_command(f"CONFIG_A_WIPE,{params['a_fast_speed']},{params['a_slow_speed']}")
 
-    def move_to_next_layer(self):
-        return self.send_command("NEXT_LAYER")
+    def config_z_peel_profile(self, params):
+        return self.send_command(f"CONFIG_Z_PEEL_PROFILE,{params['z_break_dist']},{params['z_break_speed']},"
+                                 f"{params['z_approach_dist']},{params['z_approach_speed']}")
+
+    def config_interlock(self, params):
+        return self.send_command(f"CONFIG_INTERLOCK,{params['a_home_clearance']}")
+
+    def config_ramp(self, axis, accel, profile):
+        return self.send_command(f"CONFIG_RAMP,{axis},{accel},{profile}")
+
+    def config_a_limit(self, params):
+        return self.send_command(f"CONFIG_A_LIMIT,{params['a_limit_release']},{params['a_prehome']}")
+
+    def move_to_next_layer(self, deadline=None):
+        return self.send_command("NEXT_LAYER", deadline)
+
+    def config_level(self, params):
+        return self.send_command(f"CONFIG_LEVEL,{int(params['level_enabled'])},{params['level_setpoint']},"
+                                 f"{params['level_kp']},{params['level_ki']}")
+
+    def feed_level(self, mm):
+        """非阻塞：液位前馈 (固件高优先级通道处理)，返回 Future"""
+        return self.submit_command(f"LEVEL_FF,{mm:.5f}", deadline=2.0)
+
+    def enable_telemetry(self, mask, level_ms=0):
+        return self.send_command(f"TELEMETRY,{mask},{level_ms}")
+
+    def query_time(self):
+        """对时：返回 (success, 固件 ticks_us 或错误信息, 发送时刻 ns, 收到回复时刻 ns)"""
+        if not self.is_connected(): return False, "未连接", 0, 0
+        received = threading.Event(); recv_ns = []
+        send_ns = now_ns()
+        future = self.submit_command("TIME", deadline=2.0)
+        # 在通信线程收到回复时记录时刻，不计入本线程被唤醒的延迟
+        future.add_done_callback(lambda _f: (recv_ns.append(now_ns()), received.set()))
+        success, response = future.result(); received.wait(1.0)
+        if not success or not response.startswith("OK: TIME,"): return False, response, 0, 0
+        return True, int(response[len("OK: TIME,"):]), send_ns, recv_ns[0] if recv_ns else now_ns()
+
+    def stop_motion(self):
+        """急停：固件在高优先级通道处理，清空队列并中止正在执行的运动 (非阻塞，返回 Future)"""
+        return self.submit_command("STOP", deadline=2.0)
+
+    def upload_plan(self, entries):
+        """上传整个任务的运动计划；所有指令一次性流水线发出，再统一等待回复"""
+        if not self.is_connected(): return False, "未连接"
+        futures = [(cmd, self.submit_command(cmd)) for cmd in plan_commands(entries)]
+        for cmd, future in futures:
+            success, response = future.result()
+            if not success: return False, f"{cmd.split(',')[0]} 失败: {response}"
+        return True, f"运动计划已上传 ({len(entries)} 条, {sum(e.repeat for e in entries)} 层)"
+
+    def ping(self, deadline=2.0):
+        return self.send_command("PING", deadline)
+
+    def query_position(self):
+        """返回 (success, {轴: mm} 或错误信息)"""
+        success, response = self.send_command("POS", deadline=2.0)
+        position = self.parse_position(response) if success else None
+        return (True, position) if position else (False, response)
+
+    @staticmethod
+    def parse_position(response):
+        """'OK: POS,z=..,a=..' -> {轴: mm}，格式不符时返回 None"""
+        if not response.startswith("OK: POS,"): return None
+        return {k: float(v) for k, v in (item.split('=') for item in response.strip()[len("OK: POS,"):].split(','))}
+
+    def query_status(self):
+        """返回 (success, {键: 字符串} 或错误信息)，键见固件 cmd_status"""
+        success, response = self.send_command("STATUS", deadline=2.0)
+        if not success or not response.startswith("OK: STATUS,"): return False, response
+        return True, dict(item.split('=', 1) for item in response.strip()[len("OK: STATUS,"):].split(','))
+
+    def run_planned_layer(self, deadline=None):
+        """非阻塞：让固件按计划执行下一层，返回 Future"""
+        return self.submit_command("GO", deadline)
 
     def move_relative(self, axis, distance, speed):
-        accel = speed * 2; return self.send_command(f"MOVE_REL,{axis},{distance},{speed},{accel}")
+        accel = speed * 2
+        return self.send_command(f"MOVE_REL,{axis},{distance},{speed},{accel}",
+                                 motion_deadline(move_seconds(distance, speed, accel)))
 
 
 class LightEngineControl:
@@ -144,27 +337,21 @@ class LightEngineControl:
         self.main_win = None;
         self.led_combo = None;
         self.set_button = None;
+        self._armed_state = None;
         self._is_connected = False
 
     def connect(self, exe_path, title="Full-HD UV LE Controller v2.1", timeout=10):
         if not PYWINAUTO_AVAILABLE: return False, "pywinauto 库未安装"
         try:
-            try:
-                self.app = Application(backend="uia").connect(title=title, timeout=5); print("已连接到现有光引擎实例。")
-            except Exception:
-                print(f"未找到光引擎实例，尝试启动: {exe_path}")
-                if not os.path.exists(exe_path): return False, f"光引擎 EXE 未找到: {exe_path}"
-                self.app = Application(backend="uia").start(exe_path);
-                self.app.window(title=title).wait('ready', timeout=timeout);
-                print("光引擎软件已启动。")
-            self.main_win = self.app.window(title=title);
-            self.main_win.wait('ready', timeout=timeout)
-            self.led_combo = self.main_win.child_window(auto_id="ComboBoxLedEnable");
-            self.set_button = self.main_win.child_window(auto_id="ButtonSetLedOnOff")
-            if not self.led_combo.exists() or not self.set_button.exists(): raise RuntimeError(
+            # 优先使用缓存的句柄与控件路径，校验失败时才回退到完整发现
+            cache = UIAElementCache(title=title)
+            self.app, self.main_win, elements, source = cache.resolve(LED_CONTROLS, exe_path=exe_path, timeout=timeout)
+            self.led_combo = elements['led_combo'];
+            self.set_button = elements['set_button']
+            if not self.led_combo.is_enabled() or not self.set_button.is_enabled(): raise RuntimeError(
                 "未能在光引擎窗口中找到 LED 控制下拉框或设置按钮。")
             self._is_connected = True;
-            return True, "光引擎连接成功"
+            return True, f"光引擎连接成功 ({source})"
         except Exception as e:
             self._is_connected = False; return False, f"连接光引擎失败: {e}\n{traceback.format_exc()}"
 
@@ -178,13 +365,25 @@ class LightEngineControl:
         if not self.is_connected(): return False, "光引擎未连接"
         try:
             self.main_win.set_focus();
-            self.led_combo.select(state);
-            time.sleep(0.1);
+            if self._armed_state != state:
+                self.led_combo.select(state);
+                time.sleep(0.1);
             self.set_button.click();
+            self._armed_state = None;
             time.sleep(0.1);
             return True, f"LED 设置为 {state}"
         except Exception as e:
-            return False, f"设置 LED 为 {state} 失败: {e}\n{traceback.format_exc()}"
+            self._armed_state = None; return False, f"设置 LED 为 {state} 失败: {e}\n{traceback.format_exc()}"
+
+    def arm_led_on(self):
+        """预先在下拉框选中 On (不点击设置按钮，不会曝光)，led_on 时只需点击"""
+        if not self.is_connected(): return False, "光引擎未连接"
+        try:
+            self.led_combo.select("On");
+            self._armed_state = "On";
+            return True, "LED 已预选 On"
+        except Exception as e:
+            self._armed_state = None; return False, f"预选 LED On 失败: {e}"
 
     def led_on(self):
         return self._set_led_state("On")
@@ -276,6 +475,13 @@ class ProjectorProcessManager:
     def show_black(self):
         return self.send_command({'command': 'show', 'path': PrintConfig.BLACK_IMAGE_PATH})
 
+    def preload_image(self, image_path):
+        """预载到投影后台缓冲，画面保持不变"""
+        return self.send_command({'command': 'preload', 'path': image_path})
+
+    def present(self):
+        return self.send_command({'command': 'present'})
+
 
 # --- 3. 后台打印工作线程 ---
 class PrintWorker(QObject):
@@ -285,12 +491,21 @@ class PrintWorker(QObject):
 
     def __init__(self, params):
         super().__init__(); self.params = params; self._is_running = True
+        self._stop_event = threading.Event(); self._motion_ctrl = None
+        # 时间线在导出或指标任一开启时记录；指标由 span 监听器常数时间更新
+        traced = params['trace_dir'] or params['metrics_port']
+        self.tracer = Tracer(PrintConfig.TRACE_CAPACITY) if traced else NULL_TRACER
+        if params['metrics_port']: self.tracer.add_listener(TraceMetrics(REGISTRY, params['esp32_ip']).on_span)
+        self._fw_mark = None  # 上一个固件子步骤结束 (或层间运动提交) 的时刻
+        self._telemetry = None  # 固件遥测启用后，子步骤 span 改用固件计时
 
     @pyqtSlot()
     def run(self):
         motion_ctrl = None;
         light_engine_ctrl = None;
-        projector_mgr = None
+        projector_mgr = None;
+        journal = None
+        tracer = self.tracer; run_start = now_ns()
         try:
             self.log_message.emit("--- 打印任务初始化 ---");
             black_image_path = self.params['black_image_path']
@@ -302,10 +517,13 @@ class PrintWorker(QObject):
             success, msg = light_engine_ctrl.connect(self.params['controller_exe_path']);
             self.log_message.emit(msg);
             if not success: raise RuntimeError(msg)
-            motion_ctrl = MotionController(self.params['esp32_ip'], self.params['esp32_port']);
-            success, msg = motion_ctrl.connect();
-            self.log_message.emit(msg);
-            if not success: raise RuntimeError(msg)
+            motion_ctrl = MotionController(self.params['esp32_ip'], self.params['esp32_port'],
+                                           serial_port=self.params['esp32_serial'], link_mode=self.params['motion_link']);
+            with tracer.span('motion_connect'):
+                success, msg = motion_ctrl.connect();
+                self.log_message.emit(msg);
+                if not success: raise RuntimeError(msg)
+            self._motion_ctrl = motion_ctrl
             self.log_message.emit(f"正在从 {self.params['zip_path']} 解压缩文件...");
             temp_dir = self.params['temp_dir'];
             if not os.path.exists(temp_dir): os.makedirs(temp_dir)
@@ -340,44 +558,113 @@ class PrintWorker(QObject):
             s, m = motion_ctrl.config_a_wipe(self.params);
             self.log_message.emit(f"A Wipe: {m}");
             if not s: raise RuntimeError(f"配置 A 轴擦拭失败: {m}")
+            s, m = motion_ctrl.config_z_peel_profile(self.params);
+            self.log_message.emit(f"Z Peel Profile: {m}" if s else f"警告：固件不支持分段剥离，Z 轴按单一速度运动: {m}")
+            s, m = motion_ctrl.config_interlock(self.params);
+            self.log_message.emit(f"Interlock: {m}" if s else f"警告：固件不支持联锁配置，使用默认值: {m}")
+            for axis in ('z', 'a'):
+                s, m = motion_ctrl.config_ramp(axis, self.params[f'{axis}_accel'], self.params['ramp_profile']);
+                self.log_message.emit(f"Ramp {axis.upper()}: {m}" if s else f"警告：固件不支持加减速配置，{axis.upper()} 轴保持恒速: {m}")
+            s, m = motion_ctrl.config_a_limit(self.params);
+            self.log_message.emit(f"A Limit: {m}" if s else f"警告：固件不支持限位回退配置: {m}")
+            level_ff = False
+            if self.params['level_enabled']:
+                s, m = motion_ctrl.config_level(self.params);
+                self.log_message.emit(f"Level: {m}" if s else f"警告：液位闭环未启用: {m}")
+                level_ff = s
             # --- 修改结束 ---
-            self.log_message.emit("配置发送完成。")
+            if self.params['telemetry'] and tracer.enabled: self._start_telemetry(motion_ctrl)
+            expected = layer_motion_seconds(self.params, PrintConfig.A_TRAVEL_MM)
+            self.log_message.emit(f"配置发送完成。层间运动预计 {expected:.1f}s，"
+                                  f"超过 {layer_motion_deadline(self.params, PrintConfig.A_TRAVEL_MM):.1f}s (含 A 归位重试) 视为失败。")
+
+            # --- 打印日志：新任务记录起始 Z；续打时等固件空闲后按运动计划进度 (或 Z 位置) 确定从哪一层继续 ---
+            journal = self._open_journal(motion_ctrl, total_layers)
+            start_layer, pending_motion = 1, False
+            if self.params.get('resume_journal'):
+                start_layer, pending_motion = self._locate(motion_ctrl, journal)
+                if start_layer > total_layers:
+                    journal.finish(True, "打印完成"); self.log_message.emit("日志中的任务已全部曝光，无需续打。"); return
+                self.log_message.emit(f"从第 {start_layer} / {total_layers} 层继续打印。")
+
+            # --- 上传整个任务 (续打时为剩余部分) 的运动计划，层间只需发送 GO (旧固件回退到 NEXT_LAYER) ---
+            use_plan = False
+            motions = total_layers - start_layer + int(pending_motion)
+            if motions > 0:
+                motion = layer_motion_from_params(self.params, dwell_ms=self.params['peel_dwell_ms'])
+                try:
+                    s, m = motion_ctrl.upload_plan(build_motion_plan([motion] * motions))
+                except ValueError as e:  # 参数超出计划的编码范围，NEXT_LAYER 不受此限制
+                    s, m = False, str(e)
+                self.log_message.emit(m if s else f"警告：{m}，改用逐层 NEXT_LAYER。")
+                use_plan = s
+                if use_plan and journal: journal.planned(start_layer - 1 - int(pending_motion), motions)
+            motion_ctrl.event_callback = self._on_motion_event
 
             success, msg = projector_mgr.show_black();
             if not success: raise RuntimeError(f"初始黑屏失败: {msg}")
+            if pending_motion:
+                self.log_message.emit(f"第 {start_layer - 1} 层已曝光，补做其后的层间运动...")
+                success, msg = self._layer_motion(motion_ctrl, use_plan).result()
+                if not success: raise RuntimeError(f"层间运动失败: {msg}")
+                self._record_position(motion_ctrl, journal, start_layer - 1)
+            if self.params.get('resume_journal'): journal.resumed(start_layer, "重新启动")
+
+            # --- 层间重叠：NEXT_LAYER 执行期间预载下一层切片并预选 LED ---
+            scheduler = LayerScheduler([
+                ("预载切片", lambda idx: self._traced('frame_fetch', idx, projector_mgr.preload_image, image_paths[idx])),
+                ("预选 LED", lambda idx: self._traced('led_arm', idx, light_engine_ctrl.arm_led_on)),
+            ] + ([("液位前馈", lambda idx: self._traced('level_ff', idx, self._feed_level, motion_ctrl, image_paths[idx]))]
+                 if level_ff else [])
+              + ([("对时", lambda idx: self._resync(motion_ctrl))] if self._telemetry else []),
+                log=self.log_message.emit)
+            success, msg = scheduler.prepare(start_layer - 1)[:2]
+            if not success: raise RuntimeError(f"第 {start_layer} 层准备失败: {msg}")
             self.log_message.emit("--- 所有硬件已初始化，打印循环开始 ---")
-            for i, image_path in enumerate(image_paths):
+            tracer.complete('startup', run_start, now_ns())
+            for i in range(start_layer - 1, total_layers):
                 if not self._is_running: self.log_message.emit("打印任务被用户终止。"); break
-                layer_num = i + 1;
+                layer_num = i + 1; layer_start = now_ns()
                 self.log_message.emit(f"\n--- 正在打印第 {layer_num} / {total_layers} 层 ---")
-                if layer_num == 1:
-                    exposure_time = self.params['first_layer_expo']
-                elif layer_num <= self.params['transition_layers']:
-                    progress = (layer_num - 1) / (self.params['transition_layers'] - 1); exposure_time = self.params[
-                                                                                                             'first_layer_expo'] - (
-                                                                                                                     self.params[
-                                                                                                                         'first_layer_expo'] -
-                                                                                                                     self.params[
-                                                                                                                         'normal_expo']) * progress
-                else:
-                    exposure_time = self.params['normal_expo']
+                exposure_time = self._exposure_time(layer_num)
                 self.log_message.emit(f"曝光时间: {exposure_time:.2f} 秒")
-                success, msg = projector_mgr.show_image(image_path);
+                with tracer.span('projector_present', layer=layer_num): success, msg = projector_mgr.present();
                 if not success: raise RuntimeError(f"显示切片 {layer_num} 失败: {msg}")
-                success, msg = light_engine_ctrl.led_on();
+                with tracer.span('led_on', layer=layer_num): success, msg = light_engine_ctrl.led_on();
                 if not success: raise RuntimeError(f"打开 LED 失败: {msg}")
-                time.sleep(exposure_time)
-                success, msg = projector_mgr.show_black();
+                scheduler.exposure_started()
+                with tracer.span('exposure', layer=layer_num, target_s=exposure_time):
+                    self._stop_event.wait(exposure_time)  # 终止时提前结束曝光
+                with tracer.span('projector_black', layer=layer_num): success, msg = projector_mgr.show_black();
                 if not success: self.log_message.emit(f"警告：设置黑屏失败: {msg}")
-                success, msg = light_engine_ctrl.led_off();
+                with tracer.span('led_off', layer=layer_num): success, msg = light_engine_ctrl.led_off();
                 if not success: raise RuntimeError(f"关闭 LED 失败: {msg}")
+                if journal: journal.exposed_layer(layer_num)
+                if not self._is_running: self.log_message.emit("打印任务被用户终止。"); break
                 if layer_num < total_layers:
-                    self.log_message.emit("执行层间运动...");
-                    success, msg = motion_ctrl.move_to_next_layer();
-                    if not success: raise RuntimeError(f"层间运动失败: {msg}")
+                    self.log_message.emit("执行层间运动 (并行准备下一层)...");
+                    motion_start = self._fw_mark = now_ns()
+                    try:
+                        motion_future = self._layer_motion(motion_ctrl, use_plan)
+                    except RuntimeError as e:  # 曝光期间已断线
+                        success, msg = False, f"层间运动失败: {e}"
+                    else:
+                        motion_future.add_done_callback(lambda _f, start=motion_start, n=layer_num: tracer.complete(
+                            'layer_motion', start, now_ns(), 'motion', 'esp32', {'layer': n}))
+                        success, msg = scheduler.overlap(motion_future, i + 1);
+                    # 断线 (而非固件报错) 时重连并核对位置，再重新准备下一层
+                    if not success and self._is_running and journal and not self._link_alive(motion_ctrl):
+                        success, msg = self._recover_link(motion_ctrl, journal, use_plan, layer_num)
+                        if success: success, msg = scheduler.prepare(i + 1)[:2]
+                    if not success and not self._is_running: self.log_message.emit(f"层间运动已急停: {msg}"); break
+                    if not success: raise RuntimeError(msg)
+                    if journal: self._record_position(motion_ctrl, journal, layer_num)
                     self.log_message.emit("层间运动完成。")
+                tracer.complete('layer', layer_start, now_ns(), 'layer', 'layers', {'layer': layer_num})
             else:
                 self.log_message.emit("\n--- 打印完成！ ---")
+            if journal: journal.finish(self._is_running, "打印完成" if self._is_running else "用户终止")
+            self.log_message.emit(scheduler.summary())
         except Exception as e:
             error_msg = f"打印过程中发生错误: {e}\n{traceback.format_exc()}";
             self.log_message.emit(error_msg);
@@ -387,11 +674,186 @@ class PrintWorker(QObject):
             if projector_mgr: projector_mgr.stop()
             if light_engine_ctrl: light_engine_ctrl.disconnect()
             if motion_ctrl: motion_ctrl.disconnect()
+            if journal: journal.close()
+            self._export_trace()
             self.log_message.emit("任务线程已结束。");
             self.finished.emit()
 
+    def _layer_motion(self, motion_ctrl, use_plan):
+        """提交一次层间运动 (截止时间按参数估算)，返回 Future；未连接时抛出 RuntimeError"""
+        deadline = layer_motion_deadline(self.params, PrintConfig.A_TRAVEL_MM)
+        return motion_ctrl.run_planned_layer(deadline) if use_plan else motion_ctrl.submit_command("NEXT_LAYER", deadline)
+
+    def _open_journal(self, motion_ctrl, total_layers):
+        """续打时打开指定日志；新任务读取起始 Z 后创建日志。未配置目录或读不到 Z 时返回 None (本次不能续打)"""
+        path = self.params.get('resume_journal')
+        if path:
+            try:
+                journal = PrintJournal.open(path)
+            except (OSError, ValueError) as e:
+                raise RuntimeError(f"无法续打: {e}")
+            if journal.header['layers'] != total_layers:
+                journal.close(); raise RuntimeError(f"无法续打: 切片数 {total_layers} 与日志 ({journal.header['layers']}) 不符")
+            self.log_message.emit(f"续打日志: {path} (已曝光 {journal.exposed} 层)")
+            return journal
+        if not self.params['journal_dir']: return None
+        s, position = motion_ctrl.query_position()
+        if not s: self.log_message.emit(f"警告：无法读取 Z 位置，本次打印不记录日志 (不能续打): {position}"); return None
+        z_step = self.params['peel_lift_z1'] - self.params['peel_return_z2']
+        try:
+            journal = PrintJournal.create(self.params['journal_dir'], self.params['zip_path'], total_layers,
+                                          position['z'], z_step, self.params)
+        except OSError as e:
+            self.log_message.emit(f"警告：无法创建打印日志 (不能续打): {e}"); return None
+        self.log_message.emit(f"打印日志: {journal.path}")
+        return journal
+
+    def _record_position(self, motion_ctrl, journal, layer_num):
+        """层间运动完成后异步查询 Z 写入日志，不阻塞下一层曝光；查询失败也写入记录 (z 为 None，续打时外推)"""
+        def record(future):
+            success, response = future.result() if future.exception() is None else (False, "")
+            position = MotionController.parse_position(response) if success else None
+            journal.layer_done(layer_num, position['z'] if position else None)
+        try:
+            motion_ctrl.submit_command("POS", deadline=2.0).add_done_callback(record)
+        except RuntimeError:
+            journal.layer_done(layer_num, None)
+
+    def _link_alive(self, motion_ctrl):
+        return motion_ctrl.is_connected() and motion_ctrl.ping()[0]
+
+    def _wait_idle(self, motion_ctrl):
+        """断线期间固件会继续执行已收到的运动：轮询 STATUS 直到空闲且队列为空 (至多等一次层间运动的截止时间)"""
+        timeout = layer_motion_deadline(self.params, PrintConfig.A_TRAVEL_MM)
+        deadline = time.monotonic() + timeout
+        while True:
+            s, status = motion_ctrl.query_status()
+            if not s: return False, status
+            if status['state'] == 'idle' and status['queue'] == '0': return True, status
+            if time.monotonic() > deadline: return False, f"固件 {timeout:.0f}s 内未空闲 ({status['cmd']})"
+            if self._stop_event.wait(0.2): return False, "用户终止"
+
+    def _locate(self, motion_ctrl, journal):
+        """固件空闲后按运动计划进度 (或 Z 位置) 与日志核对，返回 (下一层层号, 是否需先补做层间运动)"""
+        s, status = self._wait_idle(motion_ctrl)
+        if not s: raise RuntimeError(f"无法确认固件状态: {status}")
+        s, position = motion_ctrl.query_position()
+        if not s: raise RuntimeError(f"读取 Z 位置失败: {position}")
+        done, _, planned = status['layer'].partition('/')
+        try:
+            return journal.locate(position['z'], (int(done), int(planned)))
+        except ValueError as e:
+            raise RuntimeError(str(e))
+
+    def _reconnect(self, motion_ctrl, deadline):
+        """指数退避重连，直到成功、超过 deadline 或用户终止 (后两者抛出 RuntimeError)"""
+        delay = PrintConfig.RECONNECT_INITIAL_S; attempt = 0
+        while self._is_running:
+            attempt += 1
+            success, msg = motion_ctrl.connect(PrintConfig.RECONNECT_CONNECT_TIMEOUT_S)
+            if success: self.log_message.emit(f"第 {attempt} 次重连成功。"); return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: raise RuntimeError(f"重连 {attempt} 次均失败: {msg}")
+            self.log_message.emit(f"重连失败 ({msg})，{min(delay, remaining):.1f}s 后重试...")
+            if self._stop_event.wait(min(delay, remaining)): break
+            delay = min(delay * 2, PrintConfig.RECONNECT_MAX_S)
+        raise RuntimeError("用户终止")
+
+    def _recover_link(self, motion_ctrl, journal, use_plan, layer_num):
+        """第 layer_num 层之后的层间运动因断线失败：重连，等固件空闲后按 Z 位置判断运动是否已完成，
+        未执行则重新执行 (其间再次断线会重复此过程，总时长受 RECONNECT_TIMEOUT_S 限制)。返回 (success, msg)"""
+        deadline = time.monotonic() + PrintConfig.RECONNECT_TIMEOUT_S
+        while True:
+            self.log_message.emit(f"与 ESP32 的连接中断，正在重连 (最长 {PrintConfig.RECONNECT_TIMEOUT_S:.0f}s)...")
+            motion_ctrl.disconnect()
+            try:
+                with self.tracer.span('motion_reconnect', layer=layer_num):
+                    self._reconnect(motion_ctrl, deadline)
+                    _, pending_motion = self._locate(motion_ctrl, journal)
+            except RuntimeError as e:
+                return False, f"断线恢复失败: {e}"
+            if self._telemetry: self._start_telemetry(motion_ctrl)  # 订阅随连接失效
+            if not pending_motion:
+                self.log_message.emit("断线期间固件已完成层间运动。"); break
+            self.log_message.emit("层间运动未执行，重新执行...")
+            try:
+                success, msg = self._layer_motion(motion_ctrl, use_plan).result()
+            except RuntimeError as e:
+                success, msg = False, str(e)
+            if success: break
+            if not self._is_running or self._link_alive(motion_ctrl): return False, f"层间运动失败: {msg}"
+        journal.resumed(layer_num + 1, "断线重连")
+        return True, "已恢复"
+
+    def _traced(self, name, layer_index, func, *args):
+        with self.tracer.span(name, layer=layer_index + 1): return func(*args)
+
+    def _on_motion_event(self, evt):
+        """固件进度事件 (通信线程中调用)。STEP 事件在子步骤完成时发出，
+        子步骤 span 取上一个子步骤完成 (或运动提交) 到本事件的时间；并行的 A_HOME 会包含与 Z 重叠的部分"""
+        telemetry = self._telemetry
+        if telemetry and telemetry.handle_event(evt): return
+        self.log_message.emit(f"[ESP32] {evt}")
+        kind, _, rest = evt.partition(',')
+        if kind == 'STEP' and not telemetry:
+            end = now_ns(); start = self._fw_mark or end; self._fw_mark = end
+            fw_layer, _, step = rest.partition(',')
+            self.tracer.complete(step, start, end, 'firmware', 'esp32 steps', {'fw_layer': fw_layer})
+
+    def _start_telemetry(self, motion_ctrl):
+        """对时后订阅固件遥测；液位采样需要液位传感器，失败时只订阅子步骤计时"""
+        telemetry = FirmwareTelemetry(self.tracer)
+        s, m = telemetry.sync(motion_ctrl, samples=5)
+        if not s: self.log_message.emit(f"警告：固件不支持对时，子步骤按进度事件估算: {m}"); return
+        level_ms = self.params['telemetry_level_ms']
+        s, m = motion_ctrl.enable_telemetry(TM_STEPS | (TM_LEVEL if level_ms else 0), level_ms)
+        if not s and level_ms: s, m = motion_ctrl.enable_telemetry(TM_STEPS, 0)
+        if not s: self.log_message.emit(f"警告：固件遥测未启用: {m}"); return
+        self._telemetry = telemetry
+        self.log_message.emit(f"固件遥测已启用，{telemetry.sync(motion_ctrl)[1]}")
+
+    def _resync(self, motion_ctrl):
+        """每层补充一次对时样本，跟踪两侧晶振的漂移；失败只告警，不影响打印"""
+        success, msg = self._telemetry.sync(motion_ctrl)
+        if not success: self.log_message.emit(f"警告：{msg}")
+        return True, msg
+
+    def _export_trace(self):
+        if not self.tracer.enabled or not self.params['trace_dir']: return
+        path = os.path.join(self.params['trace_dir'], time.strftime("trace_%Y%m%d_%H%M%S.json"))
+        try:
+            count = self.tracer.export(path)
+            self.log_message.emit(f"时间线已导出: {path} ({count} 条，可在 ui.perfetto.dev 打开)")
+        except OSError as e:
+            self.log_message.emit(f"警告：导出时间线失败: {e}")
+
+    def _feed_level(self, motion_ctrl, image_path):
+        """按切片亮像素面积估算本层树脂消耗，折算为 B 轴补偿量发送给固件 (不等待回复)"""
+        try:
+            with Image.open(image_path) as img:
+                lit_pixels = sum(img.convert('L').histogram()[128:])
+        except OSError as e:
+            return False, f"读取切片失败: {e}"
+        volume_mm3 = lit_pixels * self.params['pixel_pitch'] ** 2 * self.params['layer_height']
+        mm = volume_mm3 / self.params['b_displacer_area']
+        try:
+            motion_ctrl.feed_level(mm)
+        except RuntimeError as e:  # 断线：由层间运动的失败处理重连
+            return False, str(e)
+        return True, f"{mm:.4f} mm"
+
+    def _exposure_time(self, layer_num):
+        return exposure_time(self.params, layer_num)
+
     def stop(self):
-        self._is_running = False
+        self._is_running = False; self._stop_event.set()
+        # 立即让固件中止当前运动，而不是等到下一层边界
+        motion_ctrl = self._motion_ctrl
+        if motion_ctrl and motion_ctrl.is_connected():
+            try:
+                motion_ctrl.stop_motion()
+            except Exception as e:
+                self.log_message.emit(f"警告：发送 STOP 失败: {e}")
 
 
 # --- 4. PyQt5 主窗口 ---
@@ -439,6 +901,8 @@ class MainWindow(QWidget):
 
         self.initUI()
         self.setMinimumSize(800, 600)  # 设置一个最小尺寸
+        self.metrics_server = None
+        self.start_metrics_server()
 
     def initUI(self):
         self.setWindowTitle('四轴 DLP 打印机控制器 v4.5 (简体中文版)')
@@ -457,6 +921,10 @@ class MainWindow(QWidget):
         conn_layout.addWidget(QLabel("ESP32 IP:"))
         self.esp32_ip_edit = QLineEdit(PrintConfig.ESP32_IP_ADDRESS)
         conn_layout.addWidget(self.esp32_ip_edit)
+        conn_layout.addWidget(QLabel("串口:"))
+        self.esp32_serial_edit = QLineEdit(PrintConfig.ESP32_SERIAL_PORT or "")
+        self.esp32_serial_edit.setPlaceholderText("如 COM5，留空只用 Wi-Fi")
+        conn_layout.addWidget(self.esp32_serial_edit)
         self.connect_button = QPushButton("连接 & 初始化 ESP32")
         self.connect_button.clicked.connect(self.connect_esp32)
         conn_layout.addWidget(self.connect_button)
@@ -507,6 +975,24 @@ class MainWindow(QWidget):
         self.c_jog_speed_edit = QDoubleSpinBox();
         self.c_jog_speed_edit.setValue(PrintConfig.C_JOG_SPEED)
         speed_layout.addWidget(self.c_jog_speed_edit, 2, 1)
+        speed_layout.addWidget(QLabel("Z 脱离距离 (mm):"), 3, 0)
+        self.z_break_dist_edit = QDoubleSpinBox();
+        self.z_break_dist_edit.setDecimals(2);
+        self.z_break_dist_edit.setValue(PrintConfig.Z_BREAK_DISTANCE)
+        speed_layout.addWidget(self.z_break_dist_edit, 3, 1)
+        speed_layout.addWidget(QLabel("Z 脱离速度:"), 3, 2)
+        self.z_break_speed_edit = QDoubleSpinBox();
+        self.z_break_speed_edit.setValue(PrintConfig.Z_BREAK_SPEED)
+        speed_layout.addWidget(self.z_break_speed_edit, 3, 3)
+        speed_layout.addWidget(QLabel("Z 接近距离 (mm):"), 4, 0)
+        self.z_approach_dist_edit = QDoubleSpinBox();
+        self.z_approach_dist_edit.setDecimals(2);
+        self.z_approach_dist_edit.setValue(PrintConfig.Z_APPROACH_DISTANCE)
+        speed_layout.addWidget(self.z_approach_dist_edit, 4, 1)
+        speed_layout.addWidget(QLabel("Z 接近速度:"), 4, 2)
+        self.z_approach_speed_edit = QDoubleSpinBox();
+        self.z_approach_speed_edit.setValue(PrintConfig.Z_APPROACH_SPEED)
+        speed_layout.addWidget(self.z_approach_speed_edit, 4, 3)
         speed_group.setLayout(speed_layout)
         controls_layout.addWidget(speed_group)  # 添加到 controls_layout
 
@@ -559,9 +1045,12 @@ class MainWindow(QWidget):
         control_layout = QHBoxLayout()
         self.start_button = QPushButton("开始打印")
         self.start_button.clicked.connect(self.start_print)
+        self.resume_button = QPushButton("续打")
+        self.resume_button.clicked.connect(self.resume_print)
         self.stop_button = QPushButton("终止打印")
         self.stop_button.clicked.connect(self.stop_print)
         control_layout.addWidget(self.start_button)
+        control_layout.addWidget(self.resume_button)
         control_layout.addWidget(self.stop_button)
         controls_layout.addLayout(control_layout)  # 添加到 controls_layout
 
@@ -692,6 +1181,7 @@ class MainWindow(QWidget):
         self.connect_button.setEnabled(not printing)
         self.jog_group.setEnabled(connected and not printing)
         self.start_button.setEnabled(connected and not printing)
+        self.resume_button.setEnabled(connected and not printing)
         self.stop_button.setEnabled(printing)
 
         # 仅禁用非 jog_group 的 QGroupBox
@@ -700,6 +1190,7 @@ class MainWindow(QWidget):
                 widget.setEnabled(not printing)
 
         self.esp32_ip_edit.setEnabled(not printing)
+        self.esp32_serial_edit.setEnabled(not printing)
 
     def log(self, message):
         if isinstance(message, str):
@@ -712,20 +1203,44 @@ class MainWindow(QWidget):
         peel_base = self.peel_base_dist_edit.value();
         layer_height = self.layer_height_edit.value()
         return {'esp32_ip': self.esp32_ip_edit.text(), 'esp32_port': PrintConfig.ESP32_PORT,
+                'esp32_serial': self.esp32_serial_edit.text().strip() or None, 'motion_link': PrintConfig.MOTION_LINK,
                 'zip_path': PrintConfig.ZIP_FILE_PATH, 'temp_dir': PrintConfig.TEMP_EXTRACT_DIR,
                 'black_image_path': PrintConfig.BLACK_IMAGE_PATH,
                 'controller_exe_path': PrintConfig.CONTROLLER_EXE_PATH,
                 'monitor_index': PrintConfig.PROJECTOR_MONITOR_INDEX, 'first_layer_expo': self.first_expo_edit.value(),
                 'normal_expo': self.normal_expo_edit.value(), 'transition_layers': PrintConfig.TRANSITION_LAYERS,
+                'peel_dwell_ms': PrintConfig.PEEL_DWELL_MS, 'a_home_clearance': PrintConfig.A_HOME_CLEARANCE_MM,
+                'z_accel': PrintConfig.Z_ACCEL, 'a_accel': PrintConfig.A_ACCEL, 'ramp_profile': PrintConfig.RAMP_PROFILE,
+                'layer_height': layer_height, 'level_enabled': PrintConfig.LEVEL_CONTROL_ENABLED,
+                'level_setpoint': PrintConfig.LEVEL_SETPOINT_ADC, 'level_kp': PrintConfig.LEVEL_KP,
+                'level_ki': PrintConfig.LEVEL_KI, 'pixel_pitch': PrintConfig.PIXEL_PITCH_MM,
+                'b_displacer_area': PrintConfig.B_DISPLACER_AREA_MM2,
+                'a_limit_release': PrintConfig.A_LIMIT_RELEASE_MM, 'a_prehome': PrintConfig.A_PREHOME_MM,
                 'z_pulse_rev': PrintConfig.Z_PULSE_PER_REV, 'z_lead': PrintConfig.Z_LEAD,
                 'a_pulse_rev': PrintConfig.A_PULSE_PER_REV, 'a_lead': PrintConfig.A_LEAD,
                 'b_pulse_rev': PrintConfig.B_PULSE_PER_REV, 'b_lead': PrintConfig.B_LEAD,
                 'c_pulse_rev': PrintConfig.C_PULSE_PER_REV, 'c_lead': PrintConfig.C_LEAD,
                 'peel_lift_z1': peel_base + layer_height, 'peel_return_z2': peel_base,
                 'z_speed_down': self.z_speed_down_edit.value(), 'z_speed_up': self.z_speed_up_edit.value(),
+                'z_break_dist': self.z_break_dist_edit.value(), 'z_break_speed': self.z_break_speed_edit.value(),
+                'z_approach_dist': self.z_approach_dist_edit.value(), 'z_approach_speed': self.z_approach_speed_edit.value(),
                 'a_fast_speed': self.a_speed_fast_edit.value(), 'a_slow_speed': self.a_speed_slow_edit.value(),
                 'c_jog_speed': self.c_jog_speed_edit.value(), 'z_jog_speed': PrintConfig.Z_JOG_SPEED,
-                'a_jog_speed': PrintConfig.A_JOG_SPEED, 'b_jog_speed': PrintConfig.B_JOG_SPEED, }
+                'a_jog_speed': PrintConfig.A_JOG_SPEED, 'b_jog_speed': PrintConfig.B_JOG_SPEED,
+                'trace_dir': PrintConfig.TRACE_DIR, 'telemetry': PrintConfig.TELEMETRY_ENABLED,
+                'telemetry_level_ms': PrintConfig.TELEMETRY_LEVEL_PERIOD_MS,
+                'metrics_port': self.metrics_server.port if self.metrics_server else None,
+                'journal_dir': PrintConfig.JOURNAL_DIR, }
+
+    def start_metrics_server(self):
+        if PrintConfig.METRICS_PORT is None: return
+        server = MetricsServer(REGISTRY, PrintConfig.METRICS_HOST, PrintConfig.METRICS_PORT)
+        try:
+            host, port = server.start()
+        except OSError as e:
+            self.log(f"警告：指标服务启动失败 (端口 {PrintConfig.METRICS_PORT}): {e}"); return
+        self.metrics_server = server
+        self.log(f"指标服务: http://{host}:{port}/metrics")
 
     @pyqtSlot()
     def connect_esp32(self):
@@ -736,8 +1251,9 @@ class MainWindow(QWidget):
             self.update_ui_state(connected=False, printing=False);
             return
         params = self.get_params();
-        self.log(f"正在连接并初始化 ESP32 于 {params['esp32_ip']}...");
-        self.motion_controller = MotionController(params['esp32_ip'], params['esp32_port']);
+        self.log(f"正在连接并初始化 ESP32 于 {params['esp32_ip']}" + (f" / {params['esp32_serial']}" if params['esp32_serial'] else "") + "...");
+        self.motion_controller = MotionController(params['esp32_ip'], params['esp32_port'],
+                                                  serial_port=params['esp32_serial'], link_mode=params['motion_link']);
         success, msg = self.motion_controller.connect();
         self.log(msg)
         if success:
@@ -762,6 +1278,8 @@ class MainWindow(QWidget):
                 s, m = self.motion_controller.config_a_wipe(params);
                 self.log(f"A Wipe: {m}");
                 if not s: raise RuntimeError(f"配置 A Wipe 失败: {m}")
+                s, m = self.motion_controller.config_z_peel_profile(params);
+                self.log(f"Z Peel Profile: {m}" if s else f"警告：固件不支持分段剥离: {m}");
                 self.log("ESP32 初始化成功。");
                 self.connect_button.setText("断开连接");
                 self.update_ui_state(connected=True, printing=False)
@@ -775,12 +1293,26 @@ class MainWindow(QWidget):
 
     @pyqtSlot()
     def start_print(self):
+        self._start_worker(self.get_params())
+
+    @pyqtSlot()
+    def resume_print(self):
+        """从最近一个未结束的打印日志续打 (控制器崩溃或断线恢复失败之后)"""
+        path = latest_unfinished(PrintConfig.JOURNAL_DIR) if PrintConfig.JOURNAL_DIR else None
+        if path is None: self.log("错误：没有可续打的打印日志。"); return
+        try:
+            header = read_journal(path)[0]
+        except (OSError, ValueError) as e:
+            self.log(f"错误：读取打印日志失败: {e}"); return
+        params = resume_params(header, self.get_params()); params['resume_journal'] = path
+        self._start_worker(params)
+
+    def _start_worker(self, params):
         if self.worker_thread and self.worker_thread.isRunning(): self.log("错误：打印任务已在运行。"); return
         if not self.motion_controller or not self.motion_controller.is_connected(): self.log(
             "错误：请先连接到 ESP32。"); return
         self.log_widget.clear();
-        params = self.get_params();
-        self.log("准备开始打印任务...")
+        self.log("准备开始打印任务..." if 'resume_journal' not in params else f"准备续打: {params['zip_path']}")
         self.worker_thread = QThread(self);
         self.print_worker = PrintWorker(params);
         self.print_worker.moveToThread(self.worker_thread)
@@ -838,6 +1370,7 @@ class MainWindow(QWidget):
             self.stop_print()
             if not self.worker_thread.wait(5000): self.log("警告：后台任务未能及时结束，可能需要强制退出。")
         if self.motion_controller: self.motion_controller.disconnect()
+        if self.metrics_server: self.metrics_server.stop()
         event.accept()
 
 
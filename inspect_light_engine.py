@@ -1,6 +1,7 @@
 # inspect_light_engine.py
 import time
 from pywinauto.application import Application
+from uia_cache import UIAElementCache, LED_CONTROLS, CURRENT_CONTROLS
 
 print("--- 光機軟體 UI 結構偵測工具 ---")
 
@@ -21,6 +22,13 @@ try:
     main_win.print_control_identifiers(depth=4)
     print("\n--- 偵測完畢 ---")
 
+    # 4. 一次性解析並保存控件句柄與路徑，供控制腳本快速重連
+    cache = UIAElementCache(title=window_title)
+    cache.inspect(main_win, {**LED_CONTROLS, **CURRENT_CONTROLS})
+    print(f"UIA 元素快取已寫入: {cache.cache_path}")
+    for auto_id, entry in cache.data['controls'].items():
+        print(f"  {auto_id}: {entry['control_type']} {entry['path']}")
+
 except Exception as e:
     print(f"\n發生錯誤: {e}")
     print("請確認軟體是否已打開，且視窗標題完全符合。")
@@ -0,0 +1,206 @@
+# job_queue.py
+# 功能：持久化的打印任务队列 (JSON 文件)，由 fleet.py --queue 执行，本脚本的命令行用于排队 / 换板确认。
+# 控制器与命令行是两个进程：每次修改都在文件锁内 "重新读取 -> 修改 -> 原子替换"，
+# 控制器按文件修改时间轮询，换板确认后下一个任务 (已在后台准备好) 立即开始。
+# 用法:
+#   python job_queue.py add dlp-1 part.zip --param normal_expo=3.0
+#   python job_queue.py confirm dlp-1        # 已取下成品并装好空平台
+#   python job_queue.py list | cancel <id>
+
+import argparse
+import json
+import os
+import sys
+import time
+
+JOB_QUEUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "print_jobs.json")
+QUEUE_VERSION = 1
+LOCK_STALE_S = 10.0
+
+
+class _FileLock:
+    """以目录创建的原子性实现的跨进程锁 (Windows / Linux 通用)；持有者崩溃时超过 LOCK_STALE_S 视为失效"""
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path + ".lock"; self.timeout = timeout
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                os.mkdir(self.path); return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > LOCK_STALE_S: os.rmdir(self.path); continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline: raise TimeoutError(f"任务队列被占用: {self.path}")
+                time.sleep(0.02)
+
+    def __exit__(self, *exc):
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+
+class JobQueue:
+    """任务: {'id', 'printer', 'zip_path', 'params', 'state', 'message', 'created_at', 'started_at', 'finished_at'}；
+    state: queued -> printing -> done / failed，cancelled 只能由 queued 转入；
+    plates: 打印机名 -> 'empty' | 'occupied' (开始打印即占用，换板确认后恢复 empty，重启后仍然有效)"""
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        self.data = self._read()
+        self._mtime = self._stat()
+
+    # --- 1. 文件读写 ---
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == QUEUE_VERSION: return data
+            print(f"警告：任务队列版本不符，忽略 {self.path}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"警告：无法读取任务队列 {self.path}: {e}")
+        return {'version': QUEUE_VERSION, 'next_id': 1, 'jobs': [], 'plates': {}}
+
+    def _write(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._mtime = self._stat()
+
+    def _mutate(self, func):
+        with _FileLock(self.path):
+            self.data = self._read()
+            result = func(self.data)
+            self._write()
+            return result
+
+    def refresh(self):
+        """文件被其他进程修改过则重新读取，返回是否有变化"""
+        mtime = self._stat()
+        if mtime == self._mtime: return False
+        self.data = self._read(); self._mtime = mtime
+        return True
+
+    # --- 2. 查询 ---
+    def jobs(self, printer=None, states=None):
+        return [j for j in self.data['jobs']
+                if (printer is None or j['printer'] == printer) and (states is None or j['state'] in states)]
+
+    def next_job(self, printer):
+        """下一个排队中的任务 (按加入顺序)"""
+        return next(iter(self.jobs(printer, ('queued',))), None)
+
+    def get(self, job_id):
+        return next((j for j in self.data['jobs'] if j['id'] == job_id), None)
+
+    def plate_ready(self, printer):
+        return self.data['plates'].get(printer, 'empty') == 'empty'
+
+    # --- 3. 修改 ---
+    def add(self, printer, zip_path, params=None):
+        def add(data):
+            job = {'id': data['next_id'], 'printer': printer, 'zip_path': os.path.abspath(zip_path),
+                   'params': params or {}, 'state': 'queued', 'message': "",
+                   'created_at': time.strftime("%Y-%m-%d %H:%M:%S"), 'started_at': None, 'finished_at': None}
+            data['next_id'] += 1; data['jobs'].append(job)
+            return job
+        return self._mutate(add)
+
+    def update(self, job_id, from_states=None, **fields):
+        """修改任务字段；给出 from_states 时只在任务处于其中某一状态时修改 (在文件锁内检查)，否则返回 None"""
+        def update(data):
+            job = next((j for j in data['jobs'] if j['id'] == job_id), None)
+            if job is None or (from_states is not None and job['state'] not in from_states): return None
+            job.update(fields)
+            return job
+        return self._mutate(update)
+
+    def start(self, job_id):
+        """开始打印：任务转为 printing，平台标记为占用 (直到换板确认)"""
+        def start(data):
+            job = next(j for j in data['jobs'] if j['id'] == job_id)
+            if job['state'] != 'queued': return False
+            job.update(state='printing', started_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+            data['plates'][job['printer']] = 'occupied'
+            return True
+        return self._mutate(start)
+
+    def finish(self, job_id, success, message="", from_states=None):
+        return self.update(job_id, from_states, state='done' if success else 'failed', message=message,
+                           finished_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def cancel(self, job_id):
+        def cancel(data):
+            job = next((j for j in data['jobs'] if j['id'] == job_id), None)
+            if job is None or job['state'] != 'queued': return False
+            job['state'] = 'cancelled'; return True
+        return self._mutate(cancel)
+
+    def confirm_plate(self, printer):
+        def confirm(data): data['plates'][printer] = 'empty'
+        self._mutate(confirm)
+
+    def recover(self):
+        """控制器启动时调用：上次运行中断时仍为 printing 的任务标记为失败 (平台保持占用，需人工确认)"""
+        def recover(data):
+            stale = [j for j in data['jobs'] if j['state'] == 'printing']
+            for job in stale: job.update(state='failed', message="控制器重启时任务未完成")
+            return stale
+        return self._mutate(recover)
+
+
+def _parse_param(text):
+    key, sep, value = text.partition('=')
+    if not sep: raise argparse.ArgumentTypeError(f"参数格式应为 key=value: {text}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="打印任务队列")
+    parser.add_argument('--queue', default=JOB_QUEUE_PATH, help="队列文件")
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help="加入任务")
+    add.add_argument('printer'); add.add_argument('zip_path')
+    add.add_argument('--param', action='append', type=_parse_param, default=[], help="覆盖打印参数，如 normal_expo=3.0")
+    sub.add_parser('list', help="列出任务")
+    confirm = sub.add_parser('confirm', help="确认已换板，允许开始下一个任务")
+    confirm.add_argument('printer')
+    cancel = sub.add_parser('cancel', help="取消排队中的任务")
+    cancel.add_argument('job_id', type=int)
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.queue)
+    if args.command == 'add':
+        if not os.path.exists(args.zip_path): print(f"错误：切片包不存在: {args.zip_path}"); return 1
+        job = queue.add(args.printer, args.zip_path, dict(args.param))
+        print(f"已加入任务 #{job['id']} ({args.printer}: {job['zip_path']})")
+    elif args.command == 'list':
+        for job in queue.jobs():
+            print(f"#{job['id']:<4} {job['printer']:<10} {job['state']:<10} {os.path.basename(job['zip_path'])} {job['message']}")
+        for printer, plate in sorted(queue.data['plates'].items()):
+            if plate != 'empty': print(f"{printer}: 等待换板确认")
+    elif args.command == 'confirm':
+        queue.confirm_plate(args.printer); print(f"{args.printer}: 已确认换板")
+    elif args.command == 'cancel':
+        print(f"任务 #{args.job_id} 已取消" if queue.cancel(args.job_id) else f"任务 #{args.job_id} 不在排队中，无法取消")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# layer_pipeline.py
+# 功能：层间重叠调度。
+# 层间运动 (NEXT_LAYER) 执行期间，并行完成下一层的非曝光准备工作
+# (预载切片到投影仪后台缓冲、设置光机参数等)；投影画面在运动完成前保持黑屏。
+# 同时统计每层关键路径上的空闲时间 (运动完成 -> 下一层开始曝光)。
+
+import time
+
+
+class LayerTiming:
+    __slots__ = ('layer', 'motion_s', 'prepare_s', 'idle_s')
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.motion_s = 0.0    # 层间运动耗时
+        self.prepare_s = 0.0   # 下一层准备耗时 (与运动重叠)
+        self.idle_s = 0.0      # 关键路径空闲：运动完成后到开始曝光的等待
+
+
+class LayerScheduler:
+    """把准备步骤与层间运动重叠执行。
+
+    prepare_steps: [(名称, callable(layer_index) -> (success, msg))]，在运动进行时依次执行。
+    运动本身在 ESP32 上异步进行，准备步骤直接在调用线程执行 (光机 UIA 对象不跨线程使用)。
+    """
+
+    def __init__(self, prepare_steps, log=print):
+        self.prepare_steps = list(prepare_steps)
+        self.log = log
+        self.timings = []
+        self._motion_done_at = None
+
+    def prepare(self, layer_index):
+        """同步执行准备步骤 (用于第一层，此时没有可重叠的运动)"""
+        return self._run_prepare(layer_index)
+
+    def _run_prepare(self, layer_index):
+        start = time.perf_counter()
+        for name, step in self.prepare_steps:
+            success, msg = step(layer_index)
+            if not success: return False, f"{name} 失败: {msg}", time.perf_counter() - start
+        return True, "准备完成", time.perf_counter() - start
+
+    def overlap(self, motion_future, next_layer_index):
+        """motion_future: 已提交的层间运动 (结果为 (success, msg))。
+        在其执行期间准备下一层，两者都完成后返回 (success, msg)。"""
+        timing = LayerTiming(next_layer_index)
+        start = time.perf_counter()
+        done_at = []
+        motion_future.add_done_callback(lambda _f: done_at.append(time.perf_counter()))
+        prepare_ok, prepare_msg, timing.prepare_s = self._run_prepare(next_layer_index)
+        motion_ok, motion_msg = motion_future.result()
+        # 以运动实际完成的时刻为准；若准备比运动慢，超出部分会计入关键路径空闲
+        self._motion_done_at = done_at[0] if done_at else time.perf_counter()
+        timing.motion_s = self._motion_done_at - start
+        self.timings.append(timing)
+        if not motion_ok: return False, f"层间运动失败: {motion_msg}"
+        if not prepare_ok: return False, f"下一层准备失败: {prepare_msg}"
+        return True, motion_msg
+
+    def exposure_started(self):
+        """在下一层打开 LED 时调用，记录关键路径空闲时间"""
+        if self._motion_done_at is None or not self.timings: return
+        timing = self.timings[-1]
+        timing.idle_s = time.perf_counter() - self._motion_done_at
+        self._motion_done_at = None
+        hidden = min(timing.prepare_s, timing.motion_s)
+        self.log(f"层 {timing.layer + 1}: 运动 {timing.motion_s:.2f}s, 准备 {timing.prepare_s:.2f}s "
+                 f"(已与运动重叠 {hidden:.2f}s), 关键路径空闲 {timing.idle_s * 1000:.0f}ms")
+
+    def summary(self):
+        if not self.timings: return "无层间运动统计。"
+        n = len(self.timings)
+        total_idle = sum(t.idle_s for t in self.timings)
+        total_hidden = sum(min(t.prepare_s, t.motion_s) for t in self.timings)
+        worst = max(self.timings, key=lambda t: t.idle_s)
+        return (f"层间统计 ({n} 次): 平均关键路径空闲 {total_idle / n * 1000:.0f}ms, "
+                f"最长 {worst.idle_s * 1000:.0f}ms (层 {worst.layer + 1}), 与运动重叠的准备时间共 {total_hidden:.1f}s")
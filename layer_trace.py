@@ -0,0 +1,114 @@
+# layer_trace.py
+# 功能：打印流程的时间线追踪。
+# 每个阶段记录为一个 span (开始时刻 + 时长)，写入固定容量的环形缓冲 (满后覆盖最旧的记录)，
+# 记录路径上只有一次 perf_counter_ns 与一次列表赋值，不加锁 (itertools.count 的 next 在 GIL 下是原子的)，
+# 可从打印线程与通信线程同时写入。结束后导出为 Chrome trace / Perfetto 可读的 JSON。
+
+import itertools
+import json
+import os
+import time
+
+now_ns = time.perf_counter_ns
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'cat', 'track', 'args', 'start')
+
+    def __init__(self, tracer, name, cat, track, args):
+        self.tracer = tracer; self.name = name; self.cat = cat; self.track = track; self.args = args
+
+    def __enter__(self):
+        self.start = now_ns(); return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None: self.args = dict(self.args or {}, error=exc_type.__name__)
+        self.tracer.complete(self.name, self.start, now_ns(), self.cat, self.track, self.args)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """span 记录格式: (序号, 阶段 ph, 名称, 类别, 轨道, 开始 ns, 时长 ns, 参数)"""
+
+    def __init__(self, capacity=65536, enabled=True):
+        self.capacity = capacity
+        self.enabled = enabled
+        self._buf = [None] * capacity
+        self._seq = itertools.count()
+        self._origin = now_ns()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(name, cat, track, start_ns, dur_ns, args) 在记录线程中同步调用，应为常数时间操作"""
+        self._listeners.append(callback)
+
+    # --- 记录 ---
+    def span(self, name, cat='pc', track='main', **args):
+        """with tracer.span('led_on', layer=3): ..."""
+        if not self.enabled: return NULL_SPAN
+        return _Span(self, name, cat, track, args or None)
+
+    def complete(self, name, start_ns, end_ns, cat='pc', track='main', args=None):
+        """记录已知起止时刻的 span (如由异步回调或固件事件推算出的阶段)"""
+        if not self.enabled: return
+        dur = end_ns - start_ns
+        i = next(self._seq)
+        self._buf[i % self.capacity] = (i, 'X', name, cat, track, start_ns, dur, args)
+        for callback in self._listeners: callback(name, cat, track, start_ns, dur, args)
+
+    def counter(self, name, ts_ns, cat='pc', track='main', **values):
+        """数值序列 (如液位)，Perfetto 中显示为曲线"""
+        if not self.enabled: return
+        i = next(self._seq)
+        self._buf[i % self.capacity] = (i, 'C', name, cat, track, ts_ns, 0, values)
+        for callback in self._listeners: callback(name, cat, track, ts_ns, 0, values)
+
+    def instant(self, name, cat='pc', track='main', **args):
+        if not self.enabled: return
+        i = next(self._seq)
+        self._buf[i % self.capacity] = (i, 'i', name, cat, track, now_ns(), 0, args or None)
+
+    # --- 导出 ---
+    def records(self):
+        """按写入顺序返回缓冲中仍保留的记录 (溢出时只剩最新的 capacity 条)"""
+        return sorted((r for r in list(self._buf) if r is not None), key=lambda r: r[0])
+
+    def dropped(self, records=None):
+        """因缓冲溢出被覆盖的记录数"""
+        records = self.records() if records is None else records
+        return records[-1][0] + 1 - len(records) if records else 0
+
+    def to_chrome(self, process_name="kkdlp"):
+        tracks = {}
+        events = []
+        records = self.records()
+        for _, ph, name, cat, track, start, dur, args in records:
+            tid = tracks.setdefault(track, len(tracks) + 1)
+            event = {'name': name, 'cat': cat, 'ph': ph, 'pid': 1, 'tid': tid, 'ts': (start - self._origin) / 1000}
+            if ph == 'X': event['dur'] = dur / 1000
+            elif ph == 'i': event['s'] = 't'
+            if args: event['args'] = args
+            events.append(event)
+        meta = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': process_name}}]
+        meta += [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': track}} for track, tid in tracks.items()]
+        return {'traceEvents': meta + events, 'displayTimeUnit': 'ms', 'otherData': {'dropped': self.dropped(records)}}
+
+    def export(self, path, process_name="kkdlp"):
+        """写出 Chrome trace JSON (chrome://tracing 或 ui.perfetto.dev 打开)"""
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        data = self.to_chrome(process_name)
+        with open(path, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False)
+        return len(data['traceEvents'])
+
+
+NULL_TRACER = Tracer(capacity=1, enabled=False)
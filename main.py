@@ -1,16 +1,26 @@
-# main.py - 四軸 TCP 控制版 (支援動態參數配置)
+# main.py - 四軸 TCP 控制版 (支援動態參數配置，計時器驅動步進)
 import machine
 import time
+import math
 import uasyncio
 
-# --- 1. 自定義異步隊列類 (保持不變) ---
+# --- 1. 自定義異步隊列類 (固定容量環形緩衝) ---
+# 出入隊 O(1)；隊列滿時 put 等待，讀取協程隨之暫停讀套接字，由 TCP 形成背壓
 class AsyncQueue:
-    def __init__(self): self.items = []; self.event = uasyncio.Event()
-    async def put(self, item): self.items.append(item); self.event.set()
+    def __init__(self, capacity=16):
+        self.buf = [None] * capacity; self.capacity = capacity; self.head = 0; self.count = 0
+        self.not_empty = uasyncio.Event(); self.not_full = uasyncio.Event(); self.not_full.set()
+    async def put(self, item):
+        while self.count == self.capacity: await self.not_full.wait()
+        self.buf[(self.head + self.count) % self.capacity] = item; self.count += 1
+        self.not_empty.set()
+        if self.count == self.capacity: self.not_full.clear()
     async def get(self):
-        while not self.items: await self.event.wait()
-        item = self.items.pop(0)
-        if not self.items: self.event.clear()
+        while self.count == 0: await self.not_empty.wait()
+        item = self.buf[self.head]; self.buf[self.head] = None
+        self.head = (self.head + 1) % self.capacity; self.count -= 1
+        if self.count == 0: self.not_empty.clear()
+        self.not_full.set()
         return item
 
 # --- 2. 硬體設定區 (保持不變) ---
@@ -20,9 +30,47 @@ B_STEP_PIN, B_DIR_PIN, B_ENA_PIN = 19, 18, 5
 C_STEP_PIN, C_DIR_PIN, C_ENA_PIN = 17, 16, 4
 LEVEL_SENSOR_PIN = 34
 
-# --- 3. 步進馬達驅動類 (保持不變) ---
+# --- 3. 步進間隔產生器 (AVR446 / Austin 演算法) ---
+# 每一步的間隔在計時器回呼中即時遞推，記憶體用量與步數無關；
+# 間隔以 Q.8 定點數 (µs << 8) 保存，遞推全為整數運算，餘數帶入下一步避免誤差累積。
+TIMER_TICK_HZ = 1_000_000
+FP_SHIFT = 8
+MAX_INTERVAL_US = 1_000_000
+
+class StepGenerator:
+    def __init__(self): self.reset(0, 1, 0)
+
+    def reset(self, total_steps, max_speed_steps_s, accel_steps_s2):
+        self.total = total_steps; self.step_no = 0; self.rest = 0
+        self.c_min = (TIMER_TICK_HZ << FP_SHIFT) // max(1, int(max_speed_steps_s))
+        if accel_steps_s2 > 0:
+            # c0 = 0.676 * f * sqrt(2/a)，每次運動只算一次浮點
+            self.c = max(self.c_min, int(0.676 * TIMER_TICK_HZ * math.sqrt(2 / accel_steps_s2)) << FP_SHIFT)
+            full_accel = int(max_speed_steps_s * max_speed_steps_s / (2 * accel_steps_s2))
+            self.accel_steps = min(full_accel, total_steps // 2)
+            self.cruise_c = self.c_min if self.accel_steps == full_accel else None  # 短行程達不到最高速，保持當前間隔
+        else:
+            self.c = self.c_min; self.accel_steps = 0; self.cruise_c = self.c_min
+        self.decel_start = total_steps - self.accel_steps
+
+    def next_interval_us(self):
+        """已完成 step_no 步之後，回傳下一步的間隔 (µs)"""
+        i = self.step_no
+        if i < self.accel_steps:      # 加速：c_n = c_{n-1} - 2c_{n-1}/(4n+1)
+            num = 2 * self.c + self.rest; den = 4 * i + 1
+            self.c -= num // den; self.rest = num % den
+            if self.c < self.c_min: self.c = self.c_min
+        elif i >= self.decel_start:   # 減速：n = -(剩餘步數)，間隔對稱增大
+            num = 2 * self.c + self.rest; den = 4 * (self.total - i) - 1
+            self.c += num // den; self.rest = num % den
+        elif self.cruise_c is not None:
+            self.c = self.cruise_c; self.rest = 0
+        us = self.c >> FP_SHIFT
+        return us if us < MAX_INTERVAL_US else MAX_INTERVAL_US
+
+# --- 3a. 步進馬達驅動類 (由硬體計時器逐步觸發) ---
 class Stepper:
-    def __init__(self, step_pin, dir_pin, ena_pin, is_dm_driver=False):
+    def __init__(self, step_pin, dir_pin, ena_pin, timer_id, is_dm_driver=False):
         self.step_pin_num = step_pin
         self.step = machine.Pin(self.step_pin_num, machine.Pin.OUT)
         self.dir = machine.Pin(dir_pin, machine.Pin.OUT)
@@ -30,7 +78,10 @@ class Stepper:
         if self.use_ena:
             self.ena = machine.Pin(ena_pin, machine.Pin.OUT)
         self.steps_per_mm = 200.0
-        self.pwm = None
+        self.timer = machine.Timer(timer_id)
+        self.gen = StepGenerator()
+        self.done = uasyncio.ThreadSafeFlag()
+        self._on_timer_cb = self._on_timer  # 預先綁定，避免每步配置記憶體
         self.dir.value(0)
         self.step.value(0)
         self.disable()
@@ -40,6 +91,19 @@ class Stepper:
     def disable(self):
         if self.use_ena: self.ena.value(1)
 
+    def _arm(self, interval_us):
+        # 以浮點頻率設定 (ESP32 port 內部換算為計時器週期)；整數除法會使長間隔被捨入 (如 70000us -> 14Hz，>500000us -> 1Hz)
+        self.timer.init(mode=machine.Timer.ONE_SHOT, freq=TIMER_TICK_HZ / interval_us, callback=self._on_timer_cb)
+
+    def _on_timer(self, t):
+        self.step.value(1)
+        time.sleep_us(2)
+        self.step.value(0)
+        gen = self.gen
+        gen.step_no += 1
+        if gen.step_no >= gen.total: self.done.set(); return
+        self._arm(gen.next_interval_us())
+
     async def move_rel(self, distance_mm, speed_mm_s, accel_mm_s2):
         if self.steps_per_mm == 0: return
         total_steps = int(abs(distance_mm) * self.steps_per_mm)
@@ -48,40 +112,18 @@ class Stepper:
         self.enable()
         self.dir.value(1 if distance_mm < 0 else 0)
         
-        max_speed_steps_s = speed_mm_s * self.steps_per_mm
-        accel_steps_s2 = accel_mm_s2 * self.steps_per_mm
-        
-        delays = []
-        accel_steps = int(0.5 * (max_speed_steps_s**2) / accel_steps_s2) if accel_steps_s2 > 0 else 0
-        if total_steps <= 2 * accel_steps: accel_steps = total_steps // 2
-        decel_start_step = total_steps - accel_steps
-        
-        for i in range(total_steps):
-            step_count = i + 1
-            if step_count <= accel_steps:
-                speed = (max_speed_steps_s / accel_steps) * step_count if accel_steps > 0 else max_speed_steps_s
-            elif step_count > decel_start_step:
-                speed = max_speed_steps_s - (max_speed_steps_s / accel_steps) * (step_count - decel_start_step) if accel_steps > 0 else max_speed_steps_s
-            else:
-                speed = max_speed_steps_s
-            
-            if speed > 0:
-                delays.append(1_000_000 // int(speed))
-            else:
-                delays.append(1_000_000)
-        
+        self.gen.reset(total_steps, speed_mm_s * self.steps_per_mm, accel_mm_s2 * self.steps_per_mm)
         print(f"INFO: Moving {distance_mm}mm with acceleration...")
-        for i, delay in enumerate(delays):
-            self.step.value(1)
-            time.sleep_us(2)
-            self.step.value(0)
-            time.sleep_us(max(2, delay))
-            if i % 100 == 0:
-                await uasyncio.sleep_ms(0)
+        self.done.clear()
+        self._arm(self.gen.c >> FP_SHIFT)
+        try:
+            await self.done.wait()   # 步進在計時器回呼中完成，事件迴圈與 TCP 伺服器不受阻塞
+        finally:
+            self.timer.deinit()
 
 # --- 4. 全域變數 ---
 command_queue = AsyncQueue()
-steppers = { 'z': Stepper(Z_STEP_PIN, Z_DIR_PIN, Z_ENA_PIN, is_dm_driver=True), 'a': Stepper(A_STEP_PIN, A_DIR_PIN, A_ENA_PIN, is_dm_driver=True), 'b': Stepper(B_STEP_PIN, B_DIR_PIN, B_ENA_PIN, is_dm_driver=False), 'c': Stepper(C_STEP_PIN, C_DIR_PIN, C_ENA_PIN, is_dm_driver=True) }
+steppers = { 'z': Stepper(Z_STEP_PIN, Z_DIR_PIN, Z_ENA_PIN, 0, is_dm_driver=True), 'a': Stepper(A_STEP_PIN, A_DIR_PIN, A_ENA_PIN, 1, is_dm_driver=True), 'b': Stepper(B_STEP_PIN, B_DIR_PIN, B_ENA_PIN, 2, is_dm_driver=False), 'c': Stepper(C_STEP_PIN, C_DIR_PIN, C_ENA_PIN, 3, is_dm_driver=True) }  # 每軸一個硬體計時器 (ESP32 共 4 個)
 adc = machine.ADC(machine.Pin(LEVEL_SENSOR_PIN)); adc.atten(machine.ADC.ATTN_11DB)
 LEVEL_LOW_THRESHOLD = 1000; LEVEL_HIGH_THRESHOLD = 3000
 level_compensation_enabled = True
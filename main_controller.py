@@ -8,9 +8,10 @@ import zipfile
 import tkinter as tk
 from PIL import Image, ImageTk
 import socket
-from pywinauto.application import Application
 from screeninfo import get_monitors
 import subprocess
+from uia_cache import UIAElementCache, LED_CONTROLS
+from motion_plan import move_seconds, motion_deadline
 
 
 # --- 1. 使用者設定區 ---
@@ -23,6 +24,7 @@ class PrintConfig:
     # Z軸剝離運動參數
     PEEL_LIFT_DISTANCE = 5.05
     PEEL_RETURN_DISTANCE = 5.0
+    Z_RETURN_SPEED = 10.0  # 打印結束回位 (MOVE_ABS) 速度 mm/s
 
     # 曝光參數 (僅用於計算打印時間)
     NORMAL_EXPOSURE_TIME_S = 2.5
@@ -32,6 +34,9 @@ class PrintConfig:
     # 硬體連接設定
     ESP32_IP_ADDRESS = "10.10.17.187"  # 請修改為您 ESP32 的實際 IP
     ESP32_PORT = 8899
+    SOCKET_TIMEOUT = 5.0  # 連接及即時指令 (CONFIG / POS) 的超時
+    # 層間運動的速度由韌體決定 (此腳本未下發)，按最慢的預期設定上限；斷線最遲在此時間後被發現
+    LAYER_MOTION_TIMEOUT_S = 60.0
 
     # 投影儀螢幕索引 (0=主螢幕, 1=第二個螢幕, ...)
     PROJECTOR_MONITOR_INDEX = 1
@@ -46,11 +51,11 @@ class LightEngineGUIControl:
         try:
             window_title = "Full-HD UV LE Controller v2.1"
             print(f"正在連接到已手動設定好的視窗: '{window_title}'...")
-            self.app = Application(backend="uia").connect(title=window_title, timeout=60)
-            self.main_win = self.app.window(title=window_title)
-            self.main_win.wait('ready', timeout=30)
-            self.led_combo = self.main_win.child_window(auto_id="ComboBoxLedEnable")
-            self.set_led_onoff_button = self.main_win.child_window(auto_id="ButtonSetLedOnOff")
+            # 使用 UIA 元素快取，僅在快取校驗失敗時才做完整發現 (連接等待 60s、就緒等待 30s，與原先一致)
+            cache = UIAElementCache(title=window_title, connect_timeout=60)
+            self.app, self.main_win, elements, _ = cache.resolve(LED_CONTROLS, timeout=30)
+            self.led_combo = elements['led_combo']
+            self.set_led_onoff_button = elements['set_button']
             print("成功連接到光機軟體，自動化已準備就緒。")
         except Exception as e:
             print(f"錯誤: 連接到控制軟體失敗。請確認您已手動打開並設定好軟體。 {e}")
@@ -126,9 +131,10 @@ class ProjectorDisplay:
 
 # --- 4. Z軸TCP通訊模組 (同步通訊版) ---
 class ZAxisControl:
-    def __init__(self, host, port, timeout=120):
+    def __init__(self, host, port, timeout=PrintConfig.SOCKET_TIMEOUT):
         self.host = host
         self.port = port
+        self.timeout = timeout
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.settimeout(timeout)
         try:
@@ -140,8 +146,10 @@ class ZAxisControl:
             print(f"錯誤: 無法通過 TCP 連接到 ESP32。 {e}")
             exit()
 
-    def _send_cmd_and_wait_response(self, cmd):
+    def _send_cmd_and_wait_response(self, cmd, timeout=None):
+        """timeout 為本指令的回覆期限 (運動指令按預估時長設定)，預設為連接時的超時"""
         try:
+            self.sock.settimeout(timeout or self.timeout)
             full_cmd = cmd + "\n"
             self.sock.sendall(full_cmd.encode())
             response = self.reader.readline().strip()
@@ -160,7 +168,7 @@ class ZAxisControl:
 
     def move_to_next_layer(self):
         print("發送Z軸運動指令...")
-        response = self._send_cmd_and_wait_response("NEXT_LAYER")
+        response = self._send_cmd_and_wait_response("NEXT_LAYER", PrintConfig.LAYER_MOTION_TIMEOUT_S)
         if "DONE" in response:
             print("Z軸運動完成。")
             return True
@@ -171,7 +179,7 @@ class ZAxisControl:
     def move_relative(self, distance_mm):
         print(f"發送相對移動指令: {distance_mm} mm...")
         cmd = f"MOVE_REL,{distance_mm}"
-        response = self._send_cmd_and_wait_response(cmd)
+        response = self._send_cmd_and_wait_response(cmd, PrintConfig.LAYER_MOTION_TIMEOUT_S)
         if "DONE" in response:
             print("相對移動完成。")
             return True
@@ -179,6 +187,30 @@ class ZAxisControl:
             print(f"相對移動錯誤！響應: {response}")
             return False
 
+    def query_position(self):
+        """讀取韌體的 Z 軸絕對位置 (mm)；舊韌體不支援 POS 時返回 None"""
+        response = self._send_cmd_and_wait_response("POS")
+        if not response.startswith("OK: POS,"):
+            return None
+        for item in response[len("OK: POS,"):].split(','):
+            axis, _, value = item.partition('=')
+            if axis == 'z':
+                return float(value)
+        return None
+
+    def move_absolute(self, position_mm, speed):
+        print(f"發送絕對移動指令: Z -> {position_mm} mm...")
+        current = self.query_position()
+        timeout = (motion_deadline(move_seconds(position_mm - current, speed, speed * 2)) if current is not None
+                   else PrintConfig.LAYER_MOTION_TIMEOUT_S)
+        response = self._send_cmd_and_wait_response(f"MOVE_ABS,z,{position_mm},{speed},{speed * 2}", timeout)
+        if "DONE" in response:
+            print("絕對移動完成。")
+            return True
+        else:
+            print(f"絕對移動錯誤！響應: {response}")
+            return False
+
     def close(self):
         self.sock.close()
         print("TCP 連接已關閉。")
@@ -192,6 +224,7 @@ def main():
     light_engine = None
     print_completed_successfully = False
     total_layers = 0
+    start_z = None
     try:
         print(f"正在從 {config.ZIP_FILE_PATH} 解壓縮文件...")
         if not os.path.exists(config.TEMP_EXTRACT_DIR):
@@ -223,6 +256,9 @@ def main():
         display = ProjectorDisplay(config.PROJECTOR_MONITOR_INDEX)
         display.blank_screen()
         print("\n--- 所有硬體已初始化，準備開始打印 ---")
+        start_z = z_axis.query_position()
+        if start_z is not None:
+            print(f"起始 Z 位置: {start_z} mm (打印結束後按絕對位置回位)")
         start_time = time.time()
         for i, image_path in enumerate(image_paths):
             layer_num = i + 1
@@ -257,10 +293,14 @@ def main():
     finally:
         if print_completed_successfully and z_axis and total_layers > 1:
             print("\n正在執行打印結束後的回位程序...")
-            layer_height = config.PEEL_LIFT_DISTANCE - config.PEEL_RETURN_DISTANCE
-            total_print_height = (total_layers - 1) * layer_height
-            if total_print_height > 0:
-                z_axis.move_relative(-total_print_height)
+            if start_z is not None:
+                # 韌體按實際脈冲計數維護位置，無需由層數反推
+                z_axis.move_absolute(start_z, config.Z_RETURN_SPEED)
+            else:
+                layer_height = config.PEEL_LIFT_DISTANCE - config.PEEL_RETURN_DISTANCE
+                total_print_height = (total_layers - 1) * layer_height
+                if total_print_height > 0:
+                    z_axis.move_relative(-total_print_height)
             z_axis.move_relative(2)
             print("回位程序完成。")
         print("\n正在關閉所有設備...")
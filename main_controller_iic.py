@@ -38,6 +38,8 @@ class PrintConfig:
     # 硬體連接設定
     ESP32_IP_ADDRESS = "10.10.17.187"
     ESP32_PORT = 8899
+    SOCKET_TIMEOUT = 5.0  # 連接及即時指令的超時
+    LAYER_MOTION_TIMEOUT_S = 60.0  # 層間運動速度由韌體決定，按最慢的預期設定上限
 
     # 投影儀螢幕索引 (0=主螢幕, 1=第二個螢幕, ...)
     PROJECTOR_MONITOR_INDEX = 1
@@ -76,16 +78,15 @@ class HybridLightEngineControl:
 
         try:
             # 連接到GUI應用程式
-            from pywinauto.application import Application  # 延後導入
+            from uia_cache import UIAElementCache, CURRENT_CONTROLS  # 延後導入 (內部再導入 pywinauto)
             window_title = "Full-HD UV LE Controller v2.1"
             print(f"正在連接到GUI視窗: '{window_title}'...")
-            self.app = Application(backend="uia").connect(title=window_title, timeout=60)
-            self.main_win = self.app.window(title=window_title)
-            self.main_win.wait('ready', timeout=30)
+            cache = UIAElementCache(title=window_title, connect_timeout=60)
+            self.app, self.main_win, elements, _ = cache.resolve(CURRENT_CONTROLS, timeout=30)
 
             # 獲取設定電流所需的GUI元件
-            self.current_textbox = self.main_win.child_window(auto_id="TextBoxCurrent")
-            self.set_current_button = self.main_win.child_window(auto_id="ButtonSetLedCurrent")
+            self.current_textbox = elements['current_textbox']
+            self.set_current_button = elements['set_current_button']
             print("成功連接到光機GUI軟體。")
         except Exception as e:
             print(f"連接到GUI失敗: {e}")
@@ -211,7 +212,8 @@ class ProjectorDisplay:
 
 
 class ZAxisControl:
-    def __init__(self, host, port, timeout=120):
+    def __init__(self, host, port, timeout=PrintConfig.SOCKET_TIMEOUT):
+        self.timeout = timeout
         try:
             print(f"正在連接到ESP32於 {host}:{port}...")
             self.sock = socket.create_connection((host, port), timeout)
@@ -220,8 +222,9 @@ class ZAxisControl:
         except Exception as e:
             raise ConnectionError(f"無法連接到 ESP32: {e}")
 
-    def _send_cmd_and_wait_response(self, cmd):
+    def _send_cmd_and_wait_response(self, cmd, timeout=None):
         try:
+            self.sock.settimeout(timeout or self.timeout)
             self.sock.sendall((cmd + "\n").encode('utf-8'))
             return self.reader.readline().strip()
         except (socket.timeout, ConnectionResetError) as e:
@@ -234,11 +237,11 @@ class ZAxisControl:
 
     def move_to_next_layer(self):
         print("發送Z軸運動指令...");
-        return "DONE" in self._send_cmd_and_wait_response("NEXT_LAYER")
+        return "DONE" in self._send_cmd_and_wait_response("NEXT_LAYER", PrintConfig.LAYER_MOTION_TIMEOUT_S)
 
     def move_relative(self, distance_mm):
         print(f"發送相對移動指令: {distance_mm} mm...");
-        return "DONE" in self._send_cmd_and_wait_response(f"MOVE_REL,{distance_mm}")
+        return "DONE" in self._send_cmd_and_wait_response(f"MOVE_REL,{distance_mm}", PrintConfig.LAYER_MOTION_TIMEOUT_S)
 
     def close(self):
         self.sock.close(); print("TCP 連接已關閉。")
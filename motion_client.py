@@ -0,0 +1,291 @@
+# motion_client.py
+# 功能：基于 asyncio 的 ESP32 运动控制客户端。
+# 每条指令带上标签 "@<id> "，固件回复时原样带回，因此可以同时有多条指令在途，
+# 回复与异步事件 ("!" 开头的行) 按标签路由到对应的 Future。
+# 支持取消 (CANCEL,<id>) 与逐条指令的截止时间。
+# 连接时协商二进制帧协议 (motion_protocol)，固件不支持时回退到文本行协议；标签即帧的 SEQ 字段。
+# 链路层见 motion_transport：TCP 或串口 (串口固定二进制帧)；有多个候选链路时连接前测量往返时间，选用最快的。
+# 心跳：定时发送 PING (固件高优先级通道，运动进行中也立即回复)，超过 heartbeat_timeout 未收到任何数据
+# 即判定断线，所有在途指令立即失败，而不是等到各自的截止时间。
+
+import asyncio
+import itertools
+import threading
+import traceback
+
+from motion_protocol import (HELLO_COMMAND, REPLY_ID, EVENT_ID, ProtocolError,
+                             encode_command, read_frame, decode_reply)
+from motion_transport import TcpTransport, select_transport
+
+EVENT_PREFIX = "!"
+TAG_PREFIX = "@"
+
+
+class MotionCommandError(Exception):
+    """指令失败 (固件返回 ERROR、连接断开或超时)"""
+
+
+def is_success(response):
+    return response.startswith("OK") or response.startswith("DONE")
+
+
+def split_tag(line):
+    """'@12 DONE' -> (12, 'DONE')；无标签的行返回 (None, line)"""
+    if line.startswith(TAG_PREFIX):
+        head, _, rest = line.partition(" ")
+        try:
+            return int(head[1:]), rest
+        except ValueError:
+            pass
+    return None, line
+
+
+# --- 1. asyncio 客户端 ---
+class AsyncMotionClient:
+    def __init__(self, host, port, connect_timeout=5.0, prefer_binary=True, heartbeat=None, heartbeat_timeout=1.0,
+                 transports=None):
+        self.host = host
+        self.port = port
+        self.transports = transports or [TcpTransport(host, port)]  # 候选链路 (motion_transport)
+        self.transport = self.transports[0]                           # 当前使用的链路
+        self.link_report = None  # 多个候选时的选择结果 [(链路名, rtt_ms 或错误信息)]
+        self.connect_timeout = connect_timeout
+        self.prefer_binary = prefer_binary
+        self.heartbeat = heartbeat                  # 心跳间隔 (s)，None 表示不发送
+        self.heartbeat_timeout = heartbeat_timeout
+        self.binary = False
+        self.reader = None
+        self.writer = None
+        self._tags = itertools.cycle(range(1, 0x10000))  # 二进制帧 SEQ 为 u16
+        self._hello_tag = None
+        self._pending = {}       # tag -> Future
+        self._untagged = []      # 旧固件不带标签回复时按 FIFO 匹配
+        self._event_listeners = []
+        self._read_task = None
+        self._heartbeat_task = None
+        self._last_rx = 0.0      # 最近一次收到数据的时刻 (事件循环时钟)
+        self._write_lock = None
+        self._closed_reason = None
+
+    @property
+    def connected(self):
+        return self.writer is not None and self._closed_reason is None
+
+    async def connect(self):
+        if len(self.transports) > 1:
+            self.transport, self.link_report = await select_transport(
+                self.transports, lambda t: AsyncMotionClient(self.host, self.port, self.connect_timeout,
+                                                             self.prefer_binary, transports=[t]))
+        self.reader, self.writer = await asyncio.wait_for(self.transport.open(), self.connect_timeout)
+        self._closed_reason = None
+        self._write_lock = asyncio.Lock()  # 在所属事件循环内创建 (兼容 Python 3.8)
+        self.binary = self.transport.binary_only
+        self._last_rx = asyncio.get_running_loop().time()
+        self._read_task = asyncio.ensure_future(self._read_loop())
+        if self.prefer_binary and not self.binary: await self._negotiate()
+        # 文本协议的旧固件可能按 FIFO 回复不带标签，高优先级 PING 会打乱对应关系，心跳只在二进制协议下启用
+        if self.heartbeat and self.binary: self._heartbeat_task = asyncio.ensure_future(self._heartbeat_loop())
+
+    async def _negotiate(self):
+        """发送 HELLO；成功则读取协程在收到回复时立即切换到二进制帧"""
+        try:
+            self._hello_tag, future = await self.submit(HELLO_COMMAND, deadline=2.0)
+            response = await future
+            if not self.binary: print(f"固件不支持二进制协议，使用文本协议: {response}")
+        except (asyncio.TimeoutError, MotionCommandError) as e:
+            print(f"二进制协议协商失败，使用文本协议: {e}")
+        finally:
+            self._hello_tag = None
+
+    async def close(self):
+        self._fail_all("连接已关闭")
+        if self._heartbeat_task: self._heartbeat_task.cancel(); self._heartbeat_task = None
+        if self._read_task: self._read_task.cancel()
+        if self.writer:
+            try:
+                self.writer.close(); await self.writer.wait_closed()
+            except Exception:
+                pass
+        self.reader = None; self.writer = None; self._read_task = None
+
+    def add_event_listener(self, callback):
+        """callback(event_line) 在事件循环线程中调用，事件行不含 '!' 前缀"""
+        self._event_listeners.append(callback)
+
+    # --- 指令提交 ---
+    async def submit(self, cmd, deadline=None):
+        """发送指令并立即返回 (tag, Future)；Future 的结果为固件回复字符串"""
+        if not self.connected: raise MotionCommandError(self._closed_reason or "未连接")
+        loop = asyncio.get_running_loop()
+        tag = next(self._tags)
+        future = loop.create_future()
+        self._pending[tag] = future
+        self._untagged.append(tag)
+        if deadline is not None:
+            handle = loop.call_later(deadline, self._expire, tag, cmd, deadline)
+            future.add_done_callback(lambda _f: handle.cancel())
+        future.add_done_callback(lambda f, t=tag: self._on_done(t, f))
+        await self._send(tag, cmd)
+        return tag, future
+
+    async def request(self, cmd, deadline=None):
+        """发送并等待回复，返回 (success, response)，与 MotionController.send_command 一致"""
+        try:
+            _, future = await self.submit(cmd, deadline)
+            response = await future
+            return is_success(response), response
+        except asyncio.TimeoutError:
+            return False, f"命令 '{cmd}' 超时 ({deadline}s)"
+        except MotionCommandError as e:
+            return False, f"命令 '{cmd}' 失败: {e}"
+
+    async def cancel(self, tag):
+        future = self._pending.get(tag)
+        if future and not future.done(): future.cancel()
+
+    async def _send(self, tag, cmd):
+        data = encode_command(cmd, tag) if self.binary else f"{TAG_PREFIX}{tag} {cmd}\n".encode()
+        async with self._write_lock:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    def _expire(self, tag, cmd, deadline):
+        future = self._pending.get(tag)
+        if future and not future.done():
+            future.set_exception(asyncio.TimeoutError(f"命令 '{cmd}' 超过截止时间 {deadline}s"))
+            self._send_cancel(tag)
+
+    def _on_done(self, tag, future):
+        self._pending.pop(tag, None)
+        if tag in self._untagged: self._untagged.remove(tag)
+        if future.cancelled(): self._send_cancel(tag)
+
+    def _send_cancel(self, tag):
+        if self.connected:
+            asyncio.ensure_future(self._send(next(self._tags), f"CANCEL,{tag}"))
+
+    # --- 心跳 ---
+    async def _heartbeat_loop(self):
+        loop = asyncio.get_running_loop(); ping = None
+        try:
+            while self.connected:
+                await asyncio.sleep(self.heartbeat)
+                silent = loop.time() - self._last_rx
+                if silent > self.heartbeat_timeout:
+                    self._link_lost(f"心跳超时: {silent:.2f}s 未收到 ESP32 数据"); return
+                if ping is None or ping.done():  # 上一个 PING 未回复时不重复发送
+                    _, ping = await self.submit("PING")
+                    ping.add_done_callback(lambda f: f.cancelled() or f.exception())  # 结果无人等待
+        except (asyncio.CancelledError, MotionCommandError, OSError):
+            pass
+
+    def _link_lost(self, reason):
+        """判定断线：在途指令立即失败，并中止连接 (不等待 TCP 超时)"""
+        self._fail_all(reason)
+        if self._read_task: self._read_task.cancel()
+        if self.writer: self.writer.transport.abort()
+
+    # --- 回复路由 ---
+    async def _read_loop(self):
+        try:
+            while True:
+                if self.binary: await self._read_binary()
+                else: await self._read_text()
+        except asyncio.CancelledError:
+            pass
+        except asyncio.IncompleteReadError:
+            self._fail_all("读取失败: ESP32 断开连接")
+        except Exception as e:
+            self._fail_all(f"读取失败: {e}")
+
+    async def _read_text(self):
+        data = await self.reader.readline()
+        if not data: raise ConnectionError("ESP32 断开连接")
+        self._last_rx = asyncio.get_running_loop().time()
+        line = data.decode(errors='replace').strip()
+        if not line: return
+        if line.startswith(EVENT_PREFIX):
+            self._dispatch_event(line[1:])
+            return
+        tag, response = split_tag(line)
+        if tag is None and self._untagged: tag = self._untagged[0]
+        if tag is not None and tag == self._hello_tag and response.startswith("OK"):
+            self.binary = True  # 必须在下一次读取之前切换
+        self._resolve(tag, response)
+
+    async def _read_binary(self):
+        try:
+            cmd_id, seq, payload = await read_frame(self.reader)
+        except ProtocolError as e:
+            print(f"警告：丢弃损坏的帧: {e}")
+            return
+        self._last_rx = asyncio.get_running_loop().time()
+        if cmd_id == EVENT_ID: self._dispatch_event(payload.decode(errors='replace'))
+        elif cmd_id == REPLY_ID: self._resolve(seq, decode_reply(payload))
+
+    def _resolve(self, tag, response):
+        future = self._pending.get(tag)
+        if future and not future.done(): future.set_result(response)
+
+    def _dispatch_event(self, event):
+        for callback in list(self._event_listeners):
+            try:
+                callback(event)
+            except Exception:
+                traceback.print_exc()
+
+    def _fail_all(self, reason):
+        self._closed_reason = self._closed_reason or reason  # 保留最先的原因 (如心跳超时)
+        for future in list(self._pending.values()):
+            if not future.done(): future.set_exception(MotionCommandError(reason))
+        self._pending.clear(); self._untagged.clear()
+
+
+# --- 2. 线程桥接：供 QThread / 同步代码使用 ---
+class MotionClientThread:
+    """在后台线程运行事件循环，对外提供线程安全的提交接口 (concurrent.futures.Future)"""
+
+    def __init__(self, host, port, connect_timeout=5.0, heartbeat=None, heartbeat_timeout=1.0, transports=None):
+        self.client = AsyncMotionClient(host, port, connect_timeout, heartbeat=heartbeat, heartbeat_timeout=heartbeat_timeout,
+                                        transports=transports)
+        self.loop = None
+        self._thread = None
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self._thread = threading.Thread(target=run, name="motion-client", daemon=True)
+        self._thread.start()
+        ready.wait()
+        try:
+            self.call(self.client.connect())
+        except Exception:
+            self.stop()
+            raise
+
+    def call(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, cmd, deadline=None):
+        """非阻塞提交，返回 concurrent.futures.Future，结果为 (success, response)"""
+        return asyncio.run_coroutine_threadsafe(self.client.request(cmd, deadline), self.loop)
+
+    def add_event_listener(self, callback):
+        self.loop.call_soon_threadsafe(self.client.add_event_listener, callback)
+
+    def stop(self):
+        if self.loop is None: return
+        try:
+            self.call(self.client.close(), timeout=2)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=2)
+        self.loop = None
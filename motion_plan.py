@@ -0,0 +1,107 @@
+# motion_plan.py
+# 功能：在开始打印前生成整个任务的逐层运动计划，并编码为上传到 ESP32 的指令。
+# 计划按游程压缩：连续参数相同的层合并为一条 (重复次数)，固件端以预分配缓冲区保存，
+# 打印时每层只需发送一条 GO，固件按计划执行并推送进度事件。
+# 另提供运动时长估算，用于按指令参数设定截止时间 (而不是统一的长超时)。
+
+import math
+from collections import namedtuple
+
+PLAN_MAX_ENTRIES = 256  # 与 esp32/main.py 的 PLAN_MAX_ENTRIES 一致
+PLAN_FLAG_WIPE = 0x01
+
+# 距离单位 mm、速度 mm/s；上传时转换为 um / 0.1 mm/s 的整数
+LayerMotion = namedtuple('LayerMotion', 'peel_lift peel_return z_speed_down z_speed_up wipe_fast wipe_slow wipe dwell_ms')
+PlanEntry = namedtuple('PlanEntry', 'repeat motion')
+PLAN_FIELD_MAX = 0xFFFF  # 条目字段均为 u16 (flags 除外)
+
+
+def layer_motion_from_params(params, dwell_ms=1000, wipe=True):
+    """由 GUI 参数字典 (get_params) 得到单层的运动参数"""
+    return LayerMotion(params['peel_lift_z1'], params['peel_return_z2'], params['z_speed_down'],
+                       params['z_speed_up'], params['a_fast_speed'], params['a_slow_speed'], wipe, dwell_ms)
+
+
+def build_motion_plan(layer_motions):
+    """逐层参数列表 -> 游程压缩后的 PlanEntry 列表"""
+    entries = []
+    for motion in layer_motions:
+        if entries and entries[-1].motion == motion and entries[-1].repeat < 0xFFFF:
+            entries[-1] = PlanEntry(entries[-1].repeat + 1, motion)
+        else:
+            entries.append(PlanEntry(1, motion))
+    if len(entries) > PLAN_MAX_ENTRIES:
+        raise ValueError(f"运动计划过大: {len(entries)} 条 (上限 {PLAN_MAX_ENTRIES})")
+    for entry in entries:  # 上传前检查编码范围，避免上传到一半时 struct.error
+        for name, value in zip(PlanEntry._fields[:1] + LayerMotion._fields, _entry_fields(entry)):
+            if not 0 <= value <= PLAN_FIELD_MAX:
+                raise ValueError(f"运动计划参数超出范围: {name}={getattr(entry.motion, name, value)} (编码值 {value} 不在 0..{PLAN_FIELD_MAX})")
+    return entries
+
+
+def _entry_fields(entry):
+    m = entry.motion
+    return [entry.repeat, round(m.peel_lift * 1000), round(m.peel_return * 1000),
+            round(m.z_speed_down * 10), round(m.z_speed_up * 10),
+            round(m.wipe_fast * 10), round(m.wipe_slow * 10),
+            PLAN_FLAG_WIPE if m.wipe else 0, int(m.dwell_ms)]
+
+
+def plan_commands(entries):
+    """PlanEntry 列表 -> [PLAN_BEGIN, PLAN_ENTRY..., PLAN_END] 文本指令 (二进制模式下由 motion_protocol 编码)"""
+    total_layers = sum(e.repeat for e in entries)
+    commands = [f"PLAN_BEGIN,{total_layers},{len(entries)}"]
+    for index, entry in enumerate(entries):
+        commands.append("PLAN_ENTRY," + ",".join(str(v) for v in [index] + _entry_fields(entry)))
+    commands.append("PLAN_END")
+    return commands
+
+
+# --- 运动时长估算 (截止时间) ---
+DEADLINE_FACTOR = 1.5   # 截止时间 = 估算时长 × 系数 + 余量
+DEADLINE_MARGIN_S = 2.0
+LIMIT_SEARCH_TIMEOUT_S = 30.0  # 与 esp32/main.py move_until_trigger 的默认 timeout_ms 一致
+
+
+def move_seconds(distance, speed, accel=0.0):
+    """单段运动时长：accel > 0 为梯形速度曲线 (距离不足时为三角形)，否则恒速"""
+    distance = abs(distance)
+    if distance == 0 or speed <= 0: return 0.0
+    if accel <= 0: return distance / speed
+    if distance >= speed * speed / accel: return distance / speed + speed / accel
+    return 2 * math.sqrt(distance / accel)
+
+
+def _profile_seconds(distance, speed, slow_mm, slow_speed, accel):
+    slow = min(slow_mm, distance) if slow_speed > 0 else 0
+    return move_seconds(distance - slow, speed, accel) + move_seconds(slow, slow_speed)
+
+
+def layer_motion_seconds(params, a_travel_mm):
+    """按参数估算一次层间运动 (NEXT_LAYER / GO) 的时长，步骤与固件 LAYER_SEQUENCE 对应：
+    Z 离层 -> A 擦拭到末端 -> Z 回层 + 停顿，A 归位与其并行 (按全程慢速接近原点估算)"""
+    z_accel = params.get('z_accel', 0); a_accel = params.get('a_accel', 0)
+    z_return = _profile_seconds(params['peel_return_z2'], params['z_speed_up'],
+                                params['z_break_dist'], params['z_break_speed'], z_accel) + 0.1
+    a_wipe = move_seconds(a_travel_mm, params['a_fast_speed'], a_accel) + 0.1
+    z_lift = _profile_seconds(params['peel_lift_z1'], params['z_speed_down'],
+                              params['z_approach_dist'], params['z_approach_speed'], z_accel)
+    a_home = move_seconds(a_travel_mm, params['a_slow_speed']) + 0.1
+    return z_return + a_wipe + max(z_lift + params['peel_dwell_ms'] / 1000, a_home)
+
+
+def motion_deadline(expected_s, factor=DEADLINE_FACTOR, margin_s=DEADLINE_MARGIN_S):
+    return expected_s * factor + margin_s
+
+
+def a_home_recovery_seconds(params):
+    """A 归位恢复路径的最长时长 (固件 step_a_home)：两段式归位的慢速段未触发开关 (超时按预归位距离计算)，
+    改为全程慢速接近并失败一次，重试后才成功 —— 每次接近至多 LIMIT_SEARCH_TIMEOUT_S"""
+    slow_s = (params['a_prehome'] + 2.0) / params['a_slow_speed'] + 0.2 if params['a_slow_speed'] > 0 else 0.0
+    return slow_s + 2 * LIMIT_SEARCH_TIMEOUT_S
+
+
+def layer_motion_deadline(params, a_travel_mm):
+    """层间运动 (NEXT_LAYER / GO) 的截止时间：正常估算按系数放宽，再加上 A 归位恢复的最坏情况，
+    可以成功的恢复不会被当作失败的层"""
+    return motion_deadline(layer_motion_seconds(params, a_travel_mm)) + a_home_recovery_seconds(params)
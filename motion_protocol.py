@@ -0,0 +1,108 @@
+# motion_protocol.py
+# 功能：PC 与 ESP32 之间的二进制帧协议 (与 esp32/main.py 第 6 节保持一致)。
+# 帧格式: SYNC(0xA5) VER CMD SEQ(u16) LEN(u16) PAYLOAD CRC16-CCITT(u16)，小端；CRC 覆盖 VER..PAYLOAD。
+# 连接后先用文本发送 "HELLO,BIN,1"，固件回复 OK 即切换为二进制帧，否则回退到文本协议。
+
+import struct
+
+PROTO_VERSION = 1
+FRAME_SYNC = 0xA5
+HEADER = struct.Struct('<BBHH')  # VER CMD SEQ LEN
+REPLY_ID = 0x80; EVENT_ID = 0xFF; TEXT_ID = 0x7F
+ST_OK, ST_DONE, ST_ERROR = 0, 1, 2
+STATUS_TEXT = {ST_OK: "OK", ST_DONE: "DONE"}
+HELLO_COMMAND = f"HELLO,BIN,{PROTO_VERSION}"
+
+# 指令表: 名称 -> (指令 id, 参数格式)；a=轴名 (u8 字符), f=float32, H=uint16, B=uint8
+COMMAND_SPECS = {
+    'CONFIG_AXIS': (0x01, 'aff'),
+    'CONFIG_Z_PEEL': (0x02, 'ffff'),
+    'CONFIG_A_WIPE': (0x03, 'ff'),
+    'NEXT_LAYER': (0x04, ''),
+    'MOVE_REL': (0x05, 'afff'),
+    'CANCEL': (0x06, 'H'),
+    'PING': (0x07, ''),
+    'PLAN_BEGIN': (0x08, 'HH'),
+    'PLAN_ENTRY': (0x09, 'HHHHHHHHBH'),
+    'PLAN_END': (0x0A, ''),
+    'GO': (0x0B, ''),
+    'CONFIG_INTERLOCK': (0x0C, 'f'),
+    'CONFIG_RAMP': (0x0D, 'afB'),
+    'MOVE_ABS': (0x0E, 'afff'),
+    'POS': (0x0F, ''),
+    'CONFIG_A_LIMIT': (0x10, 'ff'),
+    'CONFIG_Z_PEEL_PROFILE': (0x11, 'ffff'),
+    'STOP': (0x12, ''),
+    'STATUS': (0x13, ''),
+    'CONFIG_LEVEL': (0x14, 'Bfff'),
+    'LEVEL_FF': (0x15, 'f'),
+    'TELEMETRY': (0x16, 'BH'),
+    'TIME': (0x17, ''),
+}
+STRUCTS = {name: struct.Struct('<' + fmt.replace('a', 'B')) for name, (_, fmt) in COMMAND_SPECS.items()}
+
+
+class ProtocolError(Exception):
+    """帧格式或 CRC 错误"""
+
+
+def _crc16_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+CRC_TABLE = _crc16_table()
+
+
+def crc16(data, crc=0xFFFF):
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[((crc >> 8) ^ b) & 0xFF]
+    return crc
+
+
+def encode_frame(cmd_id, seq, payload=b''):
+    header = HEADER.pack(PROTO_VERSION, cmd_id, seq & 0xFFFF, len(payload))
+    crc = crc16(payload, crc16(header))
+    return bytes([FRAME_SYNC]) + header + payload + struct.pack('<H', crc)
+
+
+def encode_command(cmd, seq):
+    """把文本指令 (如 'MOVE_REL,z,1.0,10,20') 编码为二进制帧；不在指令表中的指令以 TEXT 帧透传"""
+    parts = cmd.split(',')
+    name = parts[0].strip().upper()
+    spec = COMMAND_SPECS.get(name)
+    if spec is None or len(parts) - 1 != len(spec[1]):
+        return encode_frame(TEXT_ID, seq, cmd.encode())
+    cmd_id, fmt = spec
+    values = [ord(p.strip().lower()[0]) if f == 'a' else (int(p) if f in 'HB' else float(p))
+              for f, p in zip(fmt, parts[1:])]
+    return encode_frame(cmd_id, seq, STRUCTS[name].pack(*values))
+
+
+async def read_frame(reader):
+    """从 asyncio.StreamReader 读取一帧，返回 (cmd_id, seq, payload)；CRC 错误抛出 ProtocolError"""
+    while (await reader.readexactly(1))[0] != FRAME_SYNC:
+        pass
+    header = await reader.readexactly(HEADER.size)
+    version, cmd_id, seq, length = HEADER.unpack(header)
+    body = await reader.readexactly(length + 2)
+    payload = body[:length]
+    if version != PROTO_VERSION:
+        raise ProtocolError(f"协议版本不匹配: {version}")
+    if crc16(payload, crc16(header)) != struct.unpack('<H', body[length:])[0]:
+        raise ProtocolError(f"CRC 校验失败 (seq={seq})")
+    return cmd_id, seq, payload
+
+
+def decode_reply(payload):
+    """回复帧 -> 与文本协议一致的回复字符串 ('OK' / 'DONE' / 'OK: POS,...' / 'ERROR: ...')；
+    OK/DONE 通常只有状态字节，带数据的回复 (POS / STATUS / TIME) 附带原文"""
+    if not payload: raise ProtocolError("空回复帧")
+    status = payload[0]
+    if status in STATUS_TEXT: return payload[1:].decode(errors='replace') if len(payload) > 1 else STATUS_TEXT[status]
+    return payload[1:].decode(errors='replace') or "ERROR"
@@ -0,0 +1,157 @@
+# motion_transport.py
+# 功能：motion_client 的链路层。TCP (Wi-Fi) 与串口 (USB-UART 转接板，pyserial) 都提供
+# asyncio 风格的 (reader, writer)，其上的帧协议、标签、心跳完全相同。
+# 串口没有连接 / 断开过程，无法靠新连接重置固件的协议协商，因此串口链路固定使用二进制帧。
+# select_transport 并行连接各候选链路并测量 PING 往返时间，选用延迟最低的可用链路。
+
+import asyncio
+import statistics
+import threading
+import time
+
+try:
+    import serial
+
+    PYSERIAL_AVAILABLE = True
+except ImportError:
+    PYSERIAL_AVAILABLE = False
+
+SERIAL_BAUD = 921600  # 与 esp32/main.py 的 SERIAL_BAUD 一致
+
+
+# --- 1. TCP ---
+class TcpTransport:
+    binary_only = False
+
+    def __init__(self, host, port):
+        self.host = host; self.port = port
+
+    @property
+    def name(self):
+        return f"tcp:{self.host}:{self.port}"
+
+    async def open(self):
+        return await asyncio.open_connection(self.host, self.port)
+
+
+# --- 2. 串口 ---
+class _SerialWriter:
+    """StreamWriter 的子集 (write / drain / close / wait_closed / transport.abort)；
+    写入在默认线程池中执行，不阻塞事件循环。motion_client 的写锁保证帧的顺序"""
+
+    def __init__(self, port, stop, reader_thread):
+        self._port = port; self._stop = stop; self._thread = reader_thread; self._buffer = bytearray()
+
+    @property
+    def transport(self):
+        return self  # 供 motion_client 断线时调用 writer.transport.abort()
+
+    def write(self, data):
+        self._buffer += data
+
+    async def drain(self):
+        if not self._buffer: return
+        data = bytes(self._buffer); self._buffer.clear()
+        await asyncio.get_running_loop().run_in_executor(None, self._port.write, data)
+
+    def abort(self):
+        self._stop.set(); self._port.cancel_read()
+
+    def close(self):
+        self.abort()
+
+    async def wait_closed(self):
+        """等读取线程退出 (串口随之关闭)，之后立即重新打开同一串口不会有旧线程抢读数据"""
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join, 1.0)
+
+
+class SerialTransport:
+    binary_only = True
+
+    def __init__(self, port, baudrate=SERIAL_BAUD):
+        self.port = port; self.baudrate = baudrate
+
+    @property
+    def name(self):
+        return f"serial:{self.port}"
+
+    async def open(self):
+        if not PYSERIAL_AVAILABLE: raise ConnectionError("未找到 pyserial 库，请使用 'pip install pyserial' 安装")
+        loop = asyncio.get_running_loop()
+        opening = loop.run_in_executor(None, lambda: serial.Serial(self.port, self.baudrate, timeout=0.05, write_timeout=2.0))
+        try:
+            port = await asyncio.shield(opening)
+        except asyncio.CancelledError:  # 连接超时：打开完成后立即关闭，避免串口被占用
+            opening.add_done_callback(lambda f: f.exception() or f.result().close()); raise
+        except serial.SerialException as e:
+            raise ConnectionError(f"无法打开串口 {self.port}: {e}")
+        port.reset_input_buffer()  # 丢弃打开之前固件发出的数据
+        reader = asyncio.StreamReader(); stop = threading.Event()
+
+        def read():
+            """读取线程：数据交给事件循环；串口关闭或拔出时读取端收到 EOF"""
+            try:
+                while not stop.is_set():
+                    data = port.read(port.in_waiting or 1)
+                    if data: loop.call_soon_threadsafe(reader.feed_data, data)
+                loop.call_soon_threadsafe(reader.feed_eof)
+            except (serial.SerialException, OSError, TypeError):  # 串口被拔出或已关闭
+                try:
+                    loop.call_soon_threadsafe(reader.feed_eof)
+                except RuntimeError:
+                    pass
+            except RuntimeError:
+                pass  # 事件循环已关闭
+            finally:
+                port.close()
+
+        thread = threading.Thread(target=read, name=f"serial-{self.port}", daemon=True)
+        thread.start()
+        return reader, _SerialWriter(port, stop, thread)
+
+
+def make_transports(host, port, serial_port=None, mode='auto', baudrate=SERIAL_BAUD):
+    """按设置生成候选链路：mode 为 'tcp' / 'serial' 时只用该链路，'auto' 时两者都测量 (未设置串口则只有 TCP)"""
+    tcp = TcpTransport(host, port)
+    ser = SerialTransport(serial_port, baudrate) if serial_port else None
+    if mode == 'serial':
+        if ser is None: raise ValueError("未设置串口 (esp32_serial)")
+        return [ser]
+    if mode == 'tcp' or ser is None: return [tcp]
+    return [ser, tcp]
+
+
+# --- 3. 链路选择 ---
+async def measure_rtt(client, probes=10, deadline=1.0):
+    """依次发送 probes 个 PING，返回往返时间列表 (ms)"""
+    samples = []
+    for _ in range(probes):
+        start = time.perf_counter()
+        success, response = await client.request("PING", deadline)
+        if not success: raise ConnectionError(response)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def select_transport(transports, client_factory, probes=5):
+    """并行连接各候选链路并测量 PING 往返时间 (中位数)，返回 (延迟最低的链路, 报告)；
+    报告为 [(链路名, rtt_ms 或错误信息)]。全部不可用时抛出 ConnectionError"""
+    async def probe(transport):
+        client = client_factory(transport)
+        try:
+            await client.connect()
+            return statistics.median(await measure_rtt(client, probes))
+        except Exception as e:
+            return str(e) or type(e).__name__
+        finally:
+            await client.close()
+
+    results = await asyncio.gather(*(probe(t) for t in transports))
+    report = list(zip((t.name for t in transports), results))
+    usable = [(rtt, i) for i, rtt in enumerate(results) if isinstance(rtt, float)]
+    if not usable: raise ConnectionError("; ".join(f"{name}: {r}" for name, r in report))
+    return transports[min(usable)[1]], report
+
+
+def format_report(report):
+    return "，".join(f"{name} {r:.1f}ms" if isinstance(r, float) else f"{name} 不可用 ({r})" for name, r in report)
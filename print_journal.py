@@ -0,0 +1,185 @@
+# print_journal.py
+# 功能：打印日志 (追加写入的 JSON Lines)，记录任务参数、每层曝光结束及层间运动完成后的 Z 位置，
+# 用于 Wi-Fi 断线重连后或控制器崩溃重启后，从最后完成的层继续打印。
+# 打印线程只把记录放入队列；后台线程写入并 fsync (积压的多条记录合并为一次 fsync)，打印循环不等待磁盘。
+# 崩溃时至多丢失最后几条记录：续打前以固件的运动计划进度 (或 Z 位置) 核对 (locate)，丢失的记录不会导致跳层。
+
+import json
+import os
+import queue
+import threading
+import time
+
+from slice_cache import slice_key
+
+JOURNAL_VERSION = 1
+# 续打时沿用当前界面设置的键 (连接、设备、输出目录)；其余打印参数一律取自日志，保证前后一致
+RUNTIME_KEYS = ('esp32_ip', 'esp32_port', 'esp32_serial', 'motion_link', 'controller_exe_path', 'monitor_index', 'temp_dir', 'black_image_path',
+                'trace_dir', 'telemetry', 'telemetry_level_ms', 'metrics_port', 'journal_dir')
+
+
+def _fsync(f):
+    f.flush()
+    (os.fdatasync if hasattr(os, 'fdatasync') else os.fsync)(f.fileno())
+
+
+def read_journal(path):
+    """返回 (header, records)；末行不完整 (写入中途崩溃) 时忽略该行"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    records = []
+    for n, line in enumerate(lines):
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            if n < len(lines) - 1: raise ValueError(f"打印日志第 {n + 1} 行损坏: {path}")
+    if not records or records[0].get('type') != 'start' or records[0].get('version') != JOURNAL_VERSION:
+        raise ValueError(f"不是有效的打印日志: {path}")
+    return records[0], records[1:]
+
+
+def latest_unfinished(directory):
+    """最近一个没有结束记录的日志 (可续打)，没有时返回 None"""
+    try:
+        paths = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.jsonl')]
+    except OSError:
+        return None
+    for path in sorted(paths, key=os.path.getmtime, reverse=True):
+        try:
+            _, records = read_journal(path)
+        except (OSError, ValueError):
+            continue
+        if not any(r['type'] == 'end' for r in records): return path
+    return None
+
+
+def resume_params(header, current):
+    """续打参数：打印参数取自日志，RUNTIME_KEYS 取当前设置"""
+    params = dict(header['params'])
+    params.update({k: current[k] for k in RUNTIME_KEYS if k in current})
+    params['zip_path'] = header['zip_path']
+    return params
+
+
+class PrintJournal:
+    """记录类型 (每条另有 't' 为 time.time())：
+    start   {version, zip_path, slice_key, layers, z0, z_step, params}  第 1 层曝光位置 z0，每层 Z 净移动 z_step
+    plan    {base, motions}  已上传运动计划：固件执行的第 k 次 GO 是第 base + k 层之后的层间运动
+    exposed {layer}      该层曝光结束 (LED 已关)
+    layer   {layer, z}   该层之后的层间运动完成，z 为固件报告的位置 (查询失败时为 None)
+    resume  {layer, reason}
+    end     {success, msg}  完成或用户终止，此后不再续打"""
+
+    def __init__(self, path, header, records=()):
+        self.path = path; self.header = header
+        self.exposed = 0; self.done = 0  # 最后曝光的层 / 最后完成层间运动的层
+        self.plan = None                 # (base, motions)
+        self._z = {0: header['z0']}      # 层号 -> 该层之后运动完成的 Z
+        for record in records: self._apply(record)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, name="print-journal", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def create(cls, directory, zip_path, layers, z0, z_step, params):
+        os.makedirs(directory, exist_ok=True)
+        name = f"{os.path.splitext(os.path.basename(zip_path))[0]}_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+        path = os.path.join(directory, name)
+        header = {'type': 'start', 'version': JOURNAL_VERSION, 't': time.time(), 'zip_path': os.path.abspath(zip_path),
+                  'slice_key': slice_key(zip_path), 'layers': layers, 'z0': z0, 'z_step': z_step, 'params': params}
+        with open(path, 'x', encoding='utf-8') as f:  # 任务头同步落盘
+            f.write(json.dumps(header, ensure_ascii=False, default=str) + "\n"); _fsync(f)
+        return cls(path, header)
+
+    @classmethod
+    def open(cls, path):
+        """打开未结束的日志以续打；切片包在此期间被修改或任务已结束时抛出 ValueError"""
+        header, records = read_journal(path)
+        if any(r['type'] == 'end' for r in records): raise ValueError(f"任务已结束，无法续打: {path}")
+        try:
+            key = slice_key(header['zip_path'])
+        except OSError as e:
+            raise ValueError(f"切片包不可用: {e}")
+        if key != header['slice_key']: raise ValueError(f"切片包在中断后已被修改: {header['zip_path']}")
+        return cls(path, header, records)
+
+    # --- 1. 记录 ---
+    def planned(self, base, motions):
+        self._record('plan', base=base, motions=motions)
+
+    def exposed_layer(self, layer):
+        self._record('exposed', layer=layer)
+
+    def layer_done(self, layer, z):
+        """可在任意线程调用 (如 POS 回复的回调)"""
+        self._record('layer', layer=layer, z=z)
+
+    def resumed(self, layer, reason):
+        self._record('resume', layer=layer, reason=reason)
+
+    def finish(self, success, msg):
+        self._record('end', success=success, msg=msg)
+
+    def close(self):
+        """写完队列中的记录后关闭"""
+        if self._thread is None: return
+        self._queue.put(None); self._thread.join(); self._thread = None
+        self._file.close()
+
+    def _record(self, kind, **fields):
+        record = dict(type=kind, t=time.time(), **fields)
+        self._apply(record); self._queue.put(record)
+
+    def _apply(self, record):
+        if record['type'] == 'plan': self.plan = (record['base'], record['motions'])
+        elif record['type'] == 'exposed': self.exposed = max(self.exposed, record['layer'])
+        elif record['type'] == 'layer':
+            self.done = max(self.done, record['layer'])
+            if record['z'] is not None: self._z[record['layer']] = record['z']
+
+    def _writer(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch if r is not None)
+            if lines:
+                try:
+                    self._file.write(lines); _fsync(self._file)
+                except OSError as e:
+                    print(f"警告：写入打印日志失败: {e}")
+            if batch[-1] is None: return
+
+    # --- 2. 续打定位 ---
+    def expected_z(self, layer):
+        """第 layer 层之后运动完成的 Z：取最近一条有位置的记录，再按每层净移动外推"""
+        known = max(n for n in self._z if n <= layer)
+        return self._z[known] + (layer - known) * self.header['z_step']
+
+    def locate(self, z, plan_progress=None):
+        """固件空闲时判断进度，返回 (下一层层号, 是否需先补做一次层间运动)。
+        plan_progress 为 STATUS 报告的 (已执行 GO 数, 计划总数)，与日志中的计划一致时据此确定运动完成到哪一层；
+        否则 (逐层 NEXT_LAYER、计划已清除) 按 Z 位置判断：停在最后完成运动的位置或再高一层。
+        断线 / 崩溃期间完成的运动补写记录；与日志矛盾 (固件重启、平台被移动) 时抛出 ValueError"""
+        if plan_progress and self.plan and plan_progress[1] == self.plan[1]:
+            moved = self.plan[0] + plan_progress[0]
+            source = f"固件计划进度 {plan_progress[0]}/{plan_progress[1]}"
+        else:
+            step = self.header['z_step']; tol = max(abs(step) / 4, 0.002); base = self.expected_z(self.done)
+            if abs(z - base) <= tol: moved = self.done
+            elif abs(z - (base + step)) <= tol: moved = self.done + 1
+            else:
+                raise ValueError(f"Z={z:.4f} 与打印日志不符 (第 {self.done} 层之后应为 {base:.4f})，"
+                                 f"固件可能已重启或平台被移动，请手动处理")
+            source = f"Z={z:.4f}"
+        if not (self.done <= moved and self.exposed - 1 <= moved <= self.exposed + 1) or moved >= self.header['layers']:
+            raise ValueError(f"{source} 与打印日志 (已曝光 {self.exposed} 层，运动完成至第 {self.done} 层) 不符，请手动处理")
+        if moved > self.done:  # 运动在断线 / 崩溃期间完成，补写记录
+            if moved > self.exposed: self.exposed_layer(moved)
+            self.layer_done(moved, z)
+        if self.exposed > moved: return moved + 2, self.exposed < self.header['layers']
+        return moved + 1, False
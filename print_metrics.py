@@ -0,0 +1,217 @@
+# print_metrics.py
+# 功能：打印过程指标 (计数器 / 仪表 / 直方图)，以 Prometheus 文本格式经本地 HTTP 提供。
+# 数据来自 layer_trace.Tracer 的 span 回调：每个 span 按名称查表后做一次常数时间更新 (直方图桶数固定)，
+# 更新路径不加锁；HTTP 服务运行在后台线程，抓取时只读取当前数值，不会阻塞打印循环。
+# 用法: registry = REGISTRY; tracer.add_listener(TraceMetrics(registry, printer).on_span); MetricsServer(registry).start()
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def _num(value):
+    return "+Inf" if value == float('inf') else repr(float(value))
+
+
+# --- 1. 指标类型 ---
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name; self.doc = doc; self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None: child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()): lines += self._render_child(values, child)
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+    def __init__(self): self.value = 0.0
+
+
+class Counter(_Metric):
+    kind = 'counter'
+    _new_child = _Value
+
+    def inc(self, *labels, amount=1.0):
+        self.labels(*labels).value += amount
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_labels(self.labelnames, values)} {_num(child.value)}"]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        self.labels(*labels).value = value
+
+
+class _Buckets:
+    __slots__ = ('counts', 'sum', 'count')
+    def __init__(self, n): self.counts = [0] * n; self.sum = 0.0; self.count = 0
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, buckets, labelnames=()):
+        super().__init__(name, doc, labelnames)
+        self.bounds = sorted(buckets) + [float('inf')]
+
+    def _new_child(self):
+        return _Buckets(len(self.bounds))
+
+    def observe(self, value, *labels):
+        child = self.labels(*labels)
+        child.counts[bisect.bisect_left(self.bounds, value)] += 1  # 只记录所在桶，导出时再累加
+        child.sum += value; child.count += 1
+
+    def _render_child(self, values, child):
+        lines = []; total = 0
+        for bound, n in zip(self.bounds, list(child.counts)):
+            total += n
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, ('le', _num(bound)))} {total}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_num(child.sum)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()  # 只保护注册，不参与更新
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None: metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, doc, labelnames=()): return self._register(Counter, name, doc, labelnames)
+    def gauge(self, name, doc, labelnames=()): return self._register(Gauge, name, doc, labelnames)
+    def histogram(self, name, doc, buckets, labelnames=()): return self._register(Histogram, name, doc, buckets, labelnames)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()): lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+# --- 2. 由时间线 span 更新指标 ---
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+MOTION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0)
+CYCLE_BUCKETS = (1.0, 2.0, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 120.0)
+EXPOSURE_ERROR_BUCKETS = (-0.05, -0.01, -0.005, 0.0, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+
+
+class TraceMetrics:
+    """Tracer 监听器：span 名称 -> 指标。printer 标签区分同一进程内的多台打印机"""
+
+    def __init__(self, registry=REGISTRY, printer="printer"):
+        self.printer = printer
+        r = registry
+        self.layers = r.counter('kkdlp_layers_total', "已完成的层数", ('printer',))
+        self.cycle = r.histogram('kkdlp_layer_cycle_seconds', "单层周期 (显示到层间运动完成)", CYCLE_BUCKETS, ('printer',))
+        self.exposure_error = r.histogram('kkdlp_exposure_error_seconds', "实际曝光时长 - 目标时长",
+                                          EXPOSURE_ERROR_BUCKETS, ('printer',))
+        self.motion = r.histogram('kkdlp_motion_seconds', "固件层间子步骤耗时", MOTION_BUCKETS, ('printer', 'axis', 'step'))
+        self.layer_motion = r.histogram('kkdlp_layer_motion_seconds', "层间运动 (提交到完成)", MOTION_BUCKETS, ('printer',))
+        self.projector = r.histogram('kkdlp_projector_latency_seconds', "投影指令耗时", LATENCY_BUCKETS, ('printer', 'op'))
+        self.led = r.histogram('kkdlp_led_latency_seconds', "光机 LED 操作耗时", LATENCY_BUCKETS, ('printer', 'op'))
+        self.connects = r.counter('kkdlp_motion_connects_total', "与 ESP32 的连接尝试次数 (失败计入 kkdlp_phase_errors_total)", ('printer',))
+        self.reconnects = r.counter('kkdlp_motion_reconnects_total', "打印中断线重连的次数", ('printer',))
+        self.errors = r.counter('kkdlp_phase_errors_total', "以异常结束的阶段", ('printer', 'phase'))
+        self.level = r.gauge('kkdlp_resin_level_adc', "液位传感器读数 (固件遥测)", ('printer',))
+        self.last_layer = r.gauge('kkdlp_current_layer', "最近完成的层号", ('printer',))
+        self._by_name = {
+            'layer': self._on_layer, 'exposure': self._on_exposure, 'layer_motion': self._on_layer_motion,
+            'projector_present': self._on_projector, 'projector_black': self._on_projector, 'frame_fetch': self._on_projector,
+            'led_on': self._on_led, 'led_off': self._on_led, 'led_arm': self._on_led,
+            'motion_connect': self._on_connect, 'motion_reconnect': self._on_reconnect,
+            'resin_level': self._on_level,
+        }
+
+    def on_span(self, name, cat, track, start_ns, dur_ns, args):
+        if args and 'error' in args: self.errors.inc(self.printer, name)
+        handler = self._by_name.get(name)
+        if handler is not None: handler(name, dur_ns / 1e9, args)
+        elif cat == 'firmware': self.motion.observe(dur_ns / 1e9, self.printer, name[0].lower(), name)
+
+    def _on_layer(self, name, seconds, args):
+        self.layers.inc(self.printer); self.cycle.observe(seconds, self.printer)
+        if args: self.last_layer.set(args.get('layer', 0), self.printer)
+
+    def _on_exposure(self, name, seconds, args):
+        if args and 'target_s' in args: self.exposure_error.observe(seconds - args['target_s'], self.printer)
+
+    def _on_layer_motion(self, name, seconds, args):
+        self.layer_motion.observe(seconds, self.printer)
+
+    def _on_projector(self, name, seconds, args):
+        self.projector.observe(seconds, self.printer, name)
+
+    def _on_led(self, name, seconds, args):
+        self.led.observe(seconds, self.printer, name)
+
+    def _on_connect(self, name, seconds, args):
+        self.connects.inc(self.printer)
+
+    def _on_reconnect(self, name, seconds, args):
+        self.reconnects.inc(self.printer)
+
+    def _on_level(self, name, seconds, args):
+        self.level.set(args['adc'], self.printer)
+
+
+# --- 3. HTTP 服务 (后台线程) ---
+class MetricsServer:
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=9108):
+        self.registry = registry; self.host = host; self.port = port
+        self._httpd = None; self._thread = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'): self.send_error(404); return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers(); self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 不把每次抓取写入日志
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]  # port=0 时为实际分配的端口
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        return self.host, self.port
+
+    def stop(self):
+        if self._httpd is None: return
+        self._httpd.shutdown(); self._httpd.server_close(); self._httpd = None
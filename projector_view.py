@@ -63,6 +63,10 @@ class ProjectorWindow(QWidget):
         self.image_label.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.image_label)
 
+        # 後台緩衝：預載下一層切片，收到 present 指令時才切換到螢幕上
+        self.back_buffer = None
+        self.back_path = None
+
         # 初始為黑畫面
         self.show_blank()
 
@@ -72,6 +76,26 @@ class ProjectorWindow(QWidget):
         self.image_label.setPixmap(pixmap)
         print(f"[Projector] Displaying image: {image_path}")
 
+    def preload_image(self, image_path):
+        """解碼圖片到後台緩衝，不改變目前顯示的畫面"""
+        pixmap = QPixmap(image_path)
+        if pixmap.isNull():
+            print(f"[Projector] Preload failed: {image_path}")
+            self.back_buffer = None; self.back_path = None
+            return
+        self.back_buffer = pixmap
+        self.back_path = image_path
+        print(f"[Projector] Preloaded image: {image_path}")
+
+    def present(self):
+        """將後台緩衝中的圖片切換到螢幕上"""
+        if self.back_buffer is None:
+            print("[Projector] Present requested but back buffer is empty.")
+            return
+        self.image_label.setPixmap(self.back_buffer)
+        print(f"[Projector] Presenting image: {self.back_path}")
+        self.back_buffer = None; self.back_path = None
+
     def show_blank(self):
         """顯示黑畫面"""
         # 清除圖片即可，因為背景是黑的
@@ -117,6 +141,8 @@ if __name__ == '__main__':
     command_listener.command_received.connect(
         lambda msg: {
             'show': lambda: window.show_image(msg['path']),
+            'preload': lambda: window.preload_image(msg['path']),
+            'present': window.present,
             'blank': window.show_blank,
             'close': app.quit
         }.get(msg.get('command'), lambda: print(f"Unknown command: {msg}"))()
@@ -0,0 +1,130 @@
+# slice_cache.py
+# 功能：多台打印机共享的切片缓存。
+# 同一切片包 (按绝对路径 + 大小 + 修改时间识别) 只解压、校验一次，结果由所有打印该任务的机器共用；
+# 逐层亮像素统计 (液位前馈用) 按层在需要时于共享的解码进程池中完成 (与层间运动重叠)，不占用事件循环，也不受 GIL 限制；
+# 结果按层缓存，打印同一任务的机器共用。
+# 缓存目录跨进程复用：解压先写入 .part 目录，完成后原子改名。
+
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "kkdlp_slice_cache")
+
+
+def _lit_pixels(path):
+    """解码进程池中执行：切片中亮像素 (>=128) 的数量"""
+    from PIL import Image
+    with Image.open(path) as img:
+        return sum(img.convert('L').histogram()[128:])
+
+
+def slice_key(zip_path):
+    st = os.stat(zip_path)
+    ident = f"{os.path.abspath(zip_path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(ident.encode()).hexdigest()[:16]
+
+
+def list_slices(directory):
+    """数字.png 按层号排序；没有有效切片时抛出 ValueError"""
+    names = [f for f in os.listdir(directory) if f.endswith('.png') and os.path.splitext(f)[0].isdigit()]
+    if not names: raise ValueError("未在压缩包中找到有效的切片文件 (数字.png)")
+    return [os.path.join(directory, f) for f in sorted(names, key=lambda x: int(os.path.splitext(x)[0]))]
+
+
+class SliceSet:
+    """一个切片包的解压结果；lit_pixels 为逐层亮像素统计的 Future 列表 (None 表示该层未统计)，由 SliceCache.lit_pixels 按需填充"""
+    __slots__ = ('key', 'zip_path', 'directory', 'image_paths', 'lit_pixels')
+
+    def __init__(self, key, zip_path, directory, image_paths):
+        self.key = key; self.zip_path = zip_path; self.directory = directory
+        self.image_paths = image_paths; self.lit_pixels = None
+
+    @property
+    def layers(self):
+        return len(self.image_paths)
+
+
+class SliceCache:
+    """acquire() / release() 成对使用；同一切片包的并发请求共享一次加载。
+    只在单个事件循环中使用；解压在默认线程池，逐层像素统计在进程池 (decode_workers 个进程)"""
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, decode_workers=None, max_entries=8):
+        self.root = root
+        self.decode_workers = decode_workers
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # key -> SliceSet (按最近使用排序)
+        self._loading = {}                         # key -> Future (正在解压)
+        self._refs = collections.Counter()
+        self._pool = None
+
+    async def acquire(self, zip_path):
+        key = slice_key(zip_path)
+        while key in self._loading: await asyncio.wait([self._loading[key]])  # 失败时由本请求重新加载
+        slices = self._entries.get(key)
+        if slices is None:
+            future = self._loading[key] = asyncio.get_running_loop().create_future()
+            try:
+                slices = self._entries[key] = await self._extract(key, zip_path)
+                future.set_result(None)
+            except BaseException as e:
+                future.set_exception(e); future.exception()  # 标记为已取回，异常只由本请求抛出
+                raise
+            finally:
+                del self._loading[key]
+        self._entries.move_to_end(key); self._refs[key] += 1
+        self._evict()
+        return slices
+
+    def release(self, slices):
+        self._refs[slices.key] -= 1
+        if self._refs[slices.key] <= 0: del self._refs[slices.key]
+        self._evict()
+
+    def close(self):
+        if self._pool is not None: self._pool.shutdown(wait=False); self._pool = None
+
+    async def _extract(self, key, zip_path):
+        directory = os.path.join(self.root, key)
+
+        def extract():
+            if not os.path.isdir(directory):
+                partial = directory + f".{os.getpid()}.part"
+                shutil.rmtree(partial, ignore_errors=True)
+                with zipfile.ZipFile(zip_path, 'r') as zip_ref: zip_ref.extractall(partial)
+                try:
+                    os.replace(partial, directory)
+                except OSError:
+                    shutil.rmtree(partial, ignore_errors=True)  # 其他进程已先完成
+            return list_slices(directory)
+
+        image_paths = await asyncio.get_running_loop().run_in_executor(None, extract)
+        return SliceSet(key, zip_path, directory, image_paths)
+
+    async def lit_pixels(self, slices, index):
+        """第 index 层的亮像素数。首次请求时在进程池中统计 (调用方在层间运动期间请求，不推迟开始打印)；
+        进行中的统计与结果由同一切片包的所有请求共享，统计失败的层下次重新统计"""
+        if slices.lit_pixels is None: slices.lit_pixels = [None] * slices.layers
+        future = slices.lit_pixels[index]
+        if future is None:
+            if self._pool is None: self._pool = concurrent.futures.ProcessPoolExecutor(self.decode_workers)
+            future = slices.lit_pixels[index] = asyncio.get_running_loop().run_in_executor(
+                self._pool, _lit_pixels, slices.image_paths[index])
+        try:
+            return await asyncio.shield(future)  # 一台机器取消等待不影响其他机器
+        except Exception:
+            if slices.lit_pixels[index] is future: slices.lit_pixels[index] = None
+            raise
+
+    def _evict(self):
+        """超出容量时删除最久未用且无人使用的条目 (及其解压目录)"""
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries: break
+            if self._refs[key] > 0: continue
+            slices = self._entries.pop(key)
+            shutil.rmtree(slices.directory, ignore_errors=True)
@@ -0,0 +1,157 @@
+# uia_cache.py
+# 功能：缓存光引擎软件的 UIA 元素解析结果 (窗口句柄 + 控件路径)。
+# 由 inspect_light_engine.py 一次性检查生成缓存；之后每次连接只做快速校验，
+# 仅在校验不匹配时才回退到完整的窗口发现流程 (connect timeout / wait('ready'))。
+
+import os
+import json
+import time
+
+LIGHT_ENGINE_TITLE = "Full-HD UV LE Controller v2.1"
+CACHE_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "light_engine_uia_cache.json")
+CACHE_VERSION = 1
+
+# 名称 -> auto_id，各控制脚本按需取子集
+LED_CONTROLS = {'led_combo': "ComboBoxLedEnable", 'set_button': "ButtonSetLedOnOff"}
+CURRENT_CONTROLS = {'current_textbox': "TextBoxCurrent", 'set_current_button': "ButtonSetLedCurrent"}
+
+
+class UIAElementCache:
+    """持久化的 UIA 元素缓存，resolve() 返回 (app, main_win, elements, source)"""
+
+    def __init__(self, title=LIGHT_ENGINE_TITLE, cache_path=CACHE_FILE_PATH, connect_timeout=5):
+        self.title = title
+        self.connect_timeout = connect_timeout  # 完整发现时等待光引擎窗口出现的时间 (s)
+        self.cache_path = cache_path
+        self.data = self._load()
+
+    # --- 1. 缓存文件读写 ---
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION and data.get('title') == self.title:
+                return data
+        except (OSError, ValueError):
+            pass
+        return {'version': CACHE_VERSION, 'title': self.title, 'handle': None, 'process_id': None, 'controls': {}}
+
+    def save(self):
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"警告：无法写入 UIA 缓存 {self.cache_path}: {e}")
+
+    def invalidate(self):
+        self.data['handle'] = None; self.data['process_id'] = None; self.data['controls'] = {}
+        self.save()
+
+    # --- 2. 控件路径 (从主窗口起逐级的 (control_type, 同类型子项序号)) ---
+    @staticmethod
+    def _path_of(element, root):
+        path = []
+        root_id = root.element_info.runtime_id
+        current = element
+        while current is not None and current.element_info.runtime_id != root_id:
+            parent = current.parent()
+            if parent is None: return None
+            control_type = current.element_info.control_type
+            siblings = parent.children(control_type=control_type)
+            index = next((i for i, s in enumerate(siblings) if s.element_info.runtime_id == current.element_info.runtime_id), None)
+            if index is None: return None
+            path.append([control_type, index])
+            current = parent
+        return list(reversed(path))
+
+    @staticmethod
+    def _walk(root, path):
+        element = root
+        for control_type, index in path:
+            children = element.children(control_type=control_type)
+            if index >= len(children): return None
+            element = children[index]
+        return element
+
+    # --- 3. 快速路径：句柄 + 路径校验 ---
+    def _attach_cached_window(self, Application):
+        handle = self.data.get('handle')
+        if not handle: return None, None
+        try:
+            app = Application(backend="uia").connect(handle=handle, timeout=0.5)
+            main_win = app.window(handle=handle)
+            wrapper = main_win.wrapper_object()
+            if wrapper.window_text() != self.title or not wrapper.is_enabled(): return None, None
+            return app, main_win
+        except Exception:
+            return None, None
+
+    def _resolve_cached_controls(self, main_win, controls):
+        cached = self.data.get('controls', {})
+        elements = {}
+        try:
+            root = main_win.wrapper_object()
+            for name, auto_id in controls.items():
+                entry = cached.get(auto_id)
+                if not entry: return None
+                element = self._walk(root, entry['path'])
+                if element is None or element.element_info.automation_id != auto_id: return None
+                elements[name] = element
+        except Exception:
+            return None
+        return elements
+
+    # --- 4. 完整发现 (慢路径) ---
+    def _discover(self, Application, controls, exe_path, timeout):
+        try:
+            app = Application(backend="uia").connect(title=self.title, timeout=self.connect_timeout)
+        except Exception:
+            if not exe_path: raise
+            print(f"未找到光引擎实例，尝试启动: {exe_path}")
+            if not os.path.exists(exe_path): raise FileNotFoundError(f"光引擎 EXE 未找到: {exe_path}")
+            app = Application(backend="uia").start(exe_path)
+        main_win = app.window(title=self.title)
+        main_win.wait('ready', timeout=timeout)
+        elements = self.inspect(main_win, controls)
+        return app, main_win, elements
+
+    def inspect(self, main_win, controls):
+        """对主窗口做一次完整解析，并把句柄和控件路径写入缓存"""
+        root = main_win.wrapper_object()
+        elements = {}
+        self.data['handle'] = root.handle
+        self.data['process_id'] = root.process_id()
+        for name, auto_id in controls.items():
+            element = main_win.child_window(auto_id=auto_id).wrapper_object()
+            path = self._path_of(element, root)
+            if path is not None:
+                self.data['controls'][auto_id] = {'name': name, 'control_type': element.element_info.control_type, 'path': path}
+            elements[name] = element
+        self.data['inspected_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.save()
+        return elements
+
+    def resolve(self, controls, exe_path=None, timeout=10):
+        from pywinauto.application import Application  # 延后导入
+        start = time.perf_counter()
+        app, main_win = self._attach_cached_window(Application)
+        source = "cache"
+        if app is None:
+            # 进程可能已重启：句柄失效但控件路径通常仍然有效
+            try:
+                app = Application(backend="uia").connect(title=self.title, timeout=0.5)
+                main_win = app.window(title=self.title)
+                self.data['handle'] = main_win.wrapper_object().handle
+                source = "path"
+            except Exception:
+                app = None
+        elements = self._resolve_cached_controls(main_win, controls) if app is not None else None
+        if elements is None:
+            app, main_win, elements = self._discover(Application, controls, exe_path, timeout)
+            source = "discovery"
+        elif source == "path":
+            self.save()
+        print(f"UIA 元素解析完成 ({source}, {time.perf_counter() - start:.2f}s)")
+        return app, main_win, elements, source